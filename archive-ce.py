@@ -1,49 +1,10 @@
-# Get a list of all IDs in the CE and download each node as json-ld
+# Download every node in the CE as JSON-LD into a directory of compressed shards.
+# Equivalent to `trompace archive <directory>`, see trompace/archive.py. Run again to resume.
 import datetime
-import json
-import os
-
-import requests
-
-from trompace.config import config
-from trompace import connection
-
-
-def download_ids(ids):
-    outdir = f"cearchive-{datetime.date.today().isoformat()}"
-    host = config.host
-    os.makedirs(outdir, exist_ok=True)
-    total = len(ids)
-    for i, id_ in enumerate(ids, 1):
-        outname = os.path.join(outdir, f"{id_}.json")
-        if os.path.exists(outname):
-            continue
-        print(f"{i}/{total}")
-        print(id_)
-        r = requests.get(host + "/" + id_, headers={"Accept": "application/ld+json"})
-        try:
-            resp = r.json()
-            with open(outname, "w") as fp:
-                json.dump(resp, fp, indent=2)
-        except ValueError:
-            print(r.content)
-
-
-def get_ids():
-    query = """
-    query {
-  ThingInterface {
-    identifier
-  }
-}
-    """
-    response = connection.submit_query(query)
-    data = response["data"]["ThingInterface"]
-    ids = [i["identifier"] for i in data]
-    return ids
+import sys
 
+from trompace.__main__ import main
 
 if __name__ == '__main__':
-    config.load()
-    ids = get_ids()
-    download_ids(ids)
+    directory = sys.argv[1] if len(sys.argv) > 1 else f"cearchive-{datetime.date.today().isoformat()}"
+    sys.exit(main(["archive", directory] + sys.argv[2:]))
@@ -0,0 +1,69 @@
+"""Microbenchmark of compiled mutation templates.
+
+Compares generating mutations with the compiled templates used by trompace.mutations.templates against
+interpreting the template for each mutation (make_parameters followed by two str.format calls).
+
+Run from the root of the repository with:
+
+    python -m benchmarks.bench_templates
+"""
+import argparse
+import timeit
+
+from trompace import make_parameters
+from trompace.mutations import MUTATION, person
+from trompace.mutations.templates import MUTATION_TEMPLATE, format_mutation
+
+
+PERSON_ARGS = {
+    "title": "Gustav Mahler - MusicBrainz",
+    "contributor": "https://musicbrainz.org",
+    "creator": "https://github.com/trompamusic/trompa-ce-client/tree/v0.1/demo",
+    "source": "https://musicbrainz.org/artist/8d610e51-64b4-4654-b8df-064b0fb7a9d9",
+    "format": "text/html",
+    "name": "Gustav Mahler",
+    "familyName": "Mahler",
+    "givenName": "Gustav",
+}
+
+
+def interpreted_mutation(mutationname, args):
+    formatted_mutation = MUTATION_TEMPLATE.format(mutationname=mutationname, parameters=make_parameters(**args))
+    return MUTATION.format(mutation=formatted_mutation)
+
+
+def compiled_mutation(mutationname, args):
+    return format_mutation(mutationname, args)
+
+
+def person_builder():
+    return person.mutation_create_person(
+        title="Gustav Mahler - MusicBrainz", contributor="https://musicbrainz.org",
+        creator="https://github.com/trompamusic/trompa-ce-client/tree/v0.1/demo",
+        source="https://musicbrainz.org/artist/8d610e51-64b4-4654-b8df-064b0fb7a9d9",
+        format_="text/html", name="Gustav Mahler", family_name="Mahler", given_name="Gustav",
+        birth_date="1860-07-07", language="en")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--number", type=int, default=100000, help="Number of mutations to generate")
+    args = parser.parse_args()
+
+    assert interpreted_mutation("CreatePerson", PERSON_ARGS) == compiled_mutation("CreatePerson", PERSON_ARGS)
+
+    timings = {
+        "interpreted template": timeit.timeit(lambda: interpreted_mutation("CreatePerson", PERSON_ARGS),
+                                              number=args.number),
+        "compiled template": timeit.timeit(lambda: compiled_mutation("CreatePerson", PERSON_ARGS),
+                                           number=args.number),
+        "mutation_create_person": timeit.timeit(person_builder, number=args.number),
+    }
+    for name, seconds in timings.items():
+        print(f"{name:>24}: {seconds:.3f}s for {args.number} mutations ({seconds / args.number * 1e6:.2f}us each)")
+    speedup = timings["interpreted template"] / timings["compiled template"]
+    print(f"compiled templates are {speedup:.1f}x faster")
+
+
+if __name__ == '__main__':
+    main()
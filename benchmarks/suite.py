@@ -0,0 +1,315 @@
+"""Benchmark suite for the query and mutation generation hot paths.
+
+Each benchmark generates queries or mutations from synthetic data at several scales (number of
+items). For functions that generate a single query or mutation, the scale is the number of calls.
+For the sequence builders, the scale is the length of the sequence passed in a single call.
+
+Results are written as JSON. Pass the results of a previous run with --baseline to check for
+regressions: the exit status is 1 if any benchmark is slower than the baseline by more than
+--max-regression.
+
+Run from the root of the repository with:
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --baseline results.json
+"""
+import argparse
+import datetime
+import json
+import platform
+import random
+import string
+import sys
+import time
+
+from trompace import make_parameters, make_filter, make_select_query, encode_list, StringConstant, _Neo4jDate
+from trompace import codec
+from trompace.mutations import itemlist as mutations_itemlist
+from trompace.mutations import templates as mutation_templates
+from trompace.queries import templates as query_templates
+
+DEFAULT_SCALES = [1000, 10000, 100000]
+
+# Register benchmarks with the @benchmark decorator
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def _decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return _decorator
+
+
+class SyntheticData:
+    """Deterministic synthetic values that look like the data that is stored in the CE"""
+
+    def __init__(self, seed=0):
+        self.random = random.Random(seed)
+
+    def text(self, length=20):
+        return "".join(self.random.choice(string.ascii_letters + " ") for _ in range(length))
+
+    def identifier(self):
+        return "{:08x}-{:04x}-{:04x}-{:04x}-{:012x}".format(*(self.random.getrandbits(b) for b in (32, 16, 16, 16, 48)))
+
+    def url(self):
+        return "https://example.com/" + self.identifier()
+
+    def identifiers(self, count):
+        return [self.identifier() for _ in range(count)]
+
+    def person_args(self):
+        return {
+            "title": self.text(30),
+            "contributor": "https://musicbrainz.org",
+            "creator": "https://github.com/trompamusic/trompace-client",
+            "source": self.url(),
+            "format": "text/html",
+            "name": self.text(15),
+            "description": self.text(200),
+            "language": StringConstant("en"),
+            "birthDate": _Neo4jDate([1860, 7, 7]),
+            "additionalType": [self.url(), self.url()],
+        }
+
+    def node(self):
+        """A node as returned by the CE in the response to a ThingInterface or ItemList query"""
+        return {
+            "__typename": "Person",
+            "identifier": self.identifier(),
+            "name": self.text(15),
+            "title": self.text(30),
+            "description": self.text(200),
+            "source": self.url(),
+            "position": self.random.randint(0, 10000),
+            "created": {"formatted": "2021-03-04T10:11:12.345Z"},
+            "additionalType": [self.url(), self.url()],
+            "exactMatch": [{"identifier": self.identifier()}],
+        }
+
+    def response(self, count):
+        """The encoded body of a response from the CE containing `count` nodes"""
+        return json.dumps({"data": {"ThingInterface": [self.node() for _ in range(count)]}}).encode("utf-8")
+
+
+def _calls(scale, make_args, func):
+    """Run func once for each set of arguments, returning the time taken"""
+    all_args = [make_args() for _ in range(scale)]
+    start = time.perf_counter()
+    for args in all_args:
+        func(args)
+    return time.perf_counter() - start
+
+
+def _single(make_args, func):
+    """Run func once, returning the time taken"""
+    args = make_args()
+    start = time.perf_counter()
+    func(args)
+    return time.perf_counter() - start
+
+
+@benchmark("make_parameters")
+def bench_make_parameters(data, scale):
+    return _calls(scale, data.person_args, lambda args: make_parameters(**args))
+
+
+@benchmark("make_filter")
+def bench_make_filter(data, scale):
+    return _calls(scale, lambda: {"identifier_in": data.identifiers(5), "name": data.text(),
+                                  "exactMatch": {"identifier": data.identifier()}},
+                  make_filter)
+
+
+@benchmark("make_select_query")
+def bench_make_select_query(data, scale):
+    fields = ["identifier", "name", {"itemListElement": ["identifier", "position", {"nextItem": ["identifier"]}]}]
+    return _calls(scale, lambda: fields, make_select_query)
+
+
+@benchmark("encode_list")
+def bench_encode_list(data, scale):
+    encoder = json.JSONEncoder()
+    return _calls(scale, lambda: [data.url(), StringConstant("en"), {"identifier": data.identifier()}],
+                  lambda args: list(encode_list(args, encoder)))
+
+
+@benchmark("mutations.format_mutation")
+def bench_format_mutation(data, scale):
+    return _calls(scale, data.person_args, lambda args: mutation_templates.format_mutation("CreatePerson", args))
+
+
+@benchmark("mutations.format_alias_mutation")
+def bench_format_alias_mutation(data, scale):
+    return _calls(scale, data.person_args,
+                  lambda args: mutation_templates.format_alias_mutation("Alias", "CreatePerson", args))
+
+
+@benchmark("mutations.format_link_mutation")
+def bench_format_link_mutation(data, scale):
+    return _calls(scale, lambda: (data.identifier(), data.identifier()),
+                  lambda args: mutation_templates.format_link_mutation("MergePersonExactMatch", *args))
+
+
+@benchmark("mutations.format_sequence_mutation")
+def bench_format_sequence_mutation(data, scale):
+    return _single(lambda: [(f"Alias{i}", "CreatePerson", data.person_args()) for i in range(scale)],
+                   mutation_templates.format_sequence_mutation)
+
+
+@benchmark("mutations.format_sequence_link_mutation")
+def bench_format_sequence_link_mutation(data, scale):
+    return _single(lambda: [(f"Alias{i}", "MergeListItemNextItem", [data.identifier(), data.identifier()])
+                            for i in range(scale)],
+                   mutation_templates.format_sequence_link_mutation)
+
+
+@benchmark("mutations.format_sequence_mutation_chunks")
+def bench_format_sequence_mutation_chunks(data, scale):
+    return _single(lambda: [(f"Alias{i}", "CreatePerson", data.person_args()) for i in range(scale)],
+                   lambda mutations: mutation_templates.format_sequence_mutation_chunks(mutations, max_aliases=500,
+                                                                                        max_bytes=1000000))
+
+
+@benchmark("queries.format_query")
+def bench_format_query(data, scale):
+    return _calls(scale, lambda: {"identifier": data.identifier(), "name": data.text()},
+                  lambda args: query_templates.format_query("Person", args, ["identifier", "name", "source"]))
+
+
+@benchmark("queries.format_filter_query")
+def bench_format_filter_query(data, scale):
+    return _calls(scale, lambda: {"identifier_in": data.identifiers(10)},
+                  lambda args: query_templates.format_filter_query("ThingInterface", args, ["identifier"]))
+
+
+@benchmark("queries.format_itemlist_query")
+def bench_format_itemlist_query(data, scale):
+    return _calls(scale, lambda: {"identifier_in": data.identifiers(1)},
+                  lambda args: query_templates.format_itemlist_query("ItemList", args))
+
+
+@benchmark("itemlist.mutation_sequence_create_listitem")
+def bench_sequence_create_listitem(data, scale):
+    def make_args():
+        listitems = [data.text() for _ in range(scale)]
+        return listitems
+
+    return _single(make_args, lambda listitems: mutations_itemlist.mutation_sequence_create_listitem(
+        listitems=listitems, contributor="https://www.upf.edu", creator="https://www.upf.edu",
+        name="List item", description=listitems))
+
+
+@benchmark("itemlist.mutation_sequence_add_itemlist_itemlist_element")
+def bench_sequence_add_itemlist_itemlist_element(data, scale):
+    return _single(lambda: (data.identifier(), data.identifiers(scale)),
+                   lambda args: mutations_itemlist.mutation_sequence_add_itemlist_itemlist_element(*args))
+
+
+@benchmark("itemlist.mutation_sequence_add_listitem_item")
+def bench_sequence_add_listitem_item(data, scale):
+    return _single(lambda: (data.identifiers(scale), data.identifiers(scale)),
+                   lambda args: mutations_itemlist.mutation_sequence_add_listitem_item(*args))
+
+
+@benchmark("itemlist.mutation_sequence_add_listitem_nextitem")
+def bench_sequence_add_listitem_nextitem(data, scale):
+    return _single(lambda: data.identifiers(scale), mutations_itemlist.mutation_sequence_add_listitem_nextitem)
+
+
+def _register_codec_benchmarks():
+    """Benchmark decoding and encoding a large CE response with each JSON codec that is installed"""
+    for name in codec.CODECS:
+        try:
+            json_codec = codec.make_codec(name)
+        except ImportError:
+            continue
+
+        @benchmark(f"codec.loads[{name}]")
+        def bench_loads(data, scale, json_codec=json_codec):
+            return _single(lambda: data.response(scale), json_codec.loads)
+
+        @benchmark(f"codec.dumps[{name}]")
+        def bench_dumps(data, scale, json_codec=json_codec):
+            return _single(lambda: json.loads(data.response(scale)), json_codec.dumps)
+
+
+_register_codec_benchmarks()
+
+
+def run(names, scales, repeat):
+    """Run benchmarks, keeping the fastest of `repeat` runs of each one
+    Returns:
+        A list of results {"name", "scale", "seconds", "us_per_item"}
+    """
+    results = []
+    for name in names:
+        for scale in scales:
+            best = min(BENCHMARKS[name](SyntheticData(), scale) for _ in range(repeat))
+            results.append({"name": name, "scale": scale, "seconds": best, "us_per_item": best / scale * 1e6})
+            print(f"{name:<58} {scale:>7} {best:9.4f}s {best / scale * 1e6:9.2f}us/item", file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, max_regression):
+    """Compare results with a baseline
+    Returns:
+        A list of the results that are more than `max_regression` slower than the baseline, with
+        the additional keys "baseline_seconds" and "ratio"
+    """
+    baseline_results = {(r["name"], r["scale"]): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline_results.get((result["name"], result["scale"]))
+        if previous is None:
+            continue
+        ratio = result["seconds"] / previous["seconds"]
+        if ratio > 1 + max_regression:
+            regressions.append(dict(result, baseline_seconds=previous["seconds"], ratio=ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES, help="Numbers of items")
+    parser.add_argument("--benchmark", "-b", action="append", choices=sorted(BENCHMARKS),
+                        help="Only run this benchmark (can be repeated)")
+    parser.add_argument("--repeat", type=int, default=3, help="Run each benchmark this many times and keep the best")
+    parser.add_argument("--output", "-o", help="Write results to this JSON file (default: stdout)")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Maximum allowed slowdown compared to the baseline, as a fraction (default 0.2)")
+    args = parser.parse_args(argv)
+
+    names = args.benchmark or list(BENCHMARKS)
+    results = run(names, args.scales, args.repeat)
+    output = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        output["regressions"] = compare(results, baseline, args.max_regression)
+        for regression in output["regressions"]:
+            print(f"REGRESSION {regression['name']} ({regression['scale']}): {regression['seconds']:.4f}s, "
+                  f"baseline {regression['baseline_seconds']:.4f}s ({regression['ratio']:.2f}x)", file=sys.stderr)
+        if output["regressions"]:
+            status = 1
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(output, fp, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+        print()
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
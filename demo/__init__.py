@@ -13,3 +13,10 @@ def send_query_and_get_id(query, return_type=None):
                 return [i["identifier"] for i in item]
             return item["identifier"]
     return None
+
+
+def send_queries(queries):
+    """Submit independent queries concurrently, raising the first error that occurs"""
+    for result in connection.submit_queries(queries, auth_required=True):
+        if result.error:
+            raise result.error
@@ -91,9 +91,7 @@ def main(print_queries: bool, submit_queries: bool):
         print(join_motivations)
         print(join_rating)
     if submit_queries:
-        send_query_and_get_id(join_vocab)
-        send_query_and_get_id(join_motivations)
-        send_query_and_get_id(join_rating)
+        send_queries([join_vocab, join_motivations, join_rating])
 
     # Join the toolkit items to the toolkit
     add_vocab = itemlist.mutation_add_itemlist_itemlist_element(itemlist_id, listitem_vocab_id)
@@ -110,14 +108,10 @@ def main(print_queries: bool, submit_queries: bool):
         print(add_commenting)
         print(add_tagging)
     if submit_queries:
-        send_query_and_get_id(add_vocab)
-        send_query_and_get_id(add_motivation)
-        send_query_and_get_id(add_rating)
-        send_query_and_get_id(add_commenting)
-        send_query_and_get_id(add_tagging)
+        send_queries([add_vocab, add_motivation, add_rating, add_commenting, add_tagging])
 
 
 if __name__ == '__main__':
-    from demo import args, send_query_and_get_id
+    from demo import args, send_query_and_get_id, send_queries
 
     main(args.args.print, args.args.submit)
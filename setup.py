@@ -11,7 +11,10 @@ setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     url="https://github.com/trompamusic/trompace-client",
-    packages=find_packages(exclude=['tests', 'demo']),
+    packages=find_packages(exclude=['tests', 'demo', 'benchmarks', 'benchmarks.*']),
+    entry_points={
+        'console_scripts': ['trompace=trompace.__main__:main'],
+    },
     use_scm_version=True,
     setup_requires=['setuptools_scm'],
     classifiers=[
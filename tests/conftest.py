@@ -0,0 +1,18 @@
+from unittest import mock
+
+import pytest
+
+from trompace import connection
+from trompace.config import config
+from trompace.testing import FakeCE
+
+
+@pytest.fixture
+def ce():
+    """A FakeCE that trompace sends its requests to"""
+    connection.close_session()
+    with FakeCE(seed=0) as ce:
+        with mock.patch.object(config, "host", ce.url), \
+                mock.patch.object(config, "websocket_host", ce.websocket_url):
+            yield ce
+    connection.close_session()
@@ -1,7 +1,12 @@
+import datetime
 import unittest
 
 from datetime import date
-from trompace import make_parameters, StringConstant, _Neo4jDate
+from trompace import make_parameters, make_variables, use_variables, Operation, StringConstant, _Neo4jDate
+from trompace.mutations import person
+from trompace.queries.itemlist import query_listitems
+from trompace.queries.person import query_person
+from tests import CeTestCase
 
 
 class TestMakeParameters(unittest.TestCase):
@@ -78,3 +83,79 @@ class TestMakeParameters(unittest.TestCase):
         made_params = make_parameters(**params)
         expected = '''date: { year: 2020 month: 1 day: 15 }'''
         assert expected == made_params, "Year, month, day and more values did not output a date"
+
+
+class TestVariables(CeTestCase):
+    """Test sending mutation and query arguments as variables"""
+
+    def test_make_variables(self):
+        params = {"name": "My thing", "position": 3, "valueRequired": True, "language": StringConstant("en"),
+                  "identifier": "abc", "additionalType": ["a", "b"]}
+        parameters, definitions, variables = make_variables(**params)
+        assert parameters == '''name: $name\n        position: $position\n        valueRequired: $valueRequired\n''' \
+                             '''        language: en\n        identifier: $identifier\n''' \
+                             '''        additionalType: $additionalType'''
+        assert definitions == "$name: String!, $position: Int!, $valueRequired: Boolean!, $identifier: ID!, " \
+                              "$additionalType: [String!]!"
+        assert variables == {"name": "My thing", "position": 3, "valueRequired": True, "identifier": "abc",
+                             "additionalType": ["a", "b"]}
+
+    def test_inlined_values(self):
+        """Values that can't be sent as variables are inlined"""
+        params = {"date": _Neo4jDate([2020, 1]), "items": [StringConstant("one"), "two"], "filter": {"name": "x"}}
+        parameters, definitions, variables = make_variables(**params)
+        assert parameters == make_parameters(**params)
+        assert definitions == ""
+        assert variables == {}
+
+    def test_datetime(self):
+        parameters, definitions, variables = make_variables(startTime=datetime.datetime(2020, 1, 15, 13, 30))
+        assert definitions == "$startTime: _Neo4jDateTimeInput!"
+        assert variables == {"startTime": {"formatted": "2020-01-15T13:30:00"}}
+
+    def test_mutation_with_variables(self):
+        with use_variables():
+            created = person.mutation_create_person(title="A. J. Fynn", contributor="https://www.cpdl.org",
+                                                    creator="https://www.upf.edu", source="https://www.cpdl.org/",
+                                                    format_="text/html", language="en")
+            other = person.mutation_create_person(title="Other", contributor="https://www.cpdl.org",
+                                                  creator="https://www.upf.edu", source="https://www.cpdl.org/b",
+                                                  format_="text/html", language="en")
+        assert isinstance(created, Operation)
+        # The document doesn't depend on the values of the arguments
+        assert str(created) == str(other)
+        assert created.variables["title"] == "A. J. Fynn"
+        assert "language: en" in created
+        self.assert_queries_equal(created, """mutation($title: String!, $contributor: String!, $creator: String!,
+          $source: String!, $format: String!) {
+            CreatePerson(title: $title contributor: $contributor creator: $creator source: $source
+                         format: $format language: en) { identifier }
+        }""")
+
+    def test_link_mutation_with_variables(self):
+        with use_variables():
+            link = person.mutation_person_add_exact_match_person("id1", "id2")
+        assert link.variables == {"identifier_1": "id1", "identifier_2": "id2"}
+        self.assert_queries_equal(link, """mutation($identifier_1: ID!, $identifier_2: ID!) {
+            MergePersonExactMatch(from: {identifier: $identifier_1} to: {identifier: $identifier_2}) {
+              from { identifier } to { identifier }
+            }
+        }""")
+
+    def test_query_with_variables(self):
+        with use_variables():
+            query = query_person(identifier="abc")
+            filter_query = query_listitems(identifiers=["a", "b"])
+        self.assert_queries_equal(query, """query($identifier: ID!) {
+            Person(identifier: $identifier) { identifier name }
+        }""")
+        assert query.variables == {"identifier": "abc"}
+        assert filter_query.variables == {"identifier_in": ["a", "b"]}
+        assert "identifier_in: $identifier_in" in filter_query
+
+    def test_disabled(self):
+        with use_variables():
+            with use_variables(False):
+                query = query_person(identifier="abc")
+        assert not isinstance(query, Operation)
+        assert '"abc"' in query
@@ -0,0 +1,80 @@
+# Tests for the generic mutation templates
+import datetime
+
+from trompace import make_parameters, StringConstant, _Neo4jDate
+from trompace.mutations import itemlist, MUTATION
+from trompace.mutations.templates import format_sequence_mutation_chunks, format_sequence_mutation, \
+    format_mutation, format_link_mutation, compile_mutation, create_alias_mutation, \
+    MUTATION_TEMPLATE, MUTATION_ALIAS_TEMPLATE, LINK_MUTATION_TEMPLATE
+from tests import CeTestCase
+
+
+class TestCompiledTemplates(CeTestCase):
+
+    args = {"title": "Caf\u00e9 {\"quoted\"}\n", "position": 3, "valueRequired": False, "ratio": 1.5,
+            "additionalType": ["a", StringConstant("b")], "filter": {"name": "x"},
+            "startTime": datetime.datetime(2020, 1, 15, 13, 30), "birthDate": _Neo4jDate("2020-01-15"),
+            "language": StringConstant("en"), "empty": None}
+
+    def test_same_as_interpreted(self):
+        expected = MUTATION.format(mutation=MUTATION_TEMPLATE.format(mutationname="CreateThing",
+                                                                     parameters=make_parameters(**self.args)))
+        assert format_mutation("CreateThing", self.args) == expected
+
+    def test_alias_same_as_interpreted(self):
+        expected = MUTATION_ALIAS_TEMPLATE.format(mutationalias="Alias0", mutationname="CreateThing",
+                                                  parameters=make_parameters(**self.args))
+        assert create_alias_mutation("Alias0", "CreateThing", self.args) == expected
+
+    def test_link_same_as_interpreted(self):
+        expected = MUTATION.format(mutation=LINK_MUTATION_TEMPLATE.format(
+            mutationname="MergePersonExactMatch", identifier_1="id{1}", identifier_2="id2"))
+        assert format_link_mutation("MergePersonExactMatch", "id{1}", "id2") == expected
+
+    def test_compiled_once(self):
+        compile_mutation.cache_clear()
+        format_mutation("CreateThing", {"name": "one", "position": 1})
+        format_mutation("CreateThing", {"name": "two", "position": 2})
+        format_mutation("CreateThing", {"position": 3, "name": "three"})
+        info = compile_mutation.cache_info()
+        # Different argument order is a different template
+        assert info.misses == 2
+        assert info.hits == 1
+
+
+class TestSequenceChunks(CeTestCase):
+
+    def setUp(self) -> None:
+        super()
+        self.mutations = itemlist.make_sequence_create_listitem(
+            listitems=[f"item {i}" for i in range(10)], contributor="https://www.upf.edu",
+            creator="https://www.upf.edu", name="List item", description=[f"item {i}" for i in range(10)])
+
+    def test_no_limits(self):
+        chunks = format_sequence_mutation_chunks(self.mutations)
+        assert len(chunks) == 1
+        self.assert_queries_equal(chunks[0], format_sequence_mutation(self.mutations))
+
+    def test_max_aliases(self):
+        chunks = format_sequence_mutation_chunks(self.mutations, max_aliases=3)
+        assert len(chunks) == 4
+        self.assert_queries_equal(chunks[0], format_sequence_mutation(self.mutations[:3]))
+        self.assert_queries_equal(chunks[3], format_sequence_mutation(self.mutations[9:]))
+
+    def test_max_bytes(self):
+        single = len(format_sequence_mutation(self.mutations[:1]).encode("utf-8"))
+        chunks = format_sequence_mutation_chunks(self.mutations, max_bytes=single * 2)
+        assert len(chunks) > 1
+        assert all(len(chunk.encode("utf-8")) <= single * 2 for chunk in chunks)
+        assert sum(chunk.count("CreateListItem") for chunk in chunks) == 10
+
+    def test_mutation_larger_than_max_bytes(self):
+        chunks = format_sequence_mutation_chunks(self.mutations[:2], max_bytes=10)
+        assert len(chunks) == 2
+
+    def test_link_mutations(self):
+        mutations = itemlist.make_sequence_add_listitem_nextitem(listitem_ids=["a", "b", "c", "d"])
+        chunks = format_sequence_mutation_chunks(mutations + self.mutations[:1], max_aliases=2)
+        assert len(chunks) == 2
+        assert "MergeListItemNextItemAlias0: MergeListItemNextItem" in chunks[0]
+        assert "ListItemAlias0: CreateListItem" in chunks[1]
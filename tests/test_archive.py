@@ -0,0 +1,165 @@
+import gzip
+import json
+import os
+import time
+from unittest import mock
+
+import pytest
+import requests
+
+from trompace import connection
+from trompace.__main__ import main
+from trompace.archive import Archive, archive_ce, archive_ce_delta
+from trompace.config import config
+from trompace.mutations import person
+
+
+@pytest.fixture
+def ce(ce):
+    for i in range(25):
+        ce.add_node("Person", identifier=f"p{i:02d}", name=f"Person {i}")
+    with mock.patch.object(config, "connection_retry_max_attempts", 1):
+        yield ce
+
+
+def _manifest(directory):
+    with open(os.path.join(directory, "manifest.jsonl")) as fp:
+        return [json.loads(line) for line in fp]
+
+
+class TestArchive:
+
+    def test_archive_all(self, ce, tmp_path):
+        summary = archive_ce(str(tmp_path), workers=4, shard_size=10, page_size=7)
+        assert summary.downloaded == 25
+        assert summary.failed == []
+        assert summary.shards == ["shard-00001.jsonl.gz", "shard-00002.jsonl.gz", "shard-00003.jsonl.gz"]
+        with gzip.open(tmp_path / "shard-00001.jsonl.gz", "rt") as fp:
+            lines = [json.loads(line) for line in fp]
+        assert len(lines) == 10
+        assert lines[0]["jsonld"]["@id"].endswith(lines[0]["identifier"])
+
+        manifest = _manifest(tmp_path)
+        assert [r["type"] for r in manifest] == ["shard", "shard", "shard", "complete"]
+        assert [r["count"] for r in manifest[:3]] == [10, 10, 5]
+        assert manifest[3]["nodes"] == 25
+
+        nodes = dict(Archive(str(tmp_path)).read())
+        assert sorted(nodes) == [f"p{i:02d}" for i in range(25)]
+        assert nodes["p03"]["name"] == "Person 3"
+
+    def test_resume(self, ce, tmp_path):
+        archive_ce(str(tmp_path), identifiers=["p01", "p02", "p03"], workers=2)
+        # A partial shard left by an interrupted run is removed
+        (tmp_path / ".shard-00002.jsonl.gz.tmp").write_bytes(b"partial")
+        ce.reset_stats()
+
+        summary = archive_ce(str(tmp_path), workers=2, shard_size=100)
+        assert summary.skipped == 3
+        assert summary.downloaded == 22
+        assert summary.shards == ["shard-00002.jsonl.gz"]
+        assert not (tmp_path / ".shard-00002.jsonl.gz.tmp").exists()
+        # One query to list identifiers and one JSON-LD request per new node
+        assert ce.stats["requests"] == 1 + 22
+        assert len(Archive(str(tmp_path)).completed_identifiers()) == 25
+
+    def test_failed_downloads_are_retried(self, ce, tmp_path):
+        summary = archive_ce(str(tmp_path), identifiers=["p00", "missing", "p01"], workers=1)
+        assert summary.downloaded == 2
+        assert summary.failed == ["missing"]
+        assert "complete" not in [r["type"] for r in _manifest(tmp_path)]
+
+        ce.add_node("Person", identifier="missing", name="Found")
+        summary = archive_ce(str(tmp_path), identifiers=["p00", "missing", "p01"], workers=1)
+        assert summary.downloaded == 1
+        assert summary.skipped == 2
+
+    def test_command(self, ce, tmp_path):
+        with mock.patch.object(config, "load") as load:
+            assert main(["--config", "trompace.ini", "archive", str(tmp_path), "--workers", "3",
+                         "--shard-size", "20"]) == 0
+        load.assert_called_once_with("trompace.ini")
+        assert len([r for r in _manifest(tmp_path) if r["type"] == "shard"]) == 2
+
+
+class TestDeltaArchive:
+
+    def test_delta(self, ce, tmp_path):
+        archive_ce(str(tmp_path), shard_size=100)
+        ce.reset_stats()
+        summary = archive_ce_delta(str(tmp_path), overlap=0)
+        assert summary.downloaded == 0
+        assert summary.shards == []
+
+        # Changes after the high-water mark
+        time.sleep(0.01)
+        connection.submit_query(person.mutation_update_person("p03", name="Changed"))
+        ce.add_node("Person", identifier="new", name="New")
+        summary = archive_ce_delta(str(tmp_path), overlap=0)
+        assert summary.downloaded == 2
+        assert summary.shards == ["shard-00002.jsonl.gz"]
+
+        manifest = _manifest(tmp_path)
+        assert [r["type"] for r in manifest] == ["shard", "complete", "complete", "shard", "complete"]
+        assert "since" in manifest[-1]
+        nodes = dict(Archive(str(tmp_path)).read())
+        assert nodes["p03"]["name"] == "Changed"
+        assert nodes["new"]["name"] == "New"
+        assert len(nodes) == 26
+
+        # Nothing changed since the last delta
+        assert archive_ce_delta(str(tmp_path), overlap=0).downloaded == 0
+
+    def test_overlap(self, ce, tmp_path):
+        archive_ce(str(tmp_path))
+        assert archive_ce_delta(str(tmp_path), overlap=3600).downloaded == 25
+
+    def test_resume_delta(self, ce, tmp_path):
+        archive_ce(str(tmp_path))
+        time.sleep(0.01)
+        ce.add_node("Person", identifier="new1")
+        ce.add_node("Person", identifier="new2")
+        get_jsonld = connection.get_jsonld
+
+        def fail_new2(identifier):
+            if identifier == "new2":
+                raise requests.exceptions.ConnectionError()
+            return get_jsonld(identifier)
+
+        with mock.patch.object(connection, "get_jsonld", fail_new2):
+            summary = archive_ce_delta(str(tmp_path), workers=1, overlap=0)
+        assert summary.downloaded == 1
+        assert len(summary.failed) == 1
+
+        # The high-water mark wasn't moved, the node that was already downloaded is skipped
+        summary = archive_ce_delta(str(tmp_path), workers=1, overlap=0)
+        assert summary.downloaded == 1
+        assert summary.skipped == 1
+
+    def test_delta_after_resumed_archive(self, ce, tmp_path):
+        archive_ce(str(tmp_path), identifiers=["p01", "p02", "p03"])
+        time.sleep(0.01)
+        connection.submit_query(person.mutation_update_person("p03", name="Changed"))
+        # The resumed run skips p03, so the high-water mark is when p03 was archived
+        summary = archive_ce(str(tmp_path))
+        assert summary.skipped == 3
+        summary = archive_ce_delta(str(tmp_path), overlap=0)
+        assert summary.downloaded == 1
+        assert dict(Archive(str(tmp_path)).read())["p03"]["name"] == "Changed"
+
+    def test_delta_after_rerun(self, ce, tmp_path):
+        archive_ce(str(tmp_path))
+        mark = Archive(str(tmp_path)).high_water_mark()
+        time.sleep(0.01)
+        connection.submit_query(person.mutation_update_person("p03", name="Changed"))
+        summary = archive_ce(str(tmp_path))
+        assert (summary.downloaded, summary.skipped) == (0, 25)
+        # Nothing new was downloaded, so the high-water mark doesn't move
+        assert Archive(str(tmp_path)).high_water_mark() == mark
+        summary = archive_ce_delta(str(tmp_path), overlap=0)
+        assert summary.downloaded == 1
+        assert dict(Archive(str(tmp_path)).read())["p03"]["name"] == "Changed"
+
+    def test_requires_complete_archive(self, ce, tmp_path):
+        with pytest.raises(ValueError):
+            archive_ce_delta(str(tmp_path))
@@ -0,0 +1,23 @@
+import json
+
+from benchmarks import suite
+
+
+class TestBenchmarkSuite:
+
+    def test_all_benchmarks_run(self, tmp_path, capsys):
+        output = tmp_path / "results.json"
+        assert suite.main(["--scales", "10", "--repeat", "1", "--output", str(output)]) == 0
+        results = json.loads(output.read_text())["results"]
+        assert {r["name"] for r in results} == set(suite.BENCHMARKS)
+        assert all(r["scale"] == 10 and r["seconds"] >= 0 for r in results)
+
+    def test_compare(self):
+        baseline = {"results": [{"name": "make_filter", "scale": 10, "seconds": 1.0},
+                                {"name": "encode_list", "scale": 10, "seconds": 1.0}]}
+        results = [{"name": "make_filter", "scale": 10, "seconds": 1.1},
+                   {"name": "encode_list", "scale": 10, "seconds": 1.5},
+                   {"name": "make_select_query", "scale": 10, "seconds": 3.0}]
+        regressions = suite.compare(results, baseline, max_regression=0.2)
+        assert [r["name"] for r in regressions] == ["encode_list"]
+        assert regressions[0]["ratio"] == 1.5
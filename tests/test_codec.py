@@ -0,0 +1,51 @@
+import json
+import math
+from unittest import mock
+
+import pytest
+
+from trompace import codec
+from trompace.config import config
+
+DOCUMENTS = [
+    {"query": "query { Person { name } }", "variables": {"name": "Ludwig van Beethoven", "position": 3}},
+    {"data": {"Person": [{"name": "Antonín Dvořák", "birthDate": None, "score": 1.5, "exact": True}]}},
+    {"big": 2 ** 70},
+    [],
+]
+
+
+@pytest.fixture(params=["json", "orjson"])
+def json_codec(request):
+    pytest.importorskip(request.param)
+    return codec.make_codec(request.param)
+
+
+class TestCodec:
+
+    @pytest.mark.parametrize("document", DOCUMENTS)
+    def test_round_trip(self, json_codec, document):
+        encoded = json_codec.dumps(document)
+        assert isinstance(encoded, bytes)
+        assert json.loads(encoded) == document
+        assert json_codec.loads(encoded) == document
+        assert json_codec.loads(encoded.decode("utf-8")) == document
+
+    def test_non_standard_values(self, json_codec):
+        assert json_codec.dumps({1: "a"}) == b'{"1":"a"}'
+        assert math.isnan(json_codec.loads(b'{"a": NaN}')["a"])
+
+    def test_invalid(self, json_codec):
+        with pytest.raises(ValueError):
+            json_codec.loads(b"<html>Bad gateway</html>")
+
+    def test_make_codec(self):
+        assert isinstance(codec.make_codec("json"), codec.JsonCodec)
+        assert codec.make_codec("auto").name in codec.CODECS
+        with pytest.raises(ValueError):
+            codec.make_codec("simplejson")
+
+    def test_get_codec_follows_config(self):
+        with mock.patch.object(config, "connection_json_codec", "json"):
+            assert codec.get_codec().name == "json"
+            assert codec.get_codec() is codec.get_codec()
@@ -1,5 +1,12 @@
+import asyncio
 import configparser
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
 
+import jwt
 import pytest
 
 from trompace import config
@@ -60,3 +67,248 @@ class TestConfig:
         assert c.host == "http://localhost:4000/trompa/"
         assert c.websocket_host == "ws://localhost:4000/trompa/graphql"
 
+    def test_set_connection_default(self):
+        # No connection section, use the defaults
+        c = config.TrompaConfig()
+        c.config = configparser.ConfigParser()
+        c.config.read_dict({})
+
+        c._set_connection()
+        assert c.connection_pool_connections == 10
+        assert c.connection_pool_maxsize == 10
+        assert c.connection_keepalive_timeout == 60.0
+
+    def test_set_connection(self):
+        settings = {"connection": {"pool_connections": "2", "pool_maxsize": "50", "keepalive_timeout": "5"}}
+        c = config.TrompaConfig()
+        c.config = configparser.ConfigParser()
+        c.config.read_dict(settings)
+
+        c._set_connection()
+        assert c.connection_pool_connections == 2
+        assert c.connection_pool_maxsize == 50
+        assert c.connection_keepalive_timeout == 5.0
+
+    def test_set_connection_retry(self):
+        settings = {"connection": {"retry_max_attempts": "2", "retry_backoff_base": "0.1", "retry_deadline": "10"}}
+        c = config.TrompaConfig()
+        c.config = configparser.ConfigParser()
+        c.config.read_dict(settings)
+
+        c._set_connection()
+        assert c.connection_retry_max_attempts == 2
+        assert c.connection_retry_backoff_base == 0.1
+        assert c.connection_retry_backoff_max == 30.0
+        assert c.connection_retry_deadline == 10.0
+
+        c.config.read_dict({"connection": {"retry_max_attempts": "0"}})
+        with pytest.raises(ValueError):
+            c._set_connection()
+
+    def test_set_connection_limits(self):
+        settings = {"connection": {"rate_limit": "20", "adaptive_concurrency": "yes", "adaptive_concurrency_max": "8"}}
+        c = config.TrompaConfig()
+        c.config = configparser.ConfigParser()
+        c.config.read_dict(settings)
+
+        c._set_connection()
+        assert c.connection_rate_limit == 20.0
+        assert c.connection_rate_limit_burst == 10
+        assert c.connection_adaptive_concurrency
+        assert c.connection_adaptive_concurrency_max == 8
+
+        c.config.read_dict({"connection": {"adaptive_concurrency_min": "10"}})
+        with pytest.raises(ValueError):
+            c._set_connection()
+
+    def test_set_connection_circuit_breaker(self):
+        settings = {"connection": {"read_timeout": "0", "circuit_breaker_threshold": "3"}}
+        c = config.TrompaConfig()
+        c.config = configparser.ConfigParser()
+        c.config.read_dict(settings)
+
+        c._set_connection()
+        assert c.connection_connect_timeout == 10.0
+        assert c.connection_read_timeout == 0.0
+        assert c.connection_circuit_breaker_threshold == 3
+        assert c.connection_circuit_breaker_cooldown == 30.0
+
+    def test_set_connection_json_codec(self):
+        c = config.TrompaConfig()
+        c.config = configparser.ConfigParser()
+        c.config.read_dict({"connection": {"json_codec": "json"}})
+
+        c._set_connection()
+        assert c.connection_json_codec == "json"
+
+        c.config.read_dict({"connection": {"json_codec": "simplejson"}})
+        with pytest.raises(ValueError):
+            c._set_connection()
+
+    def test_set_connection_invalid(self):
+        settings = {"connection": {"pool_maxsize": "0"}}
+        c = config.TrompaConfig()
+        c.config = configparser.ConfigParser()
+        c.config.read_dict(settings)
+
+        with pytest.raises(ValueError):
+            c._set_connection()
+
+
+def _make_token(lifetime=7200, issued=None):
+    issued = time.time() if issued is None else issued
+    claims = {"id": "test", "iat": int(issued), "exp": int(issued + lifetime)}
+    return jwt.encode(claims, "a-secret-key-for-testing-jwt-tokens")
+
+
+class TestJwtToken:
+
+    def setup_method(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.config = config.TrompaConfig()
+        self.config.host = "http://localhost:4000"
+        self.config.jwt_key_cache = os.path.join(self.tmpdir.name, "token")
+
+    def teardown_method(self):
+        self.tmpdir.cleanup()
+
+    def test_fast_path(self):
+        token = _make_token()
+        assert self.config._set_jwt_token(token)
+        with mock.patch.object(jwt, "decode") as decode, mock.patch.object(config, "get_jwt") as get_jwt:
+            assert self.config.jwt_token == token
+            assert self.config.jwt_token == token
+        decode.assert_not_called()
+        get_jwt.assert_not_called()
+
+    def test_refresh_before_expiry(self):
+        # The token expires in 30 minutes, and the margin is one hour
+        old_token = _make_token(lifetime=7200, issued=time.time() - 5400)
+        new_token = _make_token()
+        self.config._set_jwt_token(old_token)
+        with mock.patch.object(config, "get_jwt", return_value=new_token) as get_jwt:
+            assert self.config.jwt_token == new_token
+        get_jwt.assert_called_once()
+        with open(self.config.jwt_key_cache) as fp:
+            assert fp.read() == new_token
+        assert os.listdir(self.tmpdir.name) == ["token"]
+
+    def test_margin_limited_by_lifetime(self):
+        # A token with a lifetime of 10 minutes is used for 5 minutes
+        self.config._set_jwt_token(_make_token(lifetime=600))
+        assert self.config.jwt_token_refresh_at == pytest.approx(self.config.jwt_token_expiry - 300, abs=1)
+
+    def test_assign_token(self):
+        token = _make_token()
+        self.config.jwt_token_encoded = token
+        assert self.config.jwt_token_decoded["exp"] == self.config.jwt_token_expiry
+        with mock.patch.object(config, "get_jwt") as get_jwt:
+            assert self.config.jwt_token == token
+        get_jwt.assert_not_called()
+        # A token that can't be decoded is renewed
+        self.config.jwt_token_encoded = "not-a-token"
+        with mock.patch.object(config, "get_jwt", return_value=token) as get_jwt:
+            assert self.config.jwt_token == token
+        get_jwt.assert_called_once()
+
+    def test_token_without_expiry(self):
+        token = jwt.encode({"id": "test"}, "a-secret-key-for-testing-jwt-tokens")
+        self.config.jwt_token_encoded = token
+        with mock.patch.object(config, "get_jwt") as get_jwt:
+            assert self.config.jwt_token == token
+            assert self.config.jwt_token == token
+            assert config.TokenRefresher(self.config, retry_interval=5).refresh() == 5
+        get_jwt.assert_not_called()
+
+    def test_lock_per_config(self):
+        assert config.TrompaConfig()._jwt_lock is not config.TrompaConfig()._jwt_lock
+
+    def test_refresh_failed(self):
+        old_token = _make_token(lifetime=7200, issued=time.time() - 5400)
+        self.config._set_jwt_token(old_token)
+        with mock.patch.object(config, "get_jwt", return_value=None) as get_jwt:
+            assert self.config.jwt_token == old_token
+            assert self.config.jwt_token == old_token
+        # Don't try again on each request
+        get_jwt.assert_called_once()
+
+    def test_single_flight(self):
+        new_token = _make_token()
+
+        def slow_get_jwt(*args):
+            time.sleep(0.05)
+            return new_token
+
+        results = []
+        with mock.patch.object(config, "get_jwt", side_effect=slow_get_jwt) as get_jwt:
+            threads = [threading.Thread(target=lambda: results.append(self.config.jwt_token)) for _ in range(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        assert results == [new_token] * 10
+        get_jwt.assert_called_once()
+
+    def test_single_flight_async(self):
+        new_token = _make_token()
+
+        def slow_get_jwt(*args):
+            time.sleep(0.05)
+            return new_token
+
+        async def run():
+            return await asyncio.gather(*[self.config.jwt_token_async() for _ in range(10)])
+
+        with mock.patch.object(config, "get_jwt", side_effect=slow_get_jwt) as get_jwt:
+            assert asyncio.run(run()) == [new_token] * 10
+        get_jwt.assert_called_once()
+
+
+class TestTokenRefresher:
+
+    def setup_method(self):
+        self.config = config.TrompaConfig()
+        self.config.host = "http://localhost:4000"
+
+    def test_refresh(self):
+        self.config._set_jwt_token(_make_token(lifetime=100, issued=time.time() - 50))
+        new_token = _make_token(lifetime=100)
+        refresher = config.TokenRefresher(self.config, fraction=0.4)
+        with mock.patch.object(config, "get_jwt", return_value=new_token) as get_jwt:
+            assert refresher.refresh() == pytest.approx(40, abs=1)
+            # Not due yet
+            assert refresher.refresh() == pytest.approx(40, abs=1)
+        get_jwt.assert_called_once()
+        assert self.config.jwt_token == new_token
+
+    def test_refresh_failed(self):
+        self.config._set_jwt_token(_make_token(lifetime=100, issued=time.time() - 50))
+        refresher = config.TokenRefresher(self.config, retry_interval=5)
+        with mock.patch.object(config, "get_jwt", return_value=None):
+            assert refresher.refresh() == 5
+        with mock.patch.object(config, "get_jwt", side_effect=ConnectionError()):
+            assert refresher.refresh() == 5
+
+    def test_thread(self):
+        new_token = _make_token()
+        with mock.patch.object(config, "get_jwt", return_value=new_token) as get_jwt:
+            with config.TokenRefresher(self.config):
+                for _ in range(100):
+                    if get_jwt.called:
+                        break
+                    time.sleep(0.01)
+        get_jwt.assert_called_once()
+        assert self.config.jwt_token_encoded == new_token
+
+    def test_async(self):
+        new_token = _make_token()
+
+        async def run():
+            task = asyncio.create_task(config.TokenRefresher(self.config).run_async())
+            await asyncio.sleep(0.05)
+            task.cancel()
+            return await self.config.jwt_token_async()
+
+        with mock.patch.object(config, "get_jwt", return_value=new_token) as get_jwt:
+            assert asyncio.run(run()) == new_token
+        get_jwt.assert_called_once()
@@ -0,0 +1,760 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+
+import pytest
+import requests
+from aiohttp import web
+
+from trompace import connection, Operation
+from trompace.config import config
+from trompace.exceptions import QueryException, CircuitOpenException
+from trompace.testing import FakeCE
+
+
+def _body(call):
+    """The decoded JSON body of a mocked call to session.post"""
+    return json.loads(call[1]["data"])
+
+
+class TestSession:
+
+    def setup_method(self):
+        connection.close_session()
+
+    def teardown_method(self):
+        connection.close_session()
+
+    def test_session_is_shared(self):
+        session = connection.get_session()
+        assert connection.get_session() is session
+
+    def test_session_pool_size(self):
+        with mock.patch.object(config, "connection_pool_maxsize", 25):
+            session = connection.get_session()
+            adapter = session.get_adapter("https://example.com")
+            assert adapter._pool_maxsize == 25
+
+    def test_session_recreated_when_settings_change(self):
+        session = connection.get_session()
+        with mock.patch.object(config, "connection_pool_maxsize", 25):
+            assert connection.get_session() is not session
+
+    def test_session_recreated_after_keepalive_timeout(self):
+        session = connection.get_session()
+        with mock.patch.object(config, "connection_keepalive_timeout", -1):
+            assert connection.get_session() is not session
+
+
+class TestSubmitQuery:
+
+    def setup_method(self):
+        connection.close_session()
+
+    def teardown_method(self):
+        connection.close_session()
+
+    def _response(self, body):
+        response = mock.Mock(status_code=200)
+        response.content = json.dumps(body).encode("utf-8")
+        return response
+
+    def test_submit_query_uses_session(self):
+        session = connection.get_session()
+        with mock.patch.object(session, "post", return_value=self._response({"data": {}})) as post, \
+                mock.patch.object(config, "host", "http://localhost:4000"):
+            connection.submit_query("query { Person { identifier } }")
+            connection.submit_query("query { Person { identifier } }")
+            assert post.call_count == 2
+            post.assert_called_with("http://localhost:4000", data=b'{"query":"query { Person { identifier } }"}',
+                                    headers={"Content-Type": "application/json"}, timeout=(10.0, 120.0))
+
+    def test_submit_query_variables(self):
+        session = connection.get_session()
+        with mock.patch.object(session, "post", return_value=self._response({"data": {}})) as post, \
+                mock.patch.object(config, "host", "http://localhost:4000"):
+            connection.submit_query(Operation("query($id: ID!) { Person(identifier: $id) { name } }", {"id": "a"}))
+            assert _body(post.call_args) == {"query": "query($id: ID!) { Person(identifier: $id) { name } }",
+                                             "variables": {"id": "a"}}
+            connection.submit_query("query($id: ID!) { Person(identifier: $id) { name } }", variables={"id": "b"})
+            assert _body(post.call_args)["variables"] == {"id": "b"}
+
+    def test_submit_query_errors(self):
+        session = connection.get_session()
+        response = self._response({"errors": [{"message": "Unknown field"}]})
+        with mock.patch.object(session, "post", return_value=response), \
+                mock.patch.object(config, "host", "http://localhost:4000"):
+            with pytest.raises(QueryException):
+                connection.submit_query("query { Person { identifier } }")
+
+
+class TestPersistedQueries:
+
+    def setup_method(self):
+        connection.close_session()
+        connection.persisted_queries = connection.PersistedQueryRegistry()
+
+    def teardown_method(self):
+        connection.close_session()
+        connection.persisted_queries = connection.PersistedQueryRegistry()
+
+    def _response(self, body):
+        response = mock.Mock(status_code=200)
+        response.content = json.dumps(body).encode("utf-8")
+        return response
+
+    def test_query_hash(self):
+        registry = connection.PersistedQueryRegistry(max_size=2)
+        assert registry.query_hash("query { a }") == hashlib.sha256(b"query { a }").hexdigest()
+        registry.query_hash("query { b }")
+        registry.query_hash("query { c }")
+        assert len(registry._hashes) == 2
+
+    def test_query_hash_max_bytes(self):
+        registry = connection.PersistedQueryRegistry(max_bytes=25)
+        registry.query_hash("query { a }")
+        registry.query_hash("query { b }")
+        registry.query_hash("query { c }")
+        assert list(registry._hashes) == ["query { b }", "query { c }"]
+        large = "mutation { " + "a " * 20 + "}"
+        assert registry.query_hash(large) == hashlib.sha256(large.encode("utf-8")).hexdigest()
+        assert large not in registry._hashes
+        assert registry._bytes == 22
+
+    def test_hash_then_document(self):
+        query = "query { Person { identifier } }"
+        query_hash = hashlib.sha256(query.encode("utf-8")).hexdigest()
+        not_found = self._response({"errors": [{"message": "PersistedQueryNotFound",
+                                                "extensions": {"code": "PERSISTED_QUERY_NOT_FOUND"}}]})
+        found = self._response({"data": {"Person": []}})
+        session = connection.get_session()
+        with mock.patch.object(session, "post", side_effect=[not_found, found, found]) as post, \
+                mock.patch.object(config, "connection_persisted_queries", True):
+            assert connection.submit_query(query) == {"data": {"Person": []}}
+            extensions = {"persistedQuery": {"version": 1, "sha256Hash": query_hash}}
+            assert _body(post.call_args_list[0]) == {"extensions": extensions}
+            assert _body(post.call_args_list[1]) == {"extensions": extensions, "query": query}
+            # The second time the CE knows the hash
+            connection.submit_query(query)
+            assert _body(post.call_args_list[2]) == {"extensions": extensions}
+
+    def test_not_supported(self):
+        not_supported = self._response({"errors": [{"message": "PersistedQueryNotSupported"}]})
+        found = self._response({"data": {"Person": []}})
+        session = connection.get_session()
+        with mock.patch.object(session, "post", side_effect=[not_supported, found, found]) as post, \
+                mock.patch.object(config, "connection_persisted_queries", True):
+            connection.submit_query("query { Person { identifier } }")
+            connection.submit_query("query { Person { identifier } }")
+            assert _body(post.call_args_list[2]) == {"query": "query { Person { identifier } }"}
+        assert not connection.persisted_queries.supported
+
+
+class TestRetry:
+
+    @pytest.fixture
+    def ce(self, ce):
+        with mock.patch.object(config, "connection_retry_backoff_base", 0.001):
+            yield ce
+
+    def test_backoff(self):
+        policy = connection.RetryPolicy(max_attempts=10, backoff_base=1, backoff_max=5, deadline=60)
+        assert all(0 <= policy.backoff(1) <= 1 for _ in range(100))
+        assert all(0 <= policy.backoff(8) <= 5 for _ in range(100))
+        assert policy.backoff(1, retry_after=3) >= 3
+        assert policy.backoff(1, retry_after=100) == 5
+
+    def test_next_delay(self):
+        policy = connection.RetryPolicy(max_attempts=3, backoff_base=1, backoff_max=5, deadline=10)
+        now = time.monotonic()
+        assert policy.next_delay(1, now) is not None
+        assert policy.next_delay(3, now) is None
+        # The retry would start after the deadline
+        assert policy.next_delay(1, now - 9.5, retry_after=1) is None
+
+    def test_query_retried(self, ce):
+        ce.fail_next(2)
+        assert connection.submit_query("query { Person { name } }") == {"data": {"Person": []}}
+        assert ce.stats["requests"] == 3
+
+    def test_max_attempts(self, ce):
+        ce.fail_next(5)
+        with mock.patch.object(config, "connection_retry_max_attempts", 3):
+            with pytest.raises(QueryException):
+                connection.submit_query("query { Person { name } }")
+        assert ce.stats["requests"] == 3
+
+    def test_mutation_retried_if_idempotent(self, ce):
+        mutation = 'mutation { MergePerson(identifier: "a", name: "A") { identifier } }'
+        ce.fail_next(1)
+        with pytest.raises(QueryException):
+            connection.submit_query(mutation)
+        assert ce.nodes() == []
+
+        ce.fail_next(1, status=502)
+        connection.submit_query(mutation, idempotent=True)
+        assert ce.nodes() == ["a"]
+
+        ce.fail_next(1)
+        with pytest.raises(QueryException):
+            connection.submit_query("query { Person { name } }", idempotent=False)
+
+    def test_connection_error(self):
+        response = mock.Mock(status_code=200, content=b'{"data": {}}')
+        session = connection.get_session()
+        with mock.patch.object(session, "post", side_effect=[requests.exceptions.ConnectionError(), response]), \
+                mock.patch.object(config, "connection_retry_backoff_base", 0.001):
+            assert connection.submit_query("query { Person { name } }") == {"data": {}}
+        connection.close_session()
+
+    def test_download_file(self, ce):
+        ce.add_node("Person", identifier="a", name="A")
+        ce.fail_next(2, status=504)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "a.json")
+            connection.download_file(ce.url + "a", path)
+            with open(path) as fp:
+                assert json.load(fp)["name"] == "A"
+            with pytest.raises(requests.exceptions.HTTPError):
+                connection.download_file(ce.url + "b", path)
+
+    def test_download_not_limited(self, ce):
+        ce.add_node("Person", identifier="a", name="A")
+        limiter = mock.Mock()
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                mock.patch.object(connection, "get_limiters", return_value=(limiter, limiter)):
+            connection.download_file(ce.url + "a", os.path.join(tmpdir, "a.json"))
+        assert not limiter.method_calls
+
+    def test_async(self, ce):
+        async def run():
+            try:
+                return await connection.submit_query_async("query { Person { name } }")
+            finally:
+                await connection.close_async_session()
+
+        ce.fail_next(2, status=429)
+        assert asyncio.run(run()) == {"data": {"Person": []}}
+        assert ce.stats["requests"] == 3
+
+
+class TestCircuitBreaker:
+
+    def test_states(self):
+        changes = []
+        breaker = connection.CircuitBreaker(failure_threshold=3, cooldown=0.05,
+                                            on_state_change=lambda b, old, new: changes.append((old, new)))
+        for _ in range(2):
+            breaker.before_request()
+            breaker.record(failed=True)
+        breaker.before_request()
+        breaker.record(failed=False)
+        assert breaker.state == breaker.CLOSED
+        for _ in range(3):
+            breaker.before_request()
+            breaker.record(failed=True)
+        assert breaker.state == breaker.OPEN
+        with pytest.raises(CircuitOpenException):
+            breaker.before_request()
+
+        time.sleep(0.06)
+        # Only one probe request is let through
+        breaker.before_request()
+        assert breaker.state == breaker.HALF_OPEN
+        with pytest.raises(CircuitOpenException):
+            breaker.before_request()
+        breaker.record(failed=True)
+        assert breaker.state == breaker.OPEN
+
+        time.sleep(0.06)
+        breaker.before_request()
+        breaker.record(failed=False)
+        assert breaker.state == breaker.CLOSED
+        assert changes == [("closed", "open"), ("open", "half-open"), ("half-open", "open"),
+                           ("open", "half-open"), ("half-open", "closed")]
+
+    def test_transport(self):
+        changes = []
+
+        def callback(breaker, old, new):
+            changes.append(new)
+
+        connection.close_session()
+        connection.add_circuit_breaker_callback(callback)
+        try:
+            with FakeCE() as ce, mock.patch.object(config, "host", ce.url), \
+                    mock.patch.object(config, "connection_circuit_breaker_threshold", 2), \
+                    mock.patch.object(config, "connection_circuit_breaker_cooldown", 0.05), \
+                    mock.patch.object(config, "connection_retry_max_attempts", 1):
+                ce.fail_next(3)
+                for _ in range(2):
+                    with pytest.raises(QueryException):
+                        connection.submit_query("query { Person { name } }")
+                with pytest.raises(CircuitOpenException):
+                    connection.submit_query("query { Person { name } }")
+                assert ce.stats["requests"] == 2
+                time.sleep(0.06)
+                # The probe fails, and the breaker opens again
+                with pytest.raises(QueryException):
+                    connection.submit_query("query { Person { name } }")
+                time.sleep(0.06)
+                connection.submit_query("query { Person { name } }")
+                connection.submit_query("query { Person { name } }")
+                assert ce.stats["requests"] == 5
+        finally:
+            connection.remove_circuit_breaker_callback(callback)
+            connection.close_session()
+        assert changes == ["open", "half-open", "open", "half-open", "closed"]
+
+    def test_timeout(self):
+        connection.close_session()
+        with FakeCE(latency=0.5) as ce, mock.patch.object(config, "host", ce.url), \
+                mock.patch.object(config, "connection_read_timeout", 0.05), \
+                mock.patch.object(config, "connection_retry_max_attempts", 1):
+            with pytest.raises(requests.exceptions.Timeout):
+                connection.submit_query("query { Person { name } }")
+        connection.close_session()
+
+    def test_probe_released_if_not_sent(self):
+        breaker = connection.CircuitBreaker(failure_threshold=1, cooldown=0.05)
+        breaker.before_request()
+        breaker.record(failed=True)
+        time.sleep(0.06)
+
+        def send():
+            return 200, {}, {}
+
+        limiter = mock.Mock()
+        limiter.acquire.side_effect = KeyboardInterrupt
+        with mock.patch.object(connection, "get_limiters", return_value=(limiter, None)):
+            with pytest.raises(KeyboardInterrupt):
+                connection._guarded(send, breaker)()
+        assert breaker.state == breaker.HALF_OPEN
+        # The probe was not sent, so another request may probe
+        connection._guarded(send, breaker)()
+        assert breaker.state == breaker.CLOSED
+
+    def test_probe_released_if_cancelled(self):
+        breaker = connection.CircuitBreaker(failure_threshold=1, cooldown=0.05)
+        breaker.before_request()
+        breaker.record(failed=True)
+        time.sleep(0.06)
+
+        async def send():
+            return 200, {}, {}
+
+        limiter = connection.RateLimiter(rate=1, burst=1)
+        limiter.reserve()
+
+        async def run():
+            task = asyncio.ensure_future(connection._guarded_async(send, breaker)())
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        with mock.patch.object(connection, "get_limiters", return_value=(limiter, None)):
+            asyncio.run(run())
+        assert breaker.state == breaker.HALF_OPEN
+        with mock.patch.object(connection, "get_limiters", return_value=(None, None)):
+            asyncio.run(connection._guarded_async(send, breaker)())
+        assert breaker.state == breaker.CLOSED
+
+    def test_cancelled_requests_not_failures(self):
+        connection.close_session()
+
+        async def run():
+            try:
+                tasks = [asyncio.ensure_future(connection.submit_query_async("query { Person { name } }"))
+                         for _ in range(6)]
+                await asyncio.sleep(0.1)
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                with pytest.raises(asyncio.TimeoutError):
+                    await asyncio.wait_for(connection.submit_query_async("query { Person { name } }"), 0.05)
+                assert connection.get_circuit_breaker().state == connection.CircuitBreaker.CLOSED
+            finally:
+                await connection.close_async_session()
+
+        with FakeCE(latency=0.3) as ce, mock.patch.object(config, "host", ce.url), \
+                mock.patch.object(config, "connection_circuit_breaker_threshold", 2):
+            asyncio.run(run())
+            assert connection.get_circuit_breaker().state == connection.CircuitBreaker.CLOSED
+            connection.submit_query("query { Person { name } }")
+        connection.close_session()
+
+
+class TestRateLimiter:
+
+    def test_burst_then_rate(self):
+        limiter = connection.RateLimiter(rate=100, burst=5)
+        delays = [limiter.reserve() for _ in range(10)]
+        assert delays[:5] == [0.0] * 5
+        assert delays[5:] == sorted(delays[5:])
+        assert 0.045 <= delays[-1] <= 0.05
+
+    def test_acquire(self):
+        limiter = connection.RateLimiter(rate=200, burst=1)
+        start = time.monotonic()
+        for _ in range(11):
+            limiter.acquire()
+        assert time.monotonic() - start >= 0.045
+        assert limiter.state()["tokens"] < 1
+
+    def test_acquire_async(self):
+        limiter = connection.RateLimiter(rate=200, burst=1)
+
+        async def run():
+            await asyncio.gather(*[limiter.acquire_async() for _ in range(11)])
+
+        start = time.monotonic()
+        asyncio.run(run())
+        assert time.monotonic() - start >= 0.045
+
+
+class TestAdaptiveConcurrencyLimiter:
+
+    def test_decrease_on_failure(self):
+        limiter = connection.AdaptiveConcurrencyLimiter(initial_limit=20, min_limit=2, max_limit=50)
+        limiter.acquire()
+        limiter.release(0.01, failed=True)
+        assert limiter.limit == 15
+        # Failures within the same round trip only reduce the limit once
+        limiter._short_latency = 10
+        limiter.acquire()
+        limiter.release(0.01, failed=True)
+        assert limiter.limit == 15
+        limiter._last_decrease = 0
+        for _ in range(20):
+            limiter._last_decrease = 0
+            limiter.acquire()
+            limiter.release(0.01, failed=True)
+        assert limiter.limit == 2
+        assert limiter.state()["failures"] == 22
+
+    def test_decrease_on_latency(self):
+        limiter = connection.AdaptiveConcurrencyLimiter(initial_limit=10, latency_target=0.1)
+        limiter.acquire()
+        limiter.release(0.5, failed=False)
+        assert limiter.limit == 7
+
+    def test_cancelled_request(self):
+        limiter = connection.AdaptiveConcurrencyLimiter(initial_limit=10)
+
+        async def send():
+            await asyncio.sleep(1)
+
+        async def run():
+            task = asyncio.ensure_future(connection._guarded_async(send, None)())
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        with mock.patch.object(connection, "get_limiters", return_value=(None, limiter)):
+            asyncio.run(run())
+        state = limiter.state()
+        assert (state["limit"], state["in_flight"], state["requests"], state["failures"]) == (10, 0, 0, 0)
+
+    def test_decrease_on_relative_latency(self):
+        limiter = connection.AdaptiveConcurrencyLimiter(initial_limit=10)
+        for _ in range(20):
+            limiter.acquire()
+            limiter.release(0.01, failed=False)
+        assert limiter.limit == 10
+        for _ in range(10):
+            limiter._last_decrease = 0
+            limiter.acquire()
+            limiter.release(0.2, failed=False)
+        assert limiter.limit < 10
+        # The usual latency doesn't follow latency while the CE is overloaded
+        assert limiter.state()["long_latency"] < 0.02
+
+    def test_increase_when_used(self):
+        limiter = connection.AdaptiveConcurrencyLimiter(initial_limit=4, max_limit=5)
+        # Only one request at a time, the limit isn't used
+        for _ in range(50):
+            limiter.acquire()
+            limiter.release(0.01, failed=False)
+        assert limiter.limit == 4
+        for _ in range(50):
+            for _ in range(4):
+                limiter.acquire()
+            for _ in range(4):
+                limiter.release(0.01, failed=False)
+        assert limiter.limit == 5
+
+    def test_limits_concurrency(self):
+        limiter = connection.AdaptiveConcurrencyLimiter(initial_limit=3, max_limit=3)
+        state = {"current": 0, "max": 0}
+        lock = threading.Lock()
+
+        def work():
+            limiter.acquire()
+            with lock:
+                state["current"] += 1
+                state["max"] = max(state["max"], state["current"])
+            time.sleep(0.005)
+            with lock:
+                state["current"] -= 1
+            limiter.release(0.005, failed=False)
+
+        threads = [threading.Thread(target=work) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert state["max"] == 3
+
+    def test_limits_concurrency_async(self):
+        limiter = connection.AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=2)
+        state = {"current": 0, "max": 0}
+
+        async def work():
+            await limiter.acquire_async()
+            state["current"] += 1
+            state["max"] = max(state["max"], state["current"])
+            await asyncio.sleep(0.005)
+            state["current"] -= 1
+            limiter.release(0.005, failed=False)
+
+        async def run():
+            await asyncio.gather(*[work() for _ in range(10)])
+
+        asyncio.run(run())
+        assert state["max"] == 2
+        assert limiter.state()["in_flight"] == 0
+
+    def test_transport(self):
+        connection.close_session()
+        with FakeCE() as ce, mock.patch.object(config, "host", ce.url), \
+                mock.patch.object(config, "connection_adaptive_concurrency", True), \
+                mock.patch.object(config, "connection_rate_limit", 1000), \
+                mock.patch.object(config, "connection_retry_backoff_base", 0.001):
+            ce.fail_next(3)
+            results = list(connection.submit_queries(["query { Person { name } }"] * 20, max_concurrency=4))
+            state = connection.limiter_state()
+        connection.close_session()
+        assert all(r.error is None for r in results)
+        assert state["concurrency_limiter"]["failures"] == 3
+        assert state["concurrency_limiter"]["requests"] == 23
+        assert state["rate_limiter"]["rate"] == 1000
+        assert connection.limiter_state() == {"rate_limiter": None, "concurrency_limiter": None}
+
+
+class TestSubmitQueries:
+
+    def _fake_submit_query(self, state):
+        lock = threading.Lock()
+
+        def submit_query(query, auth_required=False, idempotent=None):
+            with lock:
+                state["current"] += 1
+                state["max"] = max(state["max"], state["current"])
+            # Later queries finish first
+            time.sleep(0.001 * (20 - int(query)))
+            with lock:
+                state["current"] -= 1
+            if query == "13":
+                raise QueryException([{"message": "failed"}])
+            return {"data": query}
+        return submit_query
+
+    def test_ordered(self):
+        state = {"current": 0, "max": 0}
+        with mock.patch.object(connection, "submit_query", self._fake_submit_query(state)):
+            results = list(connection.submit_queries((str(i) for i in range(20)), max_concurrency=4))
+        assert [r.index for r in results] == list(range(20))
+        assert [r.query for r in results] == [str(i) for i in range(20)]
+        assert results[2].response == {"data": "2"}
+        assert results[2].error is None
+        assert results[13].response is None
+        assert isinstance(results[13].error, QueryException)
+        assert state["max"] <= 4
+
+    def test_unordered(self):
+        state = {"current": 0, "max": 0}
+        with mock.patch.object(connection, "submit_query", self._fake_submit_query(state)):
+            results = list(connection.submit_queries([str(i) for i in range(20)], max_concurrency=4, ordered=False))
+        assert sorted(r.index for r in results) == list(range(20))
+        assert all(r.response == {"data": r.query} for r in results if r.index != 13)
+
+    def test_input_consumed_lazily(self):
+        consumed = []
+
+        def queries():
+            for i in range(1000):
+                consumed.append(i)
+                yield str(i % 20)
+
+        with mock.patch.object(connection, "submit_query", lambda query, **kwargs: {"data": query}):
+            results = connection.submit_queries(queries(), max_concurrency=2)
+            next(results)
+            assert len(consumed) <= 5
+            results.close()
+
+
+class TestSubmitMutationSequence:
+
+    def test_results_in_order(self):
+        mutations = [(f"Alias{i}", "CreateListItem", {"position": i}) for i in range(10)]
+
+        def submit_query(query, auth_required=False, idempotent=None):
+            # Return the aliases in reverse order
+            aliases = [line.split(":")[0].strip() for line in query.splitlines() if "CreateListItem" in line]
+            return {"data": {alias: {"identifier": alias.lower()} for alias in reversed(aliases)}}
+
+        with mock.patch.object(connection, "submit_query", side_effect=submit_query) as fake:
+            result = connection.submit_mutation_sequence(mutations, max_aliases=3)
+        assert fake.call_count == 4
+        assert list(result.keys()) == [f"Alias{i}" for i in range(10)]
+        assert result["Alias4"] == {"identifier": "alias4"}
+
+    def test_error(self):
+        mutations = [(f"Alias{i}", "CreateListItem", {"position": i}) for i in range(10)]
+        with mock.patch.object(connection, "submit_query", side_effect=QueryException([{"message": "failed"}])):
+            with pytest.raises(QueryException):
+                connection.submit_mutation_sequence(mutations, max_aliases=3)
+
+
+class TestIterateQuery:
+
+    @pytest.fixture
+    def ce(self, ce):
+        for i in range(25):
+            ce.add_node("Person", identifier=f"p{i:02d}", name="Bach" if i % 2 else "Mozart")
+        ce.add_node("MusicComposition", identifier="m00", name="Fugue")
+        return ce
+
+    @pytest.mark.parametrize("paging", ["keyset", "offset"])
+    @pytest.mark.parametrize("prefetch", [True, False])
+    def test_all_pages(self, ce, paging, prefetch):
+        results = list(connection.iterate_query("ThingInterface", page_size=10, paging=paging, prefetch=prefetch))
+        assert [r["identifier"] for r in results] == ["m00"] + [f"p{i:02d}" for i in range(25)]
+        # 3 full pages and an empty one
+        assert ce.stats["queries"] == 3
+
+    def test_filter_and_fields(self, ce):
+        results = list(connection.iterate_query("Person", filter={"name": "Bach", "identifier_gt": "p10"},
+                                                fields=["name"], page_size=4))
+        assert results == [{"identifier": f"p{i:02d}", "name": "Bach"} for i in range(11, 25, 2)]
+
+    def test_exact_pages(self, ce):
+        results = list(connection.iterate_query("Person", page_size=5))
+        assert len(results) == 25
+        assert ce.stats["queries"] == 6
+
+    def test_prefetch(self, ce):
+        results = connection.iterate_query("Person", page_size=10)
+        next(results)
+        # The second page is requested while the first one is processed
+        deadline = time.monotonic() + 5
+        while ce.stats["queries"] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert ce.stats["queries"] == 2
+        results.close()
+
+    def test_invalid_arguments(self):
+        with pytest.raises(ValueError):
+            next(connection.iterate_query("Person", page_size=0))
+        with pytest.raises(ValueError):
+            next(connection.iterate_query("Person", paging="cursor"))
+
+
+class TestAsync:
+    """Async requests against a local aiohttp server"""
+
+    async def _serve(self, handler, coro_fn):
+        app = web.Application()
+        app.router.add_post("/", handler)
+        app.router.add_get("/file", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        try:
+            with mock.patch.object(config, "host", f"http://127.0.0.1:{port}/"):
+                return await coro_fn(f"http://127.0.0.1:{port}/")
+        finally:
+            await connection.close_async_session()
+            await runner.cleanup()
+
+    def test_max_in_flight(self):
+        state = {"current": 0, "max": 0}
+
+        async def handler(request):
+            state["current"] += 1
+            state["max"] = max(state["max"], state["current"])
+            await asyncio.sleep(0.01)
+            state["current"] -= 1
+            body = await request.json()
+            return web.json_response({"data": {"query": body["query"]}})
+
+        async def run(host):
+            queries = [f"query {{ Person(identifier: \"{i}\") {{ identifier }} }}" for i in range(20)]
+            return await asyncio.gather(*[connection.submit_query_async(q) for q in queries])
+
+        with mock.patch.object(config, "connection_max_in_flight", 3):
+            results = asyncio.run(self._serve(handler, run))
+        assert len(results) == 20
+        assert results[5]["data"]["query"] == 'query { Person(identifier: "5") { identifier } }'
+        assert state["max"] <= 3
+
+    def test_submit_query_async_errors(self):
+        async def handler(request):
+            return web.json_response({"errors": [{"message": "Unknown field"}]})
+
+        async def run(host):
+            return await connection.submit_query_async("query { Person { identifier } }")
+
+        with pytest.raises(QueryException):
+            asyncio.run(self._serve(handler, run))
+
+    def test_download_file_async(self):
+        async def handler(request):
+            return web.Response(body=b"x" * 20000)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "out.bin")
+
+            async def run(host):
+                await connection.download_file_async(host + "file", path)
+
+            asyncio.run(self._serve(handler, run))
+            with open(path, "rb") as fp:
+                assert fp.read() == b"x" * 20000
+
+    def test_persisted_queries(self):
+        stored = {}
+        requests = []
+
+        async def handler(request):
+            body = await request.json()
+            requests.append(body)
+            query_hash = body["extensions"]["persistedQuery"]["sha256Hash"]
+            if "query" in body:
+                stored[query_hash] = body["query"]
+            elif query_hash not in stored:
+                return web.json_response({"errors": [{"message": "PersistedQueryNotFound"}]})
+            return web.json_response({"data": {"query": stored[query_hash], "variables": body.get("variables")}})
+
+        async def run(host):
+            operation = Operation("query($id: ID!) { Person(identifier: $id) { name } }", {"id": "a"})
+            first = await connection.submit_query_async(operation)
+            second = await connection.submit_query_async(operation, variables={"id": "b"})
+            return first, second
+
+        with mock.patch.object(config, "connection_persisted_queries", True):
+            first, second = asyncio.run(self._serve(handler, run))
+        assert first["data"]["variables"] == {"id": "a"}
+        assert second["data"]["query"] == "query($id: ID!) { Person(identifier: $id) { name } }"
+        assert second["data"]["variables"] == {"id": "b"}
+        assert len(requests) == 3
+        assert "query" not in requests[2]
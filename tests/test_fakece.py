@@ -0,0 +1,167 @@
+import asyncio
+import json
+import time
+from unittest import mock
+
+import jwt
+import pytest
+import requests
+import websockets
+
+from trompace import connection, use_variables
+from trompace.client import client_itemlist
+from trompace.config import config
+from trompace.exceptions import QueryException
+from trompace.mutations import person, controlaction
+from trompace.queries import person as query_person
+from trompace.subscriptions.controlaction import subscription_controlaction
+
+
+def _create_person(name):
+    mutation = person.mutation_create_person(title=name, contributor="https://www.upf.edu",
+                                             creator="https://www.upf.edu", source="https://example.com/" + name,
+                                             format_="text/html", name=name, language="en")
+    return connection.submit_query(mutation)["data"]["CreatePerson"]["identifier"]
+
+
+class TestFakeCE:
+
+    def test_create_query_update_delete(self, ce):
+        identifier = _create_person("Bach")
+        node = ce.get_node(identifier)
+        assert node["__typename"] == "Person"
+        assert node["name"] == "Bach"
+        assert node["language"] == "en"
+        assert "formatted" in node["created"]
+
+        response = connection.submit_query(query_person.query_person(identifier=identifier))
+        assert response["data"]["Person"][0]["name"] == "Bach"
+
+        connection.submit_query(person.mutation_update_person(identifier, name="J.S. Bach"))
+        assert ce.get_node(identifier)["name"] == "J.S. Bach"
+
+        connection.submit_query(person.mutation_delete_person(identifier))
+        assert ce.get_node(identifier) is None
+
+    def test_variables(self, ce):
+        with use_variables():
+            identifier = _create_person("Bach")
+        assert ce.get_node(identifier)["name"] == "Bach"
+
+    def test_filter_order_paginate(self, ce):
+        for name in ["c", "a", "d", "b"]:
+            ce.add_node("Person", identifier=name, name=name)
+        ce.add_node("MusicComposition", identifier="e", name="e")
+        response = ce.execute('query { Person(orderBy: name_desc, first: 2, offset: 1) { name } }')
+        assert response["data"]["Person"] == [{"name": "c"}, {"name": "b"}]
+        response = ce.execute('query { ThingInterface(filter: {identifier_in: ["a", "e", "x"]}) '
+                              '{ identifier __typename } }')
+        assert sorted(r["identifier"] for r in response["data"]["ThingInterface"]) == ["a", "e"]
+        response = ce.execute('query { Person(filter: {name_gt: "b"}) { name } }')
+        assert sorted(r["name"] for r in response["data"]["Person"]) == ["c", "d"]
+
+    def test_itemlist(self, ce):
+        identifier = _create_person("Bach")
+        client_itemlist.create_itemlist(name="list", description="A list", ordered=True,
+                                        contributor="https://www.upf.edu", creator="https://www.upf.edu",
+                                        values=["one", "two", "three"])
+        itemlist_id, = ce.nodes("ItemList")
+        listitems = ce.get_node(itemlist_id)["itemListElement"]
+        assert len(listitems) == 3
+        assert ce.get_node(listitems[0])["nextItem"] == listitems[1]
+        assert ce.get_node(listitems[1])["position"] == 1
+
+        itemlist = client_itemlist.itemlist_node_exists(itemlist_id)[0]
+        assert [e["identifier"] for e in itemlist["itemListElement"]] == listitems
+
+        ce.add_relation(listitems[0], "item", identifier)
+        response = ce.execute('query { ListItem(identifier: "%s") { item { ... on Person { name } } } }'
+                              % listitems[0])
+        assert response["data"]["ListItem"][0]["item"] == {"name": "Bach"}
+
+    def test_link_missing_node_returns_null(self, ce):
+        response = ce.execute('mutation { MergeListItemNextItem(from: {identifier: "a"}, to: {identifier: "b"}) '
+                              '{ from { identifier } } }')
+        assert response["data"] == {"MergeListItemNextItem": None}
+
+    def test_unknown_mutation(self, ce):
+        with pytest.raises(QueryException):
+            connection.submit_query('mutation { FrobnicatePerson(identifier: "a") { identifier } }')
+
+    def test_persisted_queries(self, ce):
+        connection.persisted_queries = connection.PersistedQueryRegistry()
+        try:
+            with mock.patch.object(config, "connection_persisted_queries", True):
+                ce.add_node("Person", identifier="a", name="a")
+                query = 'query { Person { name } }'
+                assert connection.submit_query(query)["data"]["Person"] == [{"name": "a"}]
+                assert connection.submit_query(query)["data"]["Person"] == [{"name": "a"}]
+            assert ce.stats["requests"] == 3
+        finally:
+            connection.persisted_queries = connection.PersistedQueryRegistry()
+
+    def test_jwt_and_auth(self, ce):
+        ce.require_auth = True
+        response = requests.post(ce.url + "jwt", json={"id": "client", "apiKey": "key", "scopes": ["*"]}).json()
+        assert response["success"]
+        token = jwt.decode(response["jwt"], ce.jwt_secret, algorithms=["HS256"])
+        assert token["exp"] > time.time()
+
+        with pytest.raises(QueryException):
+            _create_person("Bach")
+        with mock.patch.object(config, "jwt_token_encoded", response["jwt"]), \
+                mock.patch.object(config, "jwt_token_decoded", token):
+            mutation = person.mutation_create_person(title="x", contributor="x", creator="x", source="x",
+                                                     format_="text/html", name="x")
+            connection.submit_query(mutation, auth_required=True)
+        assert len(ce.nodes("Person")) == 1
+
+    def test_injected_errors(self, ce):
+        ce.fail_next(2)
+        assert requests.post(ce.url, json={"query": "query { Person { name } }"}).status_code == 503
+        assert requests.post(ce.url, json={"query": "query { Person { name } }"}).status_code == 503
+        assert requests.post(ce.url, json={"query": "query { Person { name } }"}).status_code == 200
+        assert ce.stats["injected_errors"] == 2
+
+        ce.error_rate = 1.0
+        ce.error_status = 429
+        assert requests.post(ce.url, json={"query": "query { Person { name } }"}).status_code == 429
+
+    def test_injected_latency(self, ce):
+        ce.latency = 0.05
+        results = list(connection.submit_queries(["query { Person { name } }"] * 8, max_concurrency=8))
+        assert all(r.error is None for r in results)
+        assert ce.stats["max_in_flight"] > 1
+
+    def test_jsonld(self, ce):
+        ce.add_node("Person", identifier="a", name="Bach")
+        response = requests.get(ce.url + "a")
+        assert response.headers["Content-Type"].startswith("application/ld+json")
+        assert response.json()["@type"] == "Person"
+        assert response.json()["name"] == "Bach"
+        assert requests.get(ce.url + "b").status_code == 404
+
+    def test_subscription(self, ce):
+        template = ce.add_node("ControlAction", name="Transcribe")
+        entrypoint = ce.add_node("EntryPoint", name="App")
+
+        async def run():
+            async with websockets.connect(ce.websocket_url, subprotocols=["graphql-ws"]) as websocket:
+                await websocket.send(json.dumps({"type": "connection_init", "payload": {}}))
+                assert await websocket.recv() == '{"type":"connection_ack"}'
+                await websocket.send(json.dumps({"id": "1", "type": "start", "payload": {
+                    "query": subscription_controlaction(entrypoint)}}))
+                await asyncio.sleep(0.05)
+                mutation = controlaction.mutation_request_controlaction(template, entrypoint, [], [])
+                response = await connection.submit_query_async(mutation)
+                message = json.loads(await asyncio.wait_for(websocket.recv(), 5))
+                await connection.close_async_session()
+                return response, message
+
+        response, message = asyncio.run(run())
+        identifier = response["data"]["RequestControlAction"]["identifier"]
+        assert message["type"] == "data"
+        assert message["payload"]["data"]["ControlActionRequest"] == {"identifier": identifier}
+        node = ce.get_node(identifier)
+        assert node["actionStatus"] == "PotentialActionStatus"
+        assert node["wasDerivedFrom"] == [template]
@@ -0,0 +1,54 @@
+import subprocess
+import sys
+
+import pytest
+
+import trompace
+
+# Dependencies that are only needed to talk to the CE
+HEAVY_MODULES = {"requests", "jwt", "websockets", "configparser", "aiohttp", "aiofiles", "graphql"}
+# Generous budget in seconds for importing a module, to catch a heavy dependency being imported by accident
+STARTUP_BUDGET = 0.15
+
+
+def _import_times(module):
+    """Import ``module`` in a new interpreter with ``-X importtime``
+    Returns:
+        A dictionary of {module name: cumulative import time in seconds} of every module that was imported
+    """
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            check=True, capture_output=True, text=True).stderr
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+class TestImports:
+
+    @pytest.mark.parametrize("module, forbidden", [
+        ("trompace", HEAVY_MODULES | {"trompace.config", "trompace.mutations"}),
+        ("trompace.mutations.person", HEAVY_MODULES),
+        ("trompace.queries.person", HEAVY_MODULES),
+        ("trompace.config", HEAVY_MODULES),
+        ("trompace.connection", HEAVY_MODULES),
+    ])
+    def test_no_heavy_imports(self, module, forbidden):
+        times = _import_times(module)
+        assert module in times
+        assert not forbidden & times.keys()
+
+    def test_startup_budget(self):
+        # Take the best of a few runs, so that a busy machine doesn't make the test fail
+        best = min(_import_times("trompace.mutations.person")["trompace.mutations.person"] for _ in range(3))
+        assert best < STARTUP_BUDGET
+
+    def test_lazy_submodules(self):
+        assert trompace.connection.submit_query
+        assert trompace.mutations.person.mutation_create_person
+        assert trompace.queries.person.query_person
+        with pytest.raises(AttributeError):
+            trompace.not_a_module
@@ -0,0 +1,429 @@
+from unittest import mock
+
+import pytest
+
+from trompace.client import client_itemlist
+from trompace.config import config
+from trompace.exceptions import IDNotFoundException
+
+
+@pytest.fixture
+def ce(ce):
+    for i in range(25):
+        ce.add_node("Person", identifier=f"p{i:02d}", name=f"Person {i}")
+    with mock.patch.object(config, "server_auth_required", False):
+        yield ce
+
+
+class TestNonexistentNodes:
+
+    def test_chunks(self, ce):
+        ids = [f"p{i:02d}" for i in range(25)] + ["x1", "x2", "p03"]
+        assert client_itemlist.get_nonexistent_listitem_nodes(ids, chunk_size=10) == {"x1", "x2"}
+        assert ce.stats["queries"] == 3
+
+    def test_none_exist(self, ce):
+        assert client_itemlist.get_nonexistent_listitem_nodes(["x1", "x2"]) == {"x1", "x2"}
+
+    def test_cache(self, ce):
+        cache = client_itemlist.ExistenceCache(ttl=60)
+        assert client_itemlist.get_nonexistent_listitem_nodes(["p00", "p01", "x1"], cache=cache) == {"x1"}
+        assert "p00" in cache
+        assert "x1" not in cache
+        ce.reset_stats()
+        assert client_itemlist.get_nonexistent_listitem_nodes(["p00", "p01"], cache=cache) == set()
+        assert ce.stats["queries"] == 0
+        # Only unknown identifiers are checked
+        assert client_itemlist.get_nonexistent_listitem_nodes(["p00", "p02", "x1"], cache=cache) == {"x1"}
+        assert ce.stats["queries"] == 1
+
+    def test_cache_expiry(self):
+        cache = client_itemlist.ExistenceCache(ttl=-1)
+        cache.add(["a"])
+        assert "a" not in cache
+        cache = client_itemlist.ExistenceCache(max_size=2)
+        cache.add(["a", "b", "c"])
+        assert "a" not in cache
+        assert "c" in cache
+
+    def test_create_itemlist_missing_node(self, ce):
+        with pytest.raises(IDNotFoundException):
+            client_itemlist.create_itemlist(name="list", description="A list", ordered=True,
+                                            creator="https://www.upf.edu", node_ids=["p00", "x1"])
+
+
+def _create_itemlist(ce, values):
+    client_itemlist.create_itemlist(name="list", description="A list", ordered=True,
+                                    creator="https://www.upf.edu", values=values)
+    return ce.nodes("ItemList")[-1]
+
+
+def _chain(ce, itemlist_id):
+    """The descriptions of the elements of an ItemList, following nextItem from the first element,
+    checking that positions and the nextItem chain agree"""
+    elements = [ce.get_node(e) for e in ce.get_node(itemlist_id)["itemListElement"]]
+    targets = {e.get("nextItem") for e in elements}
+    first, = [e for e in elements if e["identifier"] not in targets]
+    chain = [first]
+    while chain[-1].get("nextItem"):
+        chain.append(ce.get_node(chain[-1]["nextItem"]))
+    assert len(chain) == len(elements)
+    assert [e["position"] for e in chain] == sorted(e["position"] for e in chain)
+    return [e["description"] for e in chain]
+
+
+class TestInsertListItem:
+
+    @pytest.mark.parametrize("position", [0, 2, 5])
+    def test_insert_position(self, ce, position):
+        itemlist_id = _create_itemlist(ce, ["a", "b", "c", "d", "e"])
+        ce.reset_stats()
+        client_itemlist.insert_listitem_itemlist(contributor="https://www.upf.edu", name="item", description="x",
+                                                 listitem="x", itemlist_id=itemlist_id, ids_mode=False,
+                                                 append=False, position=position, creator="https://www.upf.edu")
+        expected = ["a", "b", "c", "d", "e"]
+        expected.insert(position, "x")
+        assert _chain(ce, itemlist_id) == expected
+        # Query the list, create the ListItem, link it and update positions
+        assert ce.stats["requests"] == 3
+
+    def test_append(self, ce):
+        itemlist_id = _create_itemlist(ce, ["a", "b"])
+        listitem_id = client_itemlist.insert_listitem_itemlist(
+            contributor="https://www.upf.edu", name="item", description="p00", listitem="p00",
+            itemlist_id=itemlist_id, ids_mode=True, append=True, creator="https://www.upf.edu")
+        assert ce.get_node(listitem_id)["item"] == "p00"
+        assert ce.get_node(listitem_id)["position"] == 2
+        assert len(ce.get_node(itemlist_id)["itemListElement"]) == 3
+
+    def test_insert_long_list(self, ce):
+        values = [f"v{i}" for i in range(1200)]
+        itemlist_id = _create_itemlist(ce, values)
+        ce.reset_stats()
+        client_itemlist.insert_listitem_itemlist(contributor="https://www.upf.edu", name="item", description="x",
+                                                 listitem="x", itemlist_id=itemlist_id, ids_mode=False,
+                                                 append=False, position=0, creator="https://www.upf.edu")
+        assert _chain(ce, itemlist_id) == ["x"] + values
+        # The position updates are split into a few chunks of aliased mutations
+        assert ce.stats["requests"] == 2 + 3
+
+    def test_invalid_position(self, ce):
+        itemlist_id = _create_itemlist(ce, ["a"])
+        with pytest.raises(ValueError):
+            client_itemlist.insert_listitem_itemlist(contributor="https://www.upf.edu", name="item", description="x",
+                                                     listitem="x", itemlist_id=itemlist_id, ids_mode=False,
+                                                     append=False, position=3, creator="https://www.upf.edu")
+
+
+class TestSparsePositions:
+
+    def _insert(self, itemlist_id, value, position):
+        return client_itemlist.insert_listitem_itemlist(
+            contributor="https://www.upf.edu", name="item", description=value, listitem=value,
+            itemlist_id=itemlist_id, ids_mode=False, append=False, position=position,
+            creator="https://www.upf.edu", position_strategy="sparse")
+
+    def test_insert_position(self):
+        gap = client_itemlist.POSITION_GAP
+        assert client_itemlist.sparse_positions(3) == [gap, 2 * gap, 3 * gap]
+        assert client_itemlist.sparse_insert_position([gap, 2 * gap], 0) == gap // 2
+        assert client_itemlist.sparse_insert_position([gap, 2 * gap], 1) == 3 * gap // 2
+        assert client_itemlist.sparse_insert_position([gap, 2 * gap], 2) == 3 * gap
+        assert client_itemlist.sparse_insert_position([], 0) == gap
+        assert client_itemlist.sparse_insert_position([4, 5], 1) is None
+        assert client_itemlist.sparse_insert_position([0, 1], 0) is None
+
+    def test_create(self, ce):
+        client_itemlist.create_itemlist(name="list", description="A list", ordered=True, creator="https://www.upf.edu",
+                                        values=["a", "b", "c"], position_strategy="sparse")
+        itemlist_id = ce.nodes("ItemList")[-1]
+        positions = sorted(ce.get_node(e)["position"] for e in ce.get_node(itemlist_id)["itemListElement"])
+        assert positions == client_itemlist.sparse_positions(3)
+
+    def test_insert_without_renumbering(self, ce):
+        client_itemlist.create_itemlist(name="list", description="A list", ordered=True, creator="https://www.upf.edu",
+                                        values=["a", "b", "c", "d"], position_strategy="sparse")
+        itemlist_id = ce.nodes("ItemList")[-1]
+        before = {e: ce.get_node(e)["position"] for e in ce.get_node(itemlist_id)["itemListElement"]}
+        self._insert(itemlist_id, "x", 1)
+        self._insert(itemlist_id, "y", 0)
+        self._insert(itemlist_id, "z", 6)
+        assert _chain(ce, itemlist_id) == ["y", "a", "x", "b", "c", "d", "z"]
+        assert {e: ce.get_node(e)["position"] for e in before} == before
+
+    def test_rebalance(self, ce):
+        itemlist_id = _create_itemlist(ce, ["a", "b", "c"])
+        # A list created with dense positions has no gaps, it is renumbered on the first insert
+        self._insert(itemlist_id, "x", 1)
+        positions = sorted(ce.get_node(e)["position"] for e in ce.get_node(itemlist_id)["itemListElement"])
+        assert positions == client_itemlist.sparse_positions(4)
+        # Fill the gap between "a" and "x" until it is exhausted
+        for k in range(12):
+            self._insert(itemlist_id, f"y{k}", 1)
+        assert _chain(ce, itemlist_id) == ["a"] + [f"y{k}" for k in reversed(range(12))] + ["x", "b", "c"]
+        positions = [ce.get_node(e)["position"] for e in ce.get_node(itemlist_id)["itemListElement"]]
+        assert len(set(positions)) == len(positions)
+
+    def test_invalid_strategy(self, ce):
+        with pytest.raises(ValueError):
+            client_itemlist.create_itemlist(name="list", description="A list", ordered=True,
+                                            creator="https://www.upf.edu", values=["a"], position_strategy="gaps")
+
+
+class TestEditItemList:
+
+    def _ids(self, ce, itemlist_id):
+        by_description = {ce.get_node(e)["description"]: e for e in ce.get_node(itemlist_id)["itemListElement"]}
+        return by_description
+
+    def test_lis(self):
+        lis = client_itemlist._longest_increasing_subsequence([3, 1, 2, 5, 4, 6])
+        assert sorted(lis) in ([1, 2, 3, 5], [1, 2, 4, 5])
+        assert client_itemlist._longest_increasing_subsequence([]) == set()
+
+    def test_plan_minimal(self):
+        elements = [{"identifier": "a", "position": 0, "nextItem": {"identifier": "b"}},
+                    {"identifier": "b", "position": 1, "nextItem": {"identifier": "c"}},
+                    {"identifier": "c", "position": 2, "nextItem": {"identifier": "d"}},
+                    {"identifier": "d", "position": 3, "nextItem": None}]
+        assert client_itemlist.plan_itemlist_edit(elements, ["a", "b", "c", "d"]) == []
+        mutations = client_itemlist.plan_itemlist_edit(elements, ["a", "c", "b", "d"])
+        assert [(name, args) for _, name, args in mutations] == [
+            ("RemoveListItemNextItem", ["a", "b"]),
+            ("RemoveListItemNextItem", ["b", "c"]),
+            ("RemoveListItemNextItem", ["c", "d"]),
+            ("MergeListItemNextItem", ["a", "c"]),
+            ("MergeListItemNextItem", ["c", "b"]),
+            ("MergeListItemNextItem", ["b", "d"]),
+            ("UpdateListItem", {"identifier": "c", "position": 1}),
+            ("UpdateListItem", {"identifier": "b", "position": 2}),
+        ]
+        mutations = client_itemlist.plan_itemlist_edit(elements, ["a", "c", "d"])
+        assert [(name, args) for _, name, args in mutations] == [
+            ("DeleteListItem", {"identifier": "b"}),
+            ("MergeListItemNextItem", ["a", "c"]),
+            ("UpdateListItem", {"identifier": "c", "position": 1}),
+            ("UpdateListItem", {"identifier": "d", "position": 2}),
+        ]
+        # With sparse positions, removing an element doesn't renumber the others
+        mutations = client_itemlist.plan_itemlist_edit(elements, ["a", "c", "d"], position_strategy="sparse")
+        assert [name for _, name, _ in mutations] == ["DeleteListItem", "MergeListItemNextItem"]
+        with pytest.raises(ValueError):
+            client_itemlist.plan_itemlist_edit(elements, ["a", "x"])
+
+    def test_sparse_reposition(self):
+        gap = client_itemlist.POSITION_GAP
+        # Only the moved element gets a new position
+        assert client_itemlist._sparse_reposition([gap, 3 * gap, 2 * gap, 4 * gap]) in (
+            [gap, 3 * gap // 2, 2 * gap, 4 * gap], [gap, 3 * gap, 7 * gap // 2, 4 * gap])
+        assert client_itemlist._sparse_reposition([2, 1, 3]) == client_itemlist.sparse_positions(3)
+
+    def test_apply_ops(self, ce):
+        itemlist_id = _create_itemlist(ce, ["a", "b", "c", "d", "e"])
+        ids = self._ids(ce, itemlist_id)
+        ce.reset_stats()
+        order = client_itemlist.apply_itemlist_ops(itemlist_id, [("move", ids["e"], 0), ("remove", ids["c"]),
+                                                                 ("swap", ids["a"], ids["d"])])
+        assert order == [ids[x] for x in ["e", "d", "b", "a"]]
+        assert _chain(ce, itemlist_id) == ["e", "d", "b", "a"]
+        assert sorted(ce.get_node(i)["position"] for i in order) == [0, 1, 2, 3]
+        assert ids["c"] not in ce.nodes("ListItem")
+        # One query for the list and one request for all the changes
+        assert ce.stats["requests"] == 2
+
+    def test_move_remove_swap(self, ce):
+        itemlist_id = _create_itemlist(ce, ["a", "b", "c", "d"])
+        ids = self._ids(ce, itemlist_id)
+        client_itemlist.move_listitem(itemlist_id, ids["a"], 3)
+        assert _chain(ce, itemlist_id) == ["b", "c", "d", "a"]
+        client_itemlist.swap_listitems(itemlist_id, ids["b"], ids["d"])
+        assert _chain(ce, itemlist_id) == ["d", "c", "b", "a"]
+        client_itemlist.remove_listitem(itemlist_id, ids["a"])
+        assert _chain(ce, itemlist_id) == ["d", "c", "b"]
+        with pytest.raises(ValueError):
+            client_itemlist.move_listitem(itemlist_id, ids["a"], 0)
+
+    def test_reorder_sparse(self, ce):
+        client_itemlist.create_itemlist(name="list", description="A list", ordered=True, creator="https://www.upf.edu",
+                                        values=["a", "b", "c", "d", "e"], position_strategy="sparse")
+        itemlist_id = ce.nodes("ItemList")[-1]
+        ids = self._ids(ce, itemlist_id)
+        before = {i: ce.get_node(i)["position"] for i in ids.values()}
+        client_itemlist.reorder_itemlist(itemlist_id, [ids[x] for x in ["a", "c", "d", "b", "e"]],
+                                         position_strategy="sparse")
+        assert _chain(ce, itemlist_id) == ["a", "c", "d", "b", "e"]
+        changed = [x for x, i in ids.items() if ce.get_node(i)["position"] != before[i]]
+        assert changed == ["b"]
+        with pytest.raises(ValueError):
+            client_itemlist.reorder_itemlist(itemlist_id, [ids["a"]])
+
+
+class TestSyncItemList:
+
+    def _create(self, ce, item_ids, **kwargs):
+        client_itemlist.create_itemlist(name="list", description="A list", ordered=True, creator="https://www.upf.edu",
+                                        node_ids=item_ids, **kwargs)
+        return ce.nodes("ItemList")[-1]
+
+    def _items(self, ce, itemlist_id):
+        elements = [ce.get_node(e) for e in ce.get_node(itemlist_id)["itemListElement"]]
+        targets = {e.get("nextItem") for e in elements}
+        element, = [e for e in elements if e["identifier"] not in targets]
+        items = [element["item"]]
+        while element.get("nextItem"):
+            element = ce.get_node(element["nextItem"])
+            items.append(element["item"])
+        assert len(items) == len(elements)
+        return items
+
+    def test_sync(self, ce):
+        people = [f"p{i:02d}" for i in range(25)]
+        itemlist_id = self._create(ce, people[:10])
+        listitems = set(ce.nodes("ListItem"))
+        desired = ["p20", "p00", "p02", "p01", "p03", "p04", "p05", "p06", "p08", "p09", "p21"]
+        order = client_itemlist.sync_itemlist(itemlist_id, desired, creator="https://www.upf.edu")
+        assert _positions_in_order(ce, order)
+        assert self._items(ce, itemlist_id) == desired
+        # Existing ListItems are reused, and the ListItem for p07 is deleted
+        assert len(listitems - set(ce.nodes("ListItem"))) == 1
+        assert len(set(ce.nodes("ListItem")) - listitems) == 2
+
+    def test_unchanged(self, ce):
+        itemlist_id = self._create(ce, ["p00", "p01", "p02"])
+        ce.reset_stats()
+        client_itemlist.sync_itemlist(itemlist_id, ["p00", "p01", "p02"])
+        assert ce.stats["requests"] == 1
+
+    def test_small_change_sparse(self, ce):
+        people = [f"p{i:02d}" for i in range(25)]
+        itemlist_id = self._create(ce, people, position_strategy="sparse")
+        before = {e: ce.get_node(e)["position"] for e in ce.nodes("ListItem")}
+        desired = people[:12] + people[13:] + ["p12"]
+        ce.reset_stats()
+        order = client_itemlist.sync_itemlist(itemlist_id, desired, position_strategy="sparse")
+        assert self._items(ce, itemlist_id) == desired
+        assert _positions_in_order(ce, order)
+        assert [e for e in before if ce.get_node(e)["position"] != before[e]] == [order[-1]]
+        assert ce.stats["requests"] == 2
+
+    def test_duplicates_and_new(self, ce):
+        itemlist_id = self._create(ce, ["p00", "p01"])
+        desired = ["p01", "p00", "p01", "p05"]
+        order = client_itemlist.sync_itemlist(itemlist_id, desired, creator="https://www.upf.edu")
+        assert self._items(ce, itemlist_id) == desired
+        assert len(set(order)) == 4
+
+    def test_missing_item(self, ce):
+        itemlist_id = self._create(ce, ["p00", "p01"])
+        with pytest.raises(IDNotFoundException):
+            client_itemlist.sync_itemlist(itemlist_id, ["p00", "x1"])
+
+    def test_missing_itemlist(self, ce):
+        with pytest.raises(IDNotFoundException):
+            client_itemlist.sync_itemlist("nope", ["p00"])
+        with pytest.raises(IDNotFoundException):
+            client_itemlist.insert_listitem_itemlist("x", "x", None, "p00", "nope", ids_mode=True, append=True)
+        assert client_itemlist.itemlist_node_exists("nope") == []
+
+
+def _positions_in_order(ce, listitem_ids):
+    positions = [ce.get_node(i)["position"] for i in listitem_ids]
+    return positions == sorted(set(positions))
+
+
+def _elements(identifiers, positions=None, next_ids=None):
+    positions = positions if positions is not None else range(len(identifiers))
+    if next_ids is None:
+        next_ids = list(identifiers[1:]) + [None]
+    return [{"identifier": identifier, "position": position,
+             "nextItem": {"identifier": next_id} if next_id else None, "item": {"identifier": f"i{identifier}"}}
+            for identifier, position, next_id in zip(identifiers, positions, next_ids)]
+
+
+class TestItemListView:
+
+    def test_lookup(self):
+        elements = _elements(["a", "b", "c", "d"], positions=[0, 10, 20, 30])
+        view = client_itemlist.ItemListView("list", list(reversed(elements)))
+        assert view.identifiers() == ["a", "b", "c", "d"]
+        assert view[1].identifier == "b"
+        assert view.index("c") == 2
+        assert view.get("d").item_id == "id"
+        assert view.at_position(20).identifier == "c"
+        assert "x" not in view
+        assert view.find("x") is None
+        assert view.check_chain() == []
+
+    def test_check_chain(self):
+        def problems(identifiers, next_ids, positions=None):
+            return client_itemlist.ItemListView(None, _elements(identifiers, positions, next_ids)).check_chain()
+
+        assert problems(["a", "b", "c"], ["b", None, None]) == \
+            ["The nextItem chain is broken into 2 parts, starting at a, c"]
+        assert problems(["a", "b", "c"], ["b", "c", "b"]) == \
+            ["b is the nextItem of more than one ListItem", "The nextItem chain starting at a has a cycle at b"]
+        assert problems(["a", "b", "c"], ["b", "c", "a"]) == ["3 ListItems are in a cycle that no chain leads to"]
+        assert problems(["a", "b"], ["x", None]) == ["The nextItem of a is not in the ItemList",
+                                                     "The nextItem chain is broken into 2 parts, starting at a, b"]
+        assert problems(["a", "b", "c"], ["c", None, "b"]) == \
+            ["The nextItem chain doesn't follow the order of the positions"]
+        assert problems(["a", "b"], ["b", None], positions=[1, 1]) == ["Several ListItems have the same position"]
+        assert problems(["a", "b"], ["b", None], positions=[0, None]) == ["ListItems with position null: b"]
+
+    def test_edits(self):
+        view = client_itemlist.ItemListView("list", _elements(["a", "b", "c", "d", "e"]))
+        view.move("e", 0)
+        view.remove("b")
+        view.swap("a", "d")
+        new = view.insert(2, item_id="p00")
+        assert [node.identifier for node in view] == ["e", "d", None, "c", "a"]
+        assert view[2] is new
+        assert view.index("a") == 4
+        assert "b" not in view
+        with pytest.raises(ValueError):
+            view.remove("b")
+        with pytest.raises(ValueError):
+            view.plan()
+
+    def test_index_after_many_edits(self):
+        identifiers = [f"l{i}" for i in range(100)]
+        view = client_itemlist.ItemListView("list", _elements(identifiers))
+        expected = list(identifiers)
+        for k in range(50):
+            identifier = expected.pop()
+            expected.insert(k % 7, identifier)
+            view.move(identifier, k % 7)
+            for other in expected[::9]:
+                assert view.index(other) == expected.index(other)
+        assert view.identifiers() == expected
+
+    def test_flush(self, ce):
+        itemlist_id = _create_itemlist(ce, ["a", "b", "c", "d"])
+        view = client_itemlist.ItemListView.load(itemlist_id)
+        ids = {ce.get_node(node.identifier)["description"]: node.identifier for node in view}
+        view.move(ids["d"], 0)
+        view.remove(ids["b"])
+        view.insert(1, item_id="p00")
+        ce.reset_stats()
+        order = view.flush(creator="https://www.upf.edu")
+        # One request to create the ListItem and one for all the other changes
+        assert ce.stats["requests"] == 2
+        assert order == view.identifiers()
+        assert order[0] == ids["d"] and order[2:] == [ids["a"], ids["c"]]
+        assert ce.get_node(order[1])["item"] == "p00"
+        assert [ce.get_node(i)["position"] for i in order] == [0, 1, 2, 3]
+        assert client_itemlist.ItemListView.load(itemlist_id).check_chain() == []
+        assert view.check_chain() == []
+        # Nothing left to write
+        ce.reset_stats()
+        view.flush()
+        assert ce.stats["requests"] == 0
+
+    def test_large_list(self):
+        n = 50000
+        view = client_itemlist.ItemListView("list", _elements([f"l{i}" for i in range(n)]))
+        assert view.check_chain() == []
+        assert view.index(f"l{n - 1}") == n - 1
+        view.move(f"l{n - 1}", 0)
+        assert view.plan()[-1] == ("UpdateListItemAlias{}".format(n - 1), "UpdateListItem",
+                                   {"identifier": f"l{n - 2}", "position": n - 1})
@@ -1,10 +1,37 @@
+import contextlib
+import contextvars
 import datetime
+import importlib
 import json
 from datetime import date
 import logging
 
 logger = logging.getLogger(__file__)
 
+# Shared encoder for values in queries and mutations. GraphQL string literals have the same syntax as JSON strings.
+# Requests to the CE and its responses are encoded with trompace.codec
+_encoder = json.JSONEncoder()
+_encode_string = json.encoder.encode_basestring_ascii
+
+
+def lazy_submodules(package: str, names):
+    """Make a module ``__getattr__`` function that imports the submodules ``names`` of ``package``
+    the first time that they are used as attributes, so that importing a package doesn't import all
+    of its submodules and their dependencies (PEP 562)"""
+    names = frozenset(names)
+
+    def __getattr__(name):
+        if name in names:
+            return importlib.import_module(f"{package}.{name}")
+        raise AttributeError(f"module {package!r} has no attribute {name!r}")
+
+    return __getattr__
+
+
+__getattr__ = lazy_submodules(__name__, ["application", "archive", "client", "codec", "config", "connection",
+                                         "constants", "exceptions", "mutations", "queries", "subscriptions",
+                                         "testing"])
+
 
 def docstring_interpolate(name, values):
     """Interpolate a variable into a function's docstring.
@@ -53,14 +80,13 @@ def encode_list(thelist, encoder):
 
 
 def make_filter(args: dict):
-    encoder = json.JSONEncoder()
     parts = ["{"]
     for k, v in args.items():
         parts.append(k + ":")
         if isinstance(v, dict):
             parts.append(make_filter(v))
         else:
-            parts.append(encoder.encode(v))
+            parts.append(_encoder.encode(v))
         parts.append(" ")
     parts.append("}")
     return " ".join(parts)
@@ -98,23 +124,145 @@ def make_parameters(**kwargs):
     Returns:
         A string representation of the graphql parameters
     """
-    encoder = json.JSONEncoder()
     parts = []
     for k, v in kwargs.items():
-        if isinstance(v, StringConstant):
-            value = v.value
-        elif isinstance(v, datetime.datetime):
-            value = f"{{formatted: {encoder.encode(v.isoformat())}}}"
-        elif isinstance(v, list):
-            value = "[{}]".format(", ".join(item for item in encode_list(v, encoder)))
-        elif isinstance(v, dict):
-            value = "{" + make_parameters(**v) + "}"
-        else:
-            value = encoder.encode(v)
-        parts.append("{}: {}".format(k, value))
+        parts.append("{}: {}".format(k, _make_value(v, _encoder)))
     return "\n        ".join(parts)
 
 
+def encode_value(v):
+    """Convert a single parameter value to the graphql format.
+    The result is the same as the value part of :func:`make_parameters`, with fast paths for common types."""
+    value_type = type(v)
+    if value_type is str:
+        return _encode_string(v)
+    elif value_type is int:
+        return int.__repr__(v)
+    elif value_type is bool:
+        return "true" if v else "false"
+    return _make_value(v, _encoder)
+
+
+def _make_value(v, encoder):
+    """Convert a single parameter value to the graphql format"""
+    if isinstance(v, StringConstant):
+        value = v.value
+    elif isinstance(v, datetime.datetime):
+        value = f"{{formatted: {encoder.encode(v.isoformat())}}}"
+    elif isinstance(v, list):
+        value = "[{}]".format(", ".join(item for item in encode_list(v, encoder)))
+    elif isinstance(v, dict):
+        value = "{" + make_parameters(**v) + "}"
+    else:
+        value = encoder.encode(v)
+    return value
+
+
+# GraphQL types of arguments whose type can't be inferred from their python value
+VARIABLE_TYPES = {
+    "identifier": "ID!",
+    "identifier_in": "[ID!]!",
+}
+
+# Set by use_variables(). If True, query and mutation builders send argument values as GraphQL variables
+_use_variables = contextvars.ContextVar("trompace_use_variables", default=False)
+
+
+@contextlib.contextmanager
+def use_variables(enabled: bool = True):
+    """Make the query and mutation builders send argument values as GraphQL variables.
+
+    Inside this context the builders return an :class:`Operation` instead of a string with all values
+    inlined. The document of an operation only depends on the names (and not the values) of its arguments,
+    so the CE can reuse its parsed and validated version between requests.
+    ``StringConstant`` values (enums and dates) are still inlined in the document.
+
+    Arguments:
+        enabled: set to ``False`` to disable variables inside an outer ``use_variables`` block
+    """
+    token = _use_variables.set(enabled)
+    try:
+        yield
+    finally:
+        _use_variables.reset(token)
+
+
+class Operation(str):
+    """A GraphQL document that uses variables, together with the values of these variables.
+    It behaves like a string containing the document, and :func:`trompace.connection.submit_query`
+    sends ``variables`` together with it."""
+
+    def __new__(cls, document: str, variables: dict):
+        operation = super().__new__(cls, document)
+        operation.variables = variables
+        return operation
+
+
+def _variable_type(name, value):
+    """The GraphQL type of a variable called `name` with the python value `value`, or None
+    if the value can't be sent as a variable"""
+    if name in VARIABLE_TYPES:
+        return VARIABLE_TYPES[name]
+    if isinstance(value, StringConstant):
+        return None
+    elif isinstance(value, bool):
+        return "Boolean!"
+    elif isinstance(value, int):
+        return "Int!"
+    elif isinstance(value, float):
+        return "Float!"
+    elif isinstance(value, str):
+        return "String!"
+    elif isinstance(value, datetime.datetime):
+        return "_Neo4jDateTimeInput!"
+    elif isinstance(value, list) and value:
+        item_types = set(_variable_type(None, item) for item in value)
+        if len(item_types) == 1 and None not in item_types and "_Neo4jDateTimeInput!" not in item_types:
+            return "[{}]!".format(item_types.pop())
+    return None
+
+
+def make_variables(**kwargs):
+    """Convert query parameters to the graphql format, sending their values as variables.
+    Like :func:`make_parameters`, but values are replaced by a reference to a variable with the same
+    name as the parameter. Values that can't be sent as variables (``StringConstant``, dictionaries, and
+    lists containing them) are inlined in the parameters.
+    Arguments:
+         **kwargs: a mapping of field names to values
+    Returns:
+        A tuple (parameters, definitions, variables) with the string representation of the graphql parameters,
+        the definitions of the variables that they use (e.g. ``$name: String!, $position: Int!``), and a
+        dictionary of variable values
+    """
+    parts = []
+    definitions = []
+    variables = {}
+    for k, v in kwargs.items():
+        variable_type = _variable_type(k, v)
+        if variable_type is None:
+            parts.append("{}: {}".format(k, _make_value(v, _encoder)))
+            continue
+        if isinstance(v, datetime.datetime):
+            v = {"formatted": v.isoformat()}
+        parts.append("{0}: ${0}".format(k))
+        definitions.append("${}: {}".format(k, variable_type))
+        variables[k] = v
+    return "\n        ".join(parts), ", ".join(definitions), variables
+
+
+def make_arguments(args: dict):
+    """Format the arguments of a query or mutation, using variables if :func:`use_variables` is enabled.
+    Arguments:
+        args: a dictionary of field: value pairs
+    Returns:
+        A tuple (parameters, definitions, variables), see :func:`make_variables`. If variables are not
+        enabled, definitions is empty and variables is an empty dictionary
+    """
+    if _use_variables.get():
+        return make_variables(**args)
+    return make_parameters(**args), "", {}
+
+
 class _Neo4jDate(StringConstant):
     """The _Neo4jDate is used for Date values. It will be added as
     StringConstant in the GraphQL. The date will be formatted as:
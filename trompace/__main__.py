@@ -0,0 +1,47 @@
+# Command line interface: python -m trompace <command>, or the trompace script
+import argparse
+import sys
+
+
+def _archive(args):
+    from trompace.archive import archive_ce, archive_ce_delta
+    if args.delta:
+        summary = archive_ce_delta(args.directory, workers=args.workers, shard_size=args.shard_size,
+                                   page_size=args.page_size, overlap=args.overlap)
+    else:
+        summary = archive_ce(args.directory, workers=args.workers, shard_size=args.shard_size,
+                             page_size=args.page_size)
+    print(f"Downloaded {summary.downloaded} nodes into {len(summary.shards)} shards, "
+          f"skipped {summary.skipped} already archived, {len(summary.failed)} failed")
+    return 1 if summary.failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="trompace", description="Tools for working with the TROMPA CE")
+    parser.add_argument("--config", "-c",
+                        help="Path to the config file (default: the TROMPACE_CLIENT_CONFIG environment variable)")
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+    subparsers.required = True
+
+    archive = subparsers.add_parser("archive", help="Download all nodes in the CE as JSON-LD",
+                                    description="Download all nodes in the CE as JSON-LD into gzipped JSON-Lines "
+                                                "shards. Run again with the same directory to resume.")
+    archive.add_argument("directory", help="Directory to write the archive to")
+    archive.add_argument("--workers", "-w", type=int, help="Number of nodes to download at the same time "
+                                                           "(default: the connection.pool_maxsize config item)")
+    archive.add_argument("--shard-size", type=int, default=10000, help="Maximum number of nodes in each shard")
+    archive.add_argument("--page-size", type=int, default=1000, help="Number of identifiers to list in each query")
+    archive.add_argument("--delta", action="store_true",
+                         help="Only download nodes created or modified since the archive was last completed")
+    archive.add_argument("--overlap", type=float, default=60.0,
+                         help="With --delta, also download nodes changed this many seconds before the last run")
+    archive.set_defaults(func=_archive)
+
+    args = parser.parse_args(argv)
+    from trompace.config import config
+    config.load(args.config)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,10 +2,8 @@
 import json
 import os
 
-import websockets
-
 import trompace.config as config
-from trompace.connection import submit_query, download_file
+from trompace.connection import submit_query_async, download_file_async
 from trompace.exceptions import QueryException, ValueNotFound
 from trompace.mutations.application import mutation_create_application, mutation_add_entrypoint_application
 from trompace.mutations.controlaction import mutation_create_controlaction, mutation_add_entrypoint_controlaction, \
@@ -125,19 +123,19 @@ async def create_entrypointcontrolaction_CE(created_app_id, entrypoint_name, con
                                                           creator, \
                                                           source, language, actionPlatform, contentType, encodingType,
                                                           formatin)
-    resp = await submit_query(create_entrypoint_query)
+    resp = await submit_query_async(create_entrypoint_query)
 
     created_ep_id = resp['data']['CreateEntryPoint']['identifier']
 
     add_entrypoint_query = mutation_add_entrypoint_application(created_app_id, created_ep_id)
-    resp = await submit_query(add_entrypoint_query)
+    resp = await submit_query_async(add_entrypoint_query)
 
     created_control_action = mutation_create_controlaction(control_name, description_ca, actionStatus)
-    resp = await submit_query(created_control_action)
+    resp = await submit_query_async(created_control_action)
     created_ca_id = resp['data']['CreateControlAction']['identifier']
 
     add_entrypoint_controlaction_query = mutation_add_entrypoint_controlaction(created_ep_id, created_ca_id)
-    resp = await submit_query(add_entrypoint_controlaction_query)
+    resp = await submit_query_async(add_entrypoint_controlaction_query)
     if "errors" in resp.keys():
         raise QueryException(resp['errors'])
     return created_ep_id, created_ca_id
@@ -156,12 +154,12 @@ async def create_property_CE(property_title, property_name, property_description
     """
 
     create_property_query = mutation_create_property(property_title, property_name, property_description, rangeIncludes)
-    resp = await submit_query(create_property_query)
+    resp = await submit_query_async(create_property_query)
 
     created_property_id = resp['data']['CreateProperty']['identifier']
     add_controlaction_property_query = mutation_add_controlaction_property(created_ca_id, created_property_id)
 
-    resp = await submit_query(add_controlaction_property_query)
+    resp = await submit_query_async(add_controlaction_property_query)
 
     return created_property_id
 
@@ -190,12 +188,12 @@ async def create_propertyvalue_CE(created_ca_id, value_name, value_description,
                                                                                          , multipleValues, valueName,
                                                                                          valuePattern, valueRequired)
 
-    resp = await submit_query(create_propertyvaluespecification_query)
+    resp = await submit_query_async(create_propertyvaluespecification_query)
 
     created_propertyvaluespec_id = resp['data']['CreatePropertyValueSpecification']['identifier']
     add_propertyvalue_controlaction_query = mutation_add_controlaction_propertyvaluespecification(created_ca_id,
                                                                                                   created_propertyvaluespec_id)
-    resp = await submit_query(add_propertyvalue_controlaction_query)
+    resp = await submit_query_async(add_propertyvalue_controlaction_query)
     return created_propertyvaluespec_id
 
 
@@ -217,7 +215,7 @@ async def create_application_CE(application_name: str, subject: str, description
     """
     create_application_query = mutation_create_application(application_name, contributor, creator, source, subject,
                                                            description, language, formatin)
-    resp = await submit_query(create_application_query)
+    resp = await submit_query_async(create_application_query)
 
     created_app_id = resp['data']['CreateSoftwareApplication']['identifier']
     return created_app_id
@@ -237,6 +235,7 @@ async def subscribe_controlaction(entrypoint_id, command_line, num_properties, n
     print(websocket_port)
     is_ok = False
     subs = subscription_controlaction(entrypoint_id)
+    import websockets
     async with websockets.connect(websocket_port, subprotocols=['graphql-ws']) as websocket:
         await websocket.send(INIT_STR)
         async for message in websocket:
@@ -266,7 +265,7 @@ async def handle_control_action(identifier, command_line, properties, property_v
     properties, property_values = await get_control_action_id(identifier, properties, property_values)
 
     query_modify_ca = mutation_modify_controlaction(identifier, "running")
-    resp = await submit_query(query_modify_ca)
+    resp = await submit_query_async(query_modify_ca)
 
     input_paths = []
 
@@ -278,7 +277,7 @@ async def handle_control_action(identifier, command_line, properties, property_v
         input_url = properties[pro]['source']
         out_path = "./{}".format(input_url.split("/")[-1])
 
-        await download_file(input_url, out_path)
+        await download_file_async(input_url, out_path)
         input_paths.append(out_path)
         format_dict['Property{}'.format(i)] = os.path.abspath(out_path)
 
@@ -291,17 +290,17 @@ async def handle_control_action(identifier, command_line, properties, property_v
     create_doc_query = mutation_create_digitaldocument(property_values['outputName'], "UPF", "IPF", "www.upf.edu",
                                                 "./dummy_path",
                                                 "output of test algorithm", "test subject", "en")
-    resp = await submit_query(create_doc_query)
+    resp = await submit_query_async(create_doc_query)
     created_doc_id = resp['data']['CreateDigitalDocument']['identifier']
 
     query_add_doc = mutation_add_controlaction_object(created_doc_id, identifier)
 
-    resp = await submit_query(query_add_doc)
+    resp = await submit_query_async(query_add_doc)
 
     print(resp)
 
     query_modify_ca = mutation_modify_controlaction(identifier, "complete")
-    resp = await submit_query(query_modify_ca)
+    resp = await submit_query_async(query_modify_ca)
     print(resp)
 
 
@@ -309,7 +308,7 @@ async def get_control_all_actions():
     """
     Submits a query to get all control actions, entry points and associated property and property value specifications.
     """
-    resp = await submit_query(QUERY_ENTRYPOINT)
+    resp = await submit_query_async(QUERY_ENTRYPOINT)
 
     entry_point_ids = {y: {"Id": x['identifier'], "Description": x['description'],
                            x['potentialAction'][0]['__typename'] + "_id": x['potentialAction'][0]['identifier'] \
@@ -335,7 +334,7 @@ async def get_control_action_id(control_id, properties, property_values):
         Add optional values using valueRequired.
     """
     query_ca = QUERY_CONTROLACTION_ID.format(identifier=control_id)
-    resp = await submit_query(query_ca)
+    resp = await submit_query_async(query_ca)
     op_pro = {}
     op_pvs = {}
 
@@ -0,0 +1,357 @@
+# Download every node in the CE as JSON-LD into compressed, sharded archive files.
+import datetime
+import gzip
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Iterable, NamedTuple
+
+import trompace
+from trompace import connection
+from trompace.codec import get_codec
+from trompace.config import config
+
+MANIFEST = "manifest.jsonl"
+SHARD_NAME = "shard-{:05d}.jsonl.gz"
+SHARD_PATTERN = re.compile(r"^\.?shard-(\d+)\.jsonl\.gz(\.tmp)?$")
+
+
+class ArchiveSummary(NamedTuple):
+    """The result of :func:`archive_ce`"""
+    # Number of nodes downloaded in this run
+    downloaded: int
+    # Number of nodes skipped because they were already in the archive
+    skipped: int
+    # Identifiers of nodes that could not be downloaded. They are retried in the next run
+    failed: list
+    # Names of the shard files written in this run
+    shards: list
+
+
+class Archive:
+    """A directory containing an archive of the CE.
+
+    Nodes are stored in gzip-compressed JSON-Lines *shards*, each one containing up to ``shard_size`` lines of
+    ``{"identifier": ..., "jsonld": {...}}``. A shard is written to a temporary file, which is renamed when it is
+    complete, so a shard file is never partially written. After a shard is renamed a record is appended to
+    ``manifest.jsonl`` with the identifiers that it contains. The manifest is used to resume an interrupted
+    archive without downloading the same nodes again.
+
+    Arguments:
+        directory: the directory of the archive. It is created if it doesn't exist
+        shard_size: the maximum number of nodes in each shard
+        started: the time that the current run started, recorded with each shard. Defaults to now
+    """
+
+    def __init__(self, directory: str, shard_size: int = 10000, started: datetime.datetime = None):
+        if shard_size < 1:
+            raise ValueError("shard_size must be at least 1")
+        self.directory = directory
+        self.shard_size = shard_size
+        self.manifest_path = os.path.join(directory, MANIFEST)
+        self.started = started or datetime.datetime.now(datetime.timezone.utc)
+        os.makedirs(directory, exist_ok=True)
+        self._codec = get_codec()
+        self._next_index = self._remove_partial_shards() + 1
+        self._shard = None
+        self._shard_identifiers = []
+
+    def _remove_partial_shards(self):
+        """Delete temporary shards left by an interrupted run, returning the highest shard index in the directory"""
+        highest = 0
+        for name in os.listdir(self.directory):
+            match = SHARD_PATTERN.match(name)
+            if not match:
+                continue
+            if match.group(2):
+                os.unlink(os.path.join(self.directory, name))
+            else:
+                highest = max(highest, int(match.group(1)))
+        return highest
+
+    def manifest(self):
+        """The records in the manifest, oldest first"""
+        if not os.path.exists(self.manifest_path):
+            return []
+        with open(self.manifest_path, "rb") as fp:
+            return [self._codec.loads(line) for line in fp if line.strip()]
+
+    def completed_identifiers(self):
+        """The identifiers of all nodes in shards that are listed in the manifest"""
+        completed = set()
+        for record in self.manifest():
+            if record.get("type") == "shard":
+                completed.update(record["identifiers"])
+        return completed
+
+    def archived_as_of(self):
+        """When each archived node was known to be up to date. A node in a shard written after the last complete run
+        was archived when its run started. Any other node is up to date as of the high-water mark of that run
+        Returns:
+            A dictionary of {identifier: datetime}
+        """
+        archived = {}
+        mark = None
+        for record in self.manifest():
+            if record.get("type") == "complete":
+                mark = _parse_datetime(record["started"])
+                archived = dict.fromkeys(archived, mark)
+            elif record.get("type") == "shard":
+                started = _parse_datetime(record.get("started") or record["written"])
+                archived.update(dict.fromkeys(record["identifiers"], started))
+        return archived
+
+    def high_water_mark(self):
+        """The high-water mark of the last complete run of the archive, or None if no run has completed.
+        All nodes that were created or modified before this time are in the archive. It is the time that the run
+        started, or the earliest time that a node which the run skipped was archived"""
+        marks = [record["started"] for record in self.manifest() if record.get("type") == "complete"]
+        return _parse_datetime(marks[-1]) if marks else None
+
+    def archived_since(self, since: datetime.datetime):
+        """The identifiers of the nodes in shards written by runs that started after ``since``
+        Returns:
+            A dictionary of {identifier: the time that the run which last archived the node started}
+        """
+        archived = {}
+        for record in self.manifest():
+            if record.get("type") == "shard" and "started" in record:
+                started = _parse_datetime(record["started"])
+                if started > since:
+                    archived.update(dict.fromkeys(record["identifiers"], started))
+        return archived
+
+    def _append_manifest(self, record: dict):
+        with open(self.manifest_path, "ab") as fp:
+            fp.write(self._codec.dumps(record) + b"\n")
+            fp.flush()
+            os.fsync(fp.fileno())
+
+    def add(self, identifier: str, jsonld: dict):
+        """Add a node to the current shard, starting a new shard if needed"""
+        if self._shard is None:
+            name = SHARD_NAME.format(self._next_index)
+            self._shard = (name, gzip.open(os.path.join(self.directory, f".{name}.tmp"), "wb"))
+        self._shard[1].write(self._codec.dumps({"identifier": identifier, "jsonld": jsonld}) + b"\n")
+        self._shard_identifiers.append(identifier)
+        if len(self._shard_identifiers) >= self.shard_size:
+            return self.flush()
+        return None
+
+    def flush(self):
+        """Finish the current shard and record it in the manifest
+        Returns:
+            The name of the shard file, or None if there was no shard in progress
+        """
+        if self._shard is None:
+            return None
+        name, fp = self._shard
+        fp.close()
+        os.replace(os.path.join(self.directory, f".{name}.tmp"), os.path.join(self.directory, name))
+        self._append_manifest({"type": "shard", "file": name, "count": len(self._shard_identifiers),
+                               "identifiers": self._shard_identifiers, "started": self.started.isoformat(),
+                               "written": datetime.datetime.now(datetime.timezone.utc).isoformat()})
+        trompace.logger.info(f"Wrote {len(self._shard_identifiers)} nodes to {name}")
+        self._shard = None
+        self._shard_identifiers = []
+        self._next_index += 1
+        return name
+
+    def mark_complete(self, started: datetime.datetime, nodes: int, since: str = None):
+        """Record in the manifest that all nodes in the CE, or if ``since`` is set, all nodes that were created or
+        modified after ``since``, are archived as they were at ``started``. This is the new high-water mark"""
+        record = {"type": "complete", "started": started.isoformat(),
+                  "finished": datetime.datetime.now(datetime.timezone.utc).isoformat(), "nodes": nodes}
+        if since is not None:
+            record["since"] = since
+        self._append_manifest(record)
+
+    def read(self):
+        """Iterate over the nodes in all shards of the archive, in the order that they were written.
+        A node that changed between runs appears more than once, the last one is its current version
+        Returns:
+            A generator of (identifier, jsonld) tuples
+        """
+        for record in self.manifest():
+            if record.get("type") != "shard":
+                continue
+            with gzip.open(os.path.join(self.directory, record["file"]), "rb") as fp:
+                for line in fp:
+                    node = self._codec.loads(line)
+                    yield node["identifier"], node["jsonld"]
+
+
+def _parse_datetime(value: str):
+    """Parse a DateTime from the CE or from the manifest (ISO 8601, with up to nanosecond precision)"""
+    match = re.match(r"^(.*T[\d:]+)(?:\.(\d+))?(Z|[+-][\d:]+)?$", value)
+    if not match:
+        raise ValueError(f"Invalid DateTime {value!r}")
+    seconds, fraction, zone = match.groups()
+    fraction = "." + (fraction or "0")[:6].ljust(6, "0")
+    zone = "+00:00" if zone in (None, "Z") else zone
+    return datetime.datetime.fromisoformat(seconds + fraction + zone)
+
+
+def _download(archive: Archive, identifiers: Iterable[str], workers: int):
+    """Download nodes into an archive with a pool of ``workers`` threads
+    Returns:
+        A tuple (number of nodes downloaded, identifiers that failed, names of the shards written)
+    """
+    def download(identifier):
+        return identifier, connection.get_jsonld(identifier)
+
+    downloaded = 0
+    failed = []
+    shards = []
+
+    def collect(done):
+        nonlocal downloaded
+        for future in done:
+            identifier = futures.pop(future)
+            try:
+                _, jsonld = future.result()
+            except Exception as e:
+                trompace.logger.error(f"Could not download {identifier}: {e}")
+                failed.append(identifier)
+                continue
+            downloaded += 1
+            shard = archive.add(identifier, jsonld)
+            if shard:
+                shards.append(shard)
+
+    # Limit the number of identifiers that have been read but not yet written, so that memory use
+    # doesn't depend on the number of nodes
+    window = workers * 2
+    futures = {}
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for identifier in identifiers:
+            if len(futures) >= window:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                collect(done)
+            futures[executor.submit(download, identifier)] = identifier
+        collect(wait(futures).done)
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+        shard = archive.flush()
+        if shard:
+            shards.append(shard)
+    return downloaded, failed, shards
+
+
+def archive_ce(directory: str, identifiers: Iterable[str] = None, workers: int = None, shard_size: int = 10000,
+               page_size: int = 1000):
+    """Download nodes from the CE as JSON-LD into an :class:`Archive`.
+
+    Nodes are downloaded by a pool of ``workers`` threads over the keep-alive connections of
+    :func:`trompace.connection.get_session`. If the archive already contains some nodes (e.g. because a previous
+    run was interrupted) they are not downloaded again. Nodes that fail to download are logged and retried the
+    next time that the archive is run.
+
+    Arguments:
+        directory: the directory of the archive
+        identifiers: the identifiers of the nodes to download. By default, all nodes in the CE
+          (``ThingInterface``), listed with :func:`trompace.connection.iterate_query`
+        workers: the number of nodes to download at the same time. Defaults to the
+          ``connection.pool_maxsize`` config item
+        shard_size: the maximum number of nodes in each shard file
+        page_size: the number of identifiers to request in each query when listing all nodes
+    Returns:
+        An :class:`ArchiveSummary`
+    """
+    if workers is None:
+        workers = config.connection_pool_maxsize
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+    started = datetime.datetime.now(datetime.timezone.utc)
+    archive = Archive(directory, shard_size=shard_size, started=started)
+    completed = archive.archived_as_of()
+    list_all = identifiers is None
+    if list_all:
+        identifiers = (node["identifier"] for node in
+                       connection.iterate_query("ThingInterface", fields=["identifier"], page_size=page_size))
+
+    skipped = 0
+    # Nodes that are skipped may have changed since they were archived, so the high-water mark can't be later
+    # than the time that they were archived
+    mark = started
+
+    def missing():
+        nonlocal skipped, mark
+        for identifier in identifiers:
+            if identifier in completed:
+                skipped += 1
+                mark = min(mark, completed[identifier])
+            else:
+                yield identifier
+
+    downloaded, failed, shards = _download(archive, missing(), workers)
+    if list_all and not failed:
+        archive.mark_complete(mark, downloaded + skipped)
+    trompace.logger.info(f"Archived {downloaded} nodes ({skipped} already archived, {len(failed)} failed)")
+    return ArchiveSummary(downloaded, skipped, failed, shards)
+
+
+def archive_ce_delta(directory: str, workers: int = None, shard_size: int = 10000, page_size: int = 1000,
+                     overlap: float = 60.0):
+    """Download the nodes that were created or modified in the CE since the archive was last completed.
+
+    The high-water mark is recorded by the last complete run (full or delta) of the archive, see
+    :meth:`Archive.high_water_mark`. Nodes whose ``created`` or ``modified`` DateTime is later than this
+    (minus ``overlap`` seconds, in case the clocks of the client and the CE differ) are listed with
+    :func:`trompace.connection.iterate_query` and written to new shards. A node that was changed can appear in more
+    than one shard, the last one is its current version. Nodes deleted from the CE are not detected.
+
+    If a delta run is interrupted, run it again: nodes that were already downloaded after their last
+    modification are not downloaded again, and the high-water mark is only updated when a run completes
+    without errors.
+
+    Arguments:
+        directory: the directory of an archive that was completed with :func:`archive_ce`
+        workers: the number of nodes to download at the same time, see :func:`archive_ce`
+        shard_size: the maximum number of nodes in each shard file
+        page_size: the number of nodes to request in each query when listing changed nodes
+        overlap: also download nodes that changed this many seconds before the high-water mark
+    Raises:
+        ValueError if the archive has never been completed
+    Returns:
+        An :class:`ArchiveSummary`
+    """
+    if workers is None:
+        workers = config.connection_pool_maxsize
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+    started = datetime.datetime.now(datetime.timezone.utc)
+    archive = Archive(directory, shard_size=shard_size, started=started)
+    mark = archive.high_water_mark()
+    if mark is None:
+        raise ValueError(f"The archive in {directory} has never been completed, run a full archive first")
+    since = {"formatted": (mark - datetime.timedelta(seconds=overlap)).isoformat(timespec="milliseconds")}
+    # When each node was last archived, by runs that started after the high-water mark
+    archived = archive.archived_since(mark)
+
+    skipped = 0
+
+    def changed():
+        nonlocal skipped
+        nodes = connection.iterate_query("ThingInterface",
+                                         filter={"OR": [{"created_gt": since}, {"modified_gt": since}]},
+                                         fields=["identifier", {"created": ["formatted"]},
+                                                 {"modified": ["formatted"]}],
+                                         page_size=page_size)
+        for node in nodes:
+            identifier = node["identifier"]
+            if identifier in archived:
+                changes = [_parse_datetime(node[k]["formatted"]) for k in ("created", "modified") if node.get(k)]
+                if changes and max(changes) < archived[identifier]:
+                    skipped += 1
+                    continue
+            yield identifier
+
+    downloaded, failed, shards = _download(archive, changed(), workers)
+    if not failed:
+        archive.mark_complete(started, downloaded + skipped, since=since["formatted"])
+    trompace.logger.info(f"Archived {downloaded} changed nodes ({skipped} already archived, {len(failed)} failed)")
+    return ArchiveSummary(downloaded, skipped, failed, shards)
@@ -2,7 +2,7 @@
 import asyncio
 import configparser
 
-from trompace.connection import submit_query
+from trompace.connection import submit_query_async
 
 pq_2 = """query{
   EntryPoint {
@@ -49,7 +49,7 @@ pq_2 = """query{
 
 
 async def main():
-    resp_p2 = await submit_query(pq_2)
+    resp_p2 = await submit_query_async(pq_2)
 
     i = 1
 
@@ -1,11 +1,20 @@
+import bisect
+import threading
+import time
+from collections import OrderedDict
 from typing import Optional
 from trompace.config import config
-from trompace.connection import submit_query
+from trompace.connection import submit_query, submit_mutation_sequence, submit_queries
 from trompace.mutations import itemlist as mutations_itemlist
 from trompace.constants import ItemListOrderType
 from trompace.queries.itemlist import query_listitems, query_itemlist
 from trompace.exceptions import QueryException, IDNotFoundException
 
+# ListItem position strategies. "dense" numbers the elements of a list 0, 1, 2, ..., "sparse" leaves a gap of
+# POSITION_GAP between consecutive positions so that a ListItem can be inserted without renumbering the list
+POSITION_STRATEGIES = ("dense", "sparse")
+POSITION_GAP = 1024
+
 
 def create_itemlist_node(name: str, contributor: str = None, creator: str = None, description: str = None,
                          ordered: bool = False):
@@ -159,27 +168,81 @@ def update_listitem_position(listitem_id: str, position: int):
         raise QueryException(resp['errors'])
 
 
-def get_nonexistent_listitem_nodes(item_ids: list):
+class ExistenceCache:
+    """Remembers which nodes are known to exist in the CE, so that they don't have to be checked again.
+
+    Only nodes that exist are cached, as a node that doesn't exist may be created at any time. An entry expires
+    after ``ttl`` seconds, in case the node has been deleted. Pass the same cache to several calls of
+    :func:`create_itemlist` or :func:`get_nonexistent_listitem_nodes` to skip the nodes that were already found.
+
+    Arguments:
+        ttl: the number of seconds to remember that a node exists
+        max_size: the maximum number of identifiers to remember. The least recently found are forgotten first
+    """
+
+    def __init__(self, ttl: float = 300.0, max_size: int = 100000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._expiry = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, identifier: str):
+        with self._lock:
+            expiry = self._expiry.get(identifier)
+            if expiry is None:
+                return False
+            if expiry < time.monotonic():
+                del self._expiry[identifier]
+                return False
+            return True
+
+    def add(self, identifiers):
+        """Record that the nodes with these identifiers exist"""
+        expiry = time.monotonic() + self.ttl
+        with self._lock:
+            for identifier in identifiers:
+                self._expiry[identifier] = expiry
+                self._expiry.move_to_end(identifier)
+            while len(self._expiry) > self.max_size:
+                self._expiry.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._expiry.clear()
+
+
+def get_nonexistent_listitem_nodes(item_ids: list, chunk_size: int = 1000, max_concurrency: int = None,
+                                   cache: ExistenceCache = None):
     """ Check if Items already exist in the CE
 
+    The identifiers are checked in queries of up to ``chunk_size`` identifiers, which are sent at the same time.
+
     Arguments:
         item_ids: The list of unique identifiers of the Item objects
+        chunk_size: The maximum number of identifiers to check in each query
+        max_concurrency: The maximum number of queries to send at the same time,
+          see :func:`trompace.connection.submit_queries`
+        cache: If set, don't check identifiers that are in the cache, and add the identifiers that are found to it
     Raises:
         QueryException if the query fails to execute
     Return:
         Set of identifiers not found
     """
-    query = query_listitems(identifiers=item_ids)
-    resp = submit_query(query)
-    result = resp.get("data", {}).get("ThingInterface")
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    unknown = [item_id for item_id in dict.fromkeys(item_ids) if cache is None or item_id not in cache]
+    queries = (query_listitems(identifiers=unknown[start:start + chunk_size])
+               for start in range(0, len(unknown), chunk_size))
 
-    not_found = set()
-    if not result:
-        raise QueryException(resp['errors'])
-    elif len(result) != len(item_ids):
-        not_found = set(item_ids) - set([item['identifier'] for item in result])
+    found = set()
+    for result in submit_queries(queries, max_concurrency=max_concurrency, ordered=False):
+        if result.error:
+            raise result.error
+        found.update(item['identifier'] for item in result.response["data"]["ThingInterface"] or [])
+    if cache is not None:
+        cache.add(found)
 
-    return not_found
+    return set(unknown) - found
 
 
 def itemlist_node_exists(itemlist_id: str):
@@ -190,19 +253,17 @@ def itemlist_node_exists(itemlist_id: str):
     Raises:
         QueryException if the query fails to execute
     Return:
-        True if ListItem object exists
+        The ItemList objects with the identifier, an empty list if the ItemList doesn't exist
     """
     query = query_itemlist(identifier=itemlist_id)
     resp = submit_query(query)
-    result = resp.get("data", {}).get("ItemList")
-
-    if not result:
+    if resp.get("errors"):
         raise QueryException(resp['errors'])
-    else:
-        return result
+    return resp.get("data", {}).get("ItemList") or []
 
 
-def create_sequence_listitem_nodes(name: str, listitems: list, ids_mode: bool, contributor: str):
+def create_sequence_listitem_nodes(name: str, listitems: list, ids_mode: bool, contributor: str,
+                                   positions: list = None):
     """Create a sequence of ListItem object and return
     the corresponding identifiers.
     (https://schema.org/ListItem)
@@ -212,29 +273,29 @@ def create_sequence_listitem_nodes(name: str, listitems: list, ids_mode: bool, c
         ids_mode: the type of Items to create (from ID or from string value)
         contributor: A person, an organization, or a service responsible for contributing the ListItem to the web resource.
         name: The name of the ListItem object.
+        positions: the position of each ListItem. By default 0, 1, 2, ...
     Raises:
         QueryException if the query fails to execute
     Returns:
-       The identifiers of the ListItem objects created.
+       The identifiers of the ListItem objects created, in the same order as listitems.
     """
     if not ids_mode:
         description = [item for item in listitems]
     else:
         description = [None for item in listitems]
 
-    mutation = mutations_itemlist.mutation_sequence_create_listitem(
+    mutations = mutations_itemlist.make_sequence_create_listitem(
         name=name,
         listitems=listitems,
         description=description,
-        contributor=contributor
+        contributor=contributor,
+        positions=positions
     )
-    resp = submit_query(mutation)
-    result = resp.get("data", {})
+    result = submit_mutation_sequence(mutations)
 
-    if len(result.keys()) != len(listitems):
-        raise QueryException(resp['errors'])
-    else:
-        listitems_ids = [result[listalias]['identifier'] for listalias in result]
+    if not all(result.values()):
+        raise QueryException([{"message": "Number of ListItem objects created does not match with input list"}])
+    listitems_ids = [result[listalias]['identifier'] for listalias in result]
 
     return listitems_ids
 
@@ -250,14 +311,11 @@ def merge_sequence_itemlist_itemlistelement_nodes(itemlist_id: str,
         QueryException if the query fails to execute
         ValueError if not all the ListItems passed as input are found
     """
-    mutation = mutations_itemlist.mutation_sequence_add_itemlist_itemlist_element(itemlist_id=itemlist_id,
-                                                                                  element_ids=element_ids)
-    resp = submit_query(mutation)
-    result = resp.get("data", {})
+    mutations = mutations_itemlist.make_sequence_add_itemlist_itemlist_element(itemlist_id=itemlist_id,
+                                                                               element_ids=element_ids)
+    result = submit_mutation_sequence(mutations)
 
-    if not result:
-        raise QueryException(resp['errors'])
-    elif len(result.keys()) != len(element_ids):
+    if not all(result.values()):
         raise ValueError("Number of ListItem objects founds does not match with input list")
 
 
@@ -272,14 +330,11 @@ def merge_sequence_listitem_item_nodes(listitem_ids: list, item_ids: list):
         QueryException if the query fails to execute
         ValueError if not all the Items passed as input are found
     """
-    mutation = mutations_itemlist.mutation_sequence_add_listitem_item(listitem_ids=listitem_ids,
-                                                                      item_ids=item_ids)
-    resp = submit_query(mutation)
-    result = resp.get("data", {})
+    mutations = mutations_itemlist.make_sequence_add_listitem_item(listitem_ids=listitem_ids,
+                                                                   item_ids=item_ids)
+    result = submit_mutation_sequence(mutations)
 
-    if not result:
-        raise QueryException(resp['errors'])
-    elif len(result.keys()) != len(listitem_ids):
+    if not all(result.values()):
         raise ValueError("Number of Item objects founds does not match with input list")
 
 
@@ -292,16 +347,42 @@ def merge_sequence_listitem_nextitem_nodes(listitem_ids: list):
     Raises:
         QueryException if the query fails to execute
     """
-    mutation = mutations_itemlist.mutation_sequence_add_listitem_nextitem(listitem_ids=listitem_ids)
-    resp = submit_query(mutation)
-    result = resp.get("data", {})
+    mutations = mutations_itemlist.make_sequence_add_listitem_nextitem(listitem_ids=listitem_ids)
+    submit_mutation_sequence(mutations)
 
-    if not result:
-        raise QueryException(resp['errors'])
+
+def _check_position_strategy(position_strategy: str):
+    if position_strategy not in POSITION_STRATEGIES:
+        raise ValueError(f"position_strategy must be one of {', '.join(POSITION_STRATEGIES)}")
+
+
+def sparse_positions(count: int):
+    """The positions of the ListItems of a list of ``count`` elements with the "sparse" position strategy,
+    POSITION_GAP apart"""
+    return [POSITION_GAP * (k + 1) for k in range(count)]
+
+
+def sparse_insert_position(positions: list, index: int):
+    """The position for a ListItem inserted at ``index`` in a list with the "sparse" position strategy,
+    halfway between the positions of its neighbours.
+
+    Arguments:
+        positions: The positions of the ListItems of the list, in order
+        index: The index that the new ListItem is inserted at
+    Returns:
+        The position of the new ListItem, or None if there is no gap between its neighbours and the list
+        has to be renumbered
+    """
+    lower = positions[index - 1] if index > 0 else 0
+    upper = positions[index] if index < len(positions) else lower + 2 * POSITION_GAP
+    if upper - lower < 2:
+        return None
+    return (lower + upper) // 2
 
 
 def create_itemlist(name: str, description: str, ordered: bool, contributor: str = None,
-                    creator: str = None, node_ids: list = None, values: list = None):
+                    creator: str = None, node_ids: list = None, values: list = None,
+                    existence_cache: ExistenceCache = None, position_strategy: str = "dense"):
     """ Main function to create a ItemList object and related ListItem objects
     based on the input values or node identifiers.
 
@@ -313,11 +394,17 @@ def create_itemlist(name: str, description: str, ordered: bool, contributor: str
         ordered: True if the list should be ordered, False if not
         node_ids: set of node identifiers to be added to ItemList as ListItem
         values: set of values to be added to ItemList as ListItem
+        existence_cache: A cache of the nodes that are known to exist, to skip checking them again.
+          See :class:`ExistenceCache`
+        position_strategy: "dense" to number the ListItems 0, 1, 2, ..., or "sparse" to leave gaps between
+          their positions, so that :func:`insert_listitem_itemlist` doesn't have to renumber the list
     Raises:
         ValueError if both values and node_ids are passed as input arguments
+        ValueError if position_strategy is not one of POSITION_STRATEGIES
         IDNotFoundException if ListItem objects are not found
         QueryException if the query fails to execute
     """
+    _check_position_strategy(position_strategy)
     listitems = []
     if values and node_ids:
         raise ValueError("cannot provide both node_ids and values arguments")
@@ -327,7 +414,7 @@ def create_itemlist(name: str, description: str, ordered: bool, contributor: str
         [listitems.append(x) for x in values if x not in listitems]
         ids_mode = False
     elif node_ids:
-        not_found = get_nonexistent_listitem_nodes(node_ids)
+        not_found = get_nonexistent_listitem_nodes(node_ids, cache=existence_cache)
         if not_found:
             raise IDNotFoundException(not_found)
         else:
@@ -343,7 +430,9 @@ def create_itemlist(name: str, description: str, ordered: bool, contributor: str
     listitems_ids = create_sequence_listitem_nodes(name=name,
                                                    listitems=listitems,
                                                    ids_mode=ids_mode,
-                                                   contributor=contributor)
+                                                   contributor=contributor,
+                                                   positions=sparse_positions(len(listitems))
+                                                   if position_strategy == "sparse" else None)
 
     merge_sequence_itemlist_itemlistelement_nodes(itemlist_id=itemlist_id,
                                                   element_ids=listitems_ids)
@@ -357,10 +446,21 @@ def create_itemlist(name: str, description: str, ordered: bool, contributor: str
 
 def insert_listitem_itemlist(contributor: str, name: str, description: str,
                              listitem: str, itemlist_id: str, ids_mode: bool,
-                             append: bool, creator: str = None, position: Optional[int] = None):
+                             append: bool, creator: str = None, position: Optional[int] = None,
+                             position_strategy: str = "dense"):
     """ Main function to insert a ListItem in a ItemList object by appending
     it at the bottom, or by inserting it at a specific position.
 
+    The ListItem is created, and then linked into the ItemList and the positions of the following
+    ListItems are updated with a single sequence of mutations (see
+    :func:`trompace.connection.submit_mutation_sequence`), so the number of requests doesn't depend on
+    the length of the ItemList.
+
+    With the "dense" position strategy the positions of all the following ListItems are increased by one.
+    With the "sparse" strategy the new ListItem gets a position halfway between its neighbours, and only
+    the nextItem links of its neighbours are changed. The ListItems are only renumbered when there is no
+    gap left between the neighbours, which also converts a list created with the "dense" strategy.
+
     Arguments:
         contributor: A person, an organization, or a service responsible for contributing the ListItem to the web resource.
         name: The name of the ListItem object.
@@ -370,28 +470,24 @@ def insert_listitem_itemlist(contributor: str, name: str, description: str,
         append: True if ListItem is appended at the bottom of the ItemList
         creator: The person, organization or service who created the ItemList.
         position: the position of the ListItem in the ItemList
+        position_strategy: "dense" or "sparse", the strategy that the ItemList was created with.
+          See :func:`create_itemlist`
     Raises:
-        ValueError if both append and position are passed as input arguments
+        ValueError if both append and position are passed as input arguments, or neither of them
+        ValueError if position_strategy is not one of POSITION_STRATEGIES
         ValueError if position is greater than the length of the input ItemList
+        ValueError if the Item or one of the ListItems is not found while linking the new ListItem
         ValueError if a ListItem with position null is in the ItemList
-        IDNotFoundException if ListItem objects are not found
+        IDNotFoundException if the ItemList is not found
         QueryException if the query fails to execute
+    Returns:
+        The identifier of the ListItem object created
     """
     if append and isinstance(position, int):
         raise ValueError("cannot select both append and position arguments")
+    _check_position_strategy(position_strategy)
 
-    itemlist_obj = itemlist_node_exists(itemlist_id=itemlist_id)
-    if not itemlist_obj:
-        raise IDNotFoundException(itemlist_id)
-
-    itemlist_obj = itemlist_obj[0]
-    itemlist_id = itemlist_obj["identifier"]
-    itemlist_elements = itemlist_obj["itemListElement"]
-    # We can't guarantee the order that items come out of the CE, so explicitly sort them
-    try:
-        itemlist_elements = sorted(itemlist_elements, key=lambda k: k['position'])
-    except TypeError:
-        raise ValueError("A ListItem with position null is present. Check the ItemList before to proceed.")
+    view = _load_itemlist_view(itemlist_id, position_strategy)
 
     # If input ListItem objects are already node in the CE, set description to None.
     if ids_mode:
@@ -401,55 +497,630 @@ def insert_listitem_itemlist(contributor: str, name: str, description: str,
         description = listitem
 
     if append:
-        position = len(itemlist_elements)
-        lastitem_id = itemlist_elements[-1]["identifier"]
-
-        listitem_id = create_listitem_node(contributor=contributor,
-                                           name=name,
-                                           creator=creator,
-                                           description=description,
-                                           position=position)
-
-        merge_itemlist_itemlistelement_nodes(itemlist_id=itemlist_id,
-                                             element_id=listitem_id)
-
-        merge_listitem_nextitem_nodes(listitem_id=lastitem_id,
-                                      nextitem_id=listitem_id)
-
-        if ids_mode:
-            merge_listitem_item_nodes(listitem_id=listitem_id, item_id=listitem)
-
-    elif isinstance(position, int):
-        if position > len(itemlist_elements):
-            raise ValueError("position selected is greater than the "
-                             "length of the list. Use append method.")
-
-        # Create
-        listitem_id = create_listitem_node(contributor=contributor,
-                                           name=name,
-                                           description=description,
-                                           position=position)
-
-        merge_itemlist_itemlistelement_nodes(itemlist_id=itemlist_id,
-                                             element_id=listitem_id)
-        if ids_mode:
-            merge_listitem_item_nodes(listitem_id=listitem_id, item_id=listitem)
-
-        # Update
-        if position > 0:
-            merge_listitem_nextitem_nodes(listitem_id=itemlist_elements[position-1]["identifier"],
-                                          nextitem_id=listitem_id)
-
-        merge_listitem_nextitem_nodes(listitem_id=listitem_id,
-                                      nextitem_id=itemlist_elements[position]["identifier"])
-
-        k = position
-        while k < len(itemlist_elements):
-            update_listitem_position(itemlist_elements[k]["identifier"], k+1)
-            k += 1
-
-        k = position
-        while k+1 < len(itemlist_elements):
-            merge_listitem_nextitem_nodes(listitem_id=itemlist_elements[k]["identifier"],
-                                          nextitem_id=itemlist_elements[k+1]["identifier"])
-            k += 1
+        position = len(view)
+    elif not isinstance(position, int):
+        raise ValueError("must select one of append and position arguments")
+    elif position > len(view):
+        raise ValueError("position selected is greater than the "
+                         "length of the list. Use append method.")
+
+    new_position = position
+    # With the dense strategy all following elements are shifted by one
+    new_positions = None
+    if position_strategy == "sparse":
+        new_positions = {}
+        new_position = sparse_insert_position([node.position for node in view], position)
+        if new_position is None:
+            # No gap left between the neighbours, renumber the elements whose position changes
+            renumbered = sparse_positions(len(view) + 1)
+            new_position = renumbered.pop(position)
+            new_positions = {node.identifier: renumbered_position
+                             for node, renumbered_position in zip(view, renumbered)
+                             if node.position != renumbered_position}
+
+    listitem_id = create_listitem_node(contributor=contributor,
+                                       name=name,
+                                       creator=creator,
+                                       description=description,
+                                       position=new_position)
+
+    # Link the new ListItem into the list and update positions in a single sequence of mutations
+    mutations = mutations_itemlist.make_sequence_insert_listitem(
+        itemlist_id=view.identifier,
+        listitem_id=listitem_id,
+        position=position,
+        following_ids=[node.identifier for node in view[position:]],
+        previous_id=view[position - 1].identifier if position > 0 else None,
+        item_id=listitem if ids_mode else None,
+        new_positions=new_positions)
+    result = submit_mutation_sequence(mutations)
+
+    # The nextItem link being replaced may not exist if the list was inconsistent, so ignore its result
+    missing = [alias for alias, value in result.items() if not value and alias != "RemoveListItemNextItemAlias"]
+    if missing:
+        raise ValueError(f"Could not insert the ListItem, nodes not found for {', '.join(missing)}")
+
+    return listitem_id
+
+
+def _longest_increasing_subsequence(values: list):
+    """The indices of a longest strictly increasing subsequence of values"""
+    # tails[k] is the index of the smallest last value of an increasing subsequence of length k + 1
+    tails = []
+    tail_values = []
+    previous = [None] * len(values)
+    for index, value in enumerate(values):
+        k = bisect.bisect_left(tail_values, value)
+        if k > 0:
+            previous[index] = tails[k - 1]
+        if k == len(tails):
+            tails.append(index)
+            tail_values.append(value)
+        else:
+            tails[k] = index
+            tail_values[k] = value
+    indices = set()
+    index = tails[-1] if tails else None
+    while index is not None:
+        indices.add(index)
+        index = previous[index]
+    return indices
+
+
+def _sparse_reposition(positions: list):
+    """New positions for the "sparse" strategy for ListItems that currently have ``positions``, in their new
+    order, where None is a ListItem that doesn't have a position yet. The longest run of ListItems that are
+    already in increasing order keep their positions, and the others get positions spread out between them.
+    If there is no room between them, the list is renumbered"""
+    positioned = [index for index, position in enumerate(positions) if position is not None]
+    keep = {positioned[k] for k in _longest_increasing_subsequence([positions[index] for index in positioned])}
+    new_positions = list(positions)
+    start = 0
+    while start < len(positions):
+        if start in keep:
+            start += 1
+            continue
+        end = start
+        while end < len(positions) and end not in keep:
+            end += 1
+        lower = positions[start - 1] if start > 0 else 0
+        count = end - start
+        upper = positions[end] if end < len(positions) else lower + (count + 1) * POSITION_GAP
+        if upper - lower <= count:
+            return sparse_positions(len(positions))
+        for k in range(count):
+            new_positions[start + k] = lower + (upper - lower) * (k + 1) // (count + 1)
+        start = end
+    return new_positions
+
+
+def plan_itemlist_positions(positions: list, position_strategy: str = "dense"):
+    """Compute new positions for the ListItem objects of an ItemList after they are reordered.
+
+    Arguments:
+        positions: The current position of each ListItem, in the new order, or None for a ListItem that
+          is added to the ItemList
+        position_strategy: "dense" or "sparse", see :func:`create_itemlist`
+    Raises:
+        ValueError if position_strategy is not one of POSITION_STRATEGIES
+    Returns:
+        The new position of each ListItem
+    """
+    _check_position_strategy(position_strategy)
+    if position_strategy == "sparse":
+        return _sparse_reposition(positions)
+    return list(range(len(positions)))
+
+
+def _related_identifier(related):
+    """The identifier of a related node in a query response, which is a dictionary or a list of them"""
+    if isinstance(related, list):
+        related = related[0] if related else None
+    return related["identifier"] if related else None
+
+
+class ListItemNode:
+    """A ListItem object of an :class:`ItemListView`. ``position`` and ``next_id`` are the values in the CE
+    as of the last load or flush. A ListItem that was inserted locally has no identifier until it is flushed."""
+
+    __slots__ = ("identifier", "position", "next_id", "item_id", "description")
+
+    def __init__(self, identifier: Optional[str] = None, position: Optional[int] = None, next_id: Optional[str] = None,
+                 item_id: Optional[str] = None, description: Optional[str] = None):
+        self.identifier = identifier
+        self.position = position
+        self.next_id = next_id
+        self.item_id = item_id
+        self.description = description
+
+    @classmethod
+    def from_element(cls, element: dict):
+        """Make a ListItemNode from an element of the itemListElement of a :func:`query_itemlist` response"""
+        return cls(element["identifier"], element.get("position"), _related_identifier(element.get("nextItem")),
+                   _related_identifier(element.get("item")), element.get("description"))
+
+    def __repr__(self):
+        return f"ListItemNode(identifier={self.identifier!r}, position={self.position!r}, item_id={self.item_id!r})"
+
+
+class ItemListView:
+    """A local model of an ItemList object and its ListItem objects, built from a single
+    :func:`query_itemlist` response.
+
+    The ListItems are kept in order. Looking up a ListItem by index or identifier takes constant time.
+    :meth:`find` takes constant time while the order is unchanged, but after an edit it scans the order, O(n),
+    until enough lookups have been made to make rebuilding its index worthwhile. :meth:`at_position` looks up
+    the positions in the CE as of the last load or flush, not the local order.
+
+    Edits made with :meth:`insert`, :meth:`move`, :meth:`remove`, :meth:`swap` and :meth:`set_order` only
+    change the local order, and :meth:`flush` writes all of them to the CE at once with the fewest mutations,
+    see :func:`plan_itemlist_edit`.
+
+    Arguments:
+        identifier: The identifier of the ItemList
+        elements: The itemListElement of a :func:`query_itemlist` response
+        position_strategy: "dense" or "sparse", the strategy that the ItemList was created with.
+          See :func:`create_itemlist`
+    """
+
+    __slots__ = ("identifier", "position_strategy", "_nodes", "_order", "_live", "_index", "_index_valid", "_misses",
+                 "_by_position")
+
+    # Rebuild the index after this many lookups that it couldn't answer since the last edit
+    INDEX_REBUILD_MISSES = 16
+
+    def __init__(self, identifier: Optional[str], elements: list, position_strategy: str = "dense"):
+        _check_position_strategy(position_strategy)
+        self.identifier = identifier
+        self.position_strategy = position_strategy
+        order = [ListItemNode.from_element(element) for element in elements]
+        # We can't guarantee the order that items come out of the CE, so explicitly sort them
+        order.sort(key=lambda node: (node.position is None, node.position or 0))
+        self._set_state(order)
+
+    @classmethod
+    def load(cls, itemlist_id: str, position_strategy: str = "dense"):
+        """Query an ItemList from the CE
+        Raises:
+            IDNotFoundException if the ItemList is not found
+            QueryException if the query fails to execute
+        """
+        itemlist_obj = itemlist_node_exists(itemlist_id=itemlist_id)
+        if not itemlist_obj:
+            raise IDNotFoundException(itemlist_id)
+        return cls(itemlist_obj[0]["identifier"], itemlist_obj[0]["itemListElement"], position_strategy)
+
+    def _set_state(self, order: list):
+        # The ListItems in the CE, by identifier
+        self._nodes = {node.identifier: node for node in order}
+        self._order = order
+        # The ListItems in the local order that have an identifier
+        self._live = dict(self._nodes)
+        # _index maps identifiers to indexes in _order, and is only up to date for indexes below _index_valid
+        self._index = {}
+        self._index_valid = 0
+        self._misses = 0
+        self._by_position = None
+
+    def _invalidate(self, index: int):
+        self._index_valid = min(self._index_valid, index)
+        self._misses = 0
+
+    def __len__(self):
+        return len(self._order)
+
+    def __iter__(self):
+        return iter(self._order)
+
+    def __getitem__(self, index):
+        """The ListItemNode at an index of the local order, or a list of them for a slice"""
+        return self._order[index]
+
+    def __contains__(self, identifier: str):
+        return identifier in self._live
+
+    def find(self, identifier: str):
+        """The index of a ListItem in the local order, or None if it is not in the ItemList.
+        O(n) for the first lookups after an edit, see :attr:`INDEX_REBUILD_MISSES`"""
+        node = self._live.get(identifier)
+        if node is None:
+            return None
+        index = self._index.get(identifier)
+        if index is not None and index < self._index_valid:
+            return index
+        self._misses += 1
+        if self._misses < self.INDEX_REBUILD_MISSES:
+            # Right after an edit, scanning the order is cheaper than rebuilding the index
+            return self._order.index(node)
+        for k in range(self._index_valid, len(self._order)):
+            if self._order[k].identifier is not None:
+                self._index[self._order[k].identifier] = k
+        self._index_valid = len(self._order)
+        return self._index[identifier]
+
+    def index(self, identifier: str):
+        """The index of a ListItem in the local order
+        Raises:
+            ValueError if the ListItem is not in the ItemList
+        """
+        index = self.find(identifier)
+        if index is None:
+            raise ValueError(f"ListItem {identifier} is not in the ItemList")
+        return index
+
+    def get(self, identifier: str):
+        """The ListItemNode with an identifier, or None if it is not in the ItemList"""
+        return self._live.get(identifier)
+
+    def at_position(self, position: int):
+        """The ListItemNode that had a position in the CE at the last load or flush, or None.
+        Local edits that aren't flushed yet don't change the result"""
+        if self._by_position is None:
+            self._by_position = {node.position: node for node in self._nodes.values()}
+        return self._by_position.get(position)
+
+    def identifiers(self):
+        """The identifiers of the ListItems in the local order, None for ListItems that are not flushed yet"""
+        return [node.identifier for node in self._order]
+
+    def check_chain(self):
+        """Check the nextItem links and positions of the ListItems in the CE in a single pass.
+
+        Returns:
+            A list of descriptions of the problems found, empty if the nextItem links form a single chain
+            through all the ListItems, in the order of their positions
+        """
+        problems = []
+        nodes = self._nodes
+        if not nodes:
+            return problems
+        null = [identifier for identifier, node in nodes.items() if node.position is None]
+        if null:
+            problems.append(f"ListItems with position null: {', '.join(null)}")
+        if len({node.position for node in nodes.values()} - {None}) != len(nodes) - len(null):
+            problems.append("Several ListItems have the same position")
+        targets = set()
+        for identifier, node in nodes.items():
+            if node.next_id is None:
+                continue
+            if node.next_id not in nodes:
+                problems.append(f"The nextItem of {identifier} is not in the ItemList")
+            elif node.next_id in targets:
+                problems.append(f"{node.next_id} is the nextItem of more than one ListItem")
+            targets.add(node.next_id)
+        heads = [identifier for identifier in nodes if identifier not in targets]
+        if len(heads) > 1:
+            problems.append(f"The nextItem chain is broken into {len(heads)} parts, starting at {', '.join(heads)}")
+
+        visited = set()
+        chain = []
+        for head in heads:
+            identifier = head
+            while identifier in nodes and identifier not in visited:
+                visited.add(identifier)
+                chain.append(identifier)
+                identifier = nodes[identifier].next_id
+            if identifier in visited:
+                problems.append(f"The nextItem chain starting at {head} has a cycle at {identifier}")
+        if len(visited) < len(nodes):
+            problems.append(f"{len(nodes) - len(visited)} ListItems are in a cycle that no chain leads to")
+        elif not problems and chain != list(nodes):
+            problems.append("The nextItem chain doesn't follow the order of the positions")
+        return problems
+
+    def insert(self, index: int, item_id: str = None, description: str = None):
+        """Insert a new ListItem at an index of the local order
+        Raises:
+            ValueError if index is greater than the length of the ItemList
+        Returns:
+            The new ListItemNode, which gets an identifier when it is flushed
+        """
+        if index > len(self._order):
+            raise ValueError("position selected is greater than the length of the list")
+        node = ListItemNode(item_id=item_id, description=description)
+        self._order.insert(index, node)
+        self._invalidate(index)
+        return node
+
+    def move(self, identifier: str, index: int):
+        """Move a ListItem to an index of the local order
+        Raises:
+            ValueError if the ListItem is not in the ItemList, or index is greater than the length of the ItemList
+        """
+        current = self.index(identifier)
+        if index >= len(self._order):
+            raise ValueError("position selected is greater than the length of the list")
+        node = self._order.pop(current)
+        self._order.insert(index, node)
+        self._invalidate(min(current, index))
+
+    def remove(self, identifier: str):
+        """Remove a ListItem from the local order. It is deleted when the ItemList is flushed
+        Raises:
+            ValueError if the ListItem is not in the ItemList
+        """
+        index = self.index(identifier)
+        del self._order[index]
+        del self._live[identifier]
+        self._invalidate(index)
+
+    def swap(self, identifier: str, other_identifier: str):
+        """Swap two ListItems in the local order
+        Raises:
+            ValueError if one of the ListItems is not in the ItemList
+        """
+        first, second = self.index(identifier), self.index(other_identifier)
+        self._order[first], self._order[second] = self._order[second], self._order[first]
+        self._invalidate(min(first, second))
+
+    def set_order(self, order: list):
+        """Replace the local order. ListItems that are not in the new order are deleted when the ItemList is
+        flushed.
+
+        Arguments:
+            order: The identifiers of ListItems of the ItemList, or new ListItemNode objects to insert
+        Raises:
+            ValueError if order has identifiers that are not ListItems of the ItemList, or duplicate identifiers
+        """
+        nodes = [entry if isinstance(entry, ListItemNode) else self._nodes.get(entry) for entry in order]
+        unknown = [entry for entry, node in zip(order, nodes) if node is None]
+        if unknown:
+            raise ValueError(f"ListItems not in the ItemList: {', '.join(unknown)}")
+        identifiers = [node.identifier for node in nodes if node.identifier is not None]
+        if len(set(identifiers)) != len(identifiers):
+            raise ValueError("new_order has duplicate ListItems")
+        self._order = nodes
+        self._live = {node.identifier: node for node in nodes if node.identifier is not None}
+        self._invalidate(0)
+
+    def plan(self, positions: list = None):
+        """Compute the mutations to write the local order to the CE, see :func:`plan_itemlist_edit`.
+        All ListItems must have an identifier.
+
+        Arguments:
+            positions: The new position of each ListItem in the local order, if already computed with
+              :func:`plan_itemlist_positions`
+        Raises:
+            ValueError if a ListItem has no identifier
+        Returns:
+            A list of mutations [(mutationalias, mutationname, args),...] for
+            :func:`trompace.connection.submit_mutation_sequence`
+        """
+        order = self._order
+        if any(node.identifier is None for node in order):
+            raise ValueError("New ListItems are only created when the ItemList is flushed")
+        if positions is None:
+            positions = plan_itemlist_positions([node.position for node in order], self.position_strategy)
+        new_next = {node.identifier: next_node.identifier for node, next_node in zip(order, order[1:])}
+        kept = {node.identifier for node in order}
+        delete_ids = [identifier for identifier in self._nodes if identifier not in kept]
+        deleted = set(delete_ids)
+        # Deleting a ListItem also removes its nextItem links
+        remove_nextitems = [(identifier, node.next_id) for identifier, node in self._nodes.items()
+                            if node.next_id is not None and new_next.get(identifier) != node.next_id
+                            and identifier not in deleted and node.next_id not in deleted]
+        add_nextitems = [(identifier, next_id) for identifier, next_id in new_next.items()
+                         if identifier not in self._nodes or self._nodes[identifier].next_id != next_id]
+        new_positions = {node.identifier: position for node, position in zip(order, positions)
+                         if node.position != position}
+        return mutations_itemlist.make_sequence_edit_itemlist(remove_nextitems=remove_nextitems,
+                                                              add_nextitems=add_nextitems,
+                                                              new_positions=new_positions,
+                                                              delete_ids=delete_ids)
+
+    def flush(self, contributor: str = None, creator: str = None, name: str = None):
+        """Write the local edits to the CE. New ListItems are created in one sequence of mutations, and
+        all the other changes are sent in a second one.
+
+        Arguments:
+            contributor: A person, an organization, or a service responsible for contributing new ListItems
+              to the web resource.
+            creator: The person, organization or service who created new ListItems.
+            name: The name of new ListItem objects.
+        Raises:
+            ValueError if a ListItem or Item is not found while linking the ListItems
+            QueryException if the query fails to execute
+        Returns:
+            The identifiers of the ListItem objects of the ItemList, in order
+        """
+        order = self._order
+        positions = plan_itemlist_positions([node.position for node in order], self.position_strategy)
+        mutations = []
+
+        added = [(node, position) for node, position in zip(order, positions) if node.identifier is None]
+        if added:
+            create = mutations_itemlist.make_sequence_create_listitem(
+                listitems=added, contributor=contributor, creator=creator, name=name,
+                description=[node.description for node, _ in added], positions=[position for _, position in added])
+            result = submit_mutation_sequence(create)
+            if not all(result.values()):
+                raise QueryException([{"message": "Number of ListItem objects created does not match with input list"}])
+            for (node, position), (alias, _, _) in zip(added, create):
+                node.identifier = result[alias]["identifier"]
+                node.position = position
+                self._live[node.identifier] = node
+            self._invalidate(0)
+            mutations += mutations_itemlist.make_sequence_add_itemlist_itemlist_element(
+                itemlist_id=self.identifier, element_ids=[node.identifier for node, _ in added])
+            with_items = [node for node, _ in added if node.item_id is not None]
+            if with_items:
+                mutations += mutations_itemlist.make_sequence_add_listitem_item(
+                    listitem_ids=[node.identifier for node in with_items],
+                    item_ids=[node.item_id for node in with_items])
+
+        mutations += self.plan(positions)
+        _submit_itemlist_edit(mutations)
+
+        # The CE now has the local order
+        for k, (node, position) in enumerate(zip(order, positions)):
+            node.position = position
+            node.next_id = order[k + 1].identifier if k + 1 < len(order) else None
+        self._set_state(order)
+        return self.identifiers()
+
+
+def _load_itemlist_view(itemlist_id: str, position_strategy: str = "dense"):
+    view = ItemListView.load(itemlist_id, position_strategy)
+    if any(node.position is None for node in view):
+        raise ValueError("A ListItem with position null is present. Check the ItemList before to proceed.")
+    return view
+
+
+def plan_itemlist_edit(itemlist_elements: list, new_order: list, position_strategy: str = "dense",
+                       positions: list = None):
+    """Compute the mutations to change the order of the ListItem objects of an ItemList.
+
+    Only the nextItem links that differ between the current and the new order are removed and added, and only
+    the ListItems whose position changes are updated. With the "sparse" position strategy the ListItems of the
+    longest run that is already in order keep their positions.
+
+    Arguments:
+        itemlist_elements: The itemListElement of a :func:`query_itemlist` response
+        new_order: The identifiers of the ListItem objects in their new order. ListItem objects
+          that are not in new_order are deleted
+        position_strategy: "dense" or "sparse", see :func:`create_itemlist`
+        positions: The new position of each ListItem in new_order, if already computed with
+          :func:`plan_itemlist_positions`
+    Raises:
+        ValueError if new_order has identifiers that are not ListItems of the ItemList, or duplicate identifiers
+        ValueError if position_strategy is not one of POSITION_STRATEGIES
+    Returns:
+        A list of mutations [(mutationalias, mutationname, args),...] for
+        :func:`trompace.connection.submit_mutation_sequence`
+    """
+    view = ItemListView(None, itemlist_elements, position_strategy)
+    view.set_order(new_order)
+    return view.plan(positions)
+
+
+def _submit_itemlist_edit(mutations: list):
+    if not mutations:
+        return
+    result = submit_mutation_sequence(mutations)
+    # A nextItem link being removed may not exist if the list was inconsistent, so ignore its result
+    missing = [alias for alias, value in result.items() if not value and not alias.startswith("RemoveListItemNextItem")]
+    if missing:
+        raise ValueError(f"Could not edit the ItemList, nodes not found for {', '.join(missing)}")
+
+
+def reorder_itemlist(itemlist_id: str, new_order: list, position_strategy: str = "dense"):
+    """Change the order of the ListItem objects of an ItemList object with a single sequence of mutations.
+
+    Arguments:
+        itemlist_id: The identifier of the ItemList
+        new_order: The identifiers of all the ListItem objects of the ItemList, in their new order
+        position_strategy: "dense" or "sparse", the strategy that the ItemList was created with.
+          See :func:`create_itemlist`
+    Raises:
+        ValueError if new_order doesn't have each ListItem of the ItemList once
+        IDNotFoundException if the ItemList is not found
+        QueryException if the query fails to execute
+    """
+    view = _load_itemlist_view(itemlist_id, position_strategy)
+    if sorted(new_order) != sorted(view.identifiers()):
+        raise ValueError("new_order must have each ListItem of the ItemList once")
+    view.set_order(new_order)
+    view.flush()
+
+
+def apply_itemlist_ops(itemlist_id: str, ops: list, position_strategy: str = "dense"):
+    """Apply a sequence of edit operations to an ItemList object. The operations are applied to the
+    current order of the ListItem objects, and the result is written to the CE with a single sequence of
+    mutations, see :class:`ItemListView`.
+
+    Arguments:
+        itemlist_id: The identifier of the ItemList
+        ops: A list of operations, each one of
+          ``("move", listitem_id, position)`` to move a ListItem to a position,
+          ``("remove", listitem_id)`` to delete a ListItem, or
+          ``("swap", listitem_id, other_listitem_id)`` to swap the positions of two ListItems
+        position_strategy: "dense" or "sparse", the strategy that the ItemList was created with.
+          See :func:`create_itemlist`
+    Raises:
+        ValueError if an operation is unknown or refers to a ListItem that is not in the ItemList
+        ValueError if a position is greater than the length of the ItemList
+        IDNotFoundException if the ItemList is not found
+        QueryException if the query fails to execute
+    Returns:
+        The identifiers of the ListItem objects in their new order
+    """
+    view = _load_itemlist_view(itemlist_id, position_strategy)
+    for op in ops:
+        if op[0] == "move":
+            view.move(op[1], op[2])
+        elif op[0] == "remove":
+            view.remove(op[1])
+        elif op[0] == "swap":
+            view.swap(op[1], op[2])
+        else:
+            raise ValueError(f"Unknown ItemList operation {op[0]}")
+    return view.flush()
+
+
+def move_listitem(itemlist_id: str, listitem_id: str, position: int, position_strategy: str = "dense"):
+    """Move a ListItem object to a position in its ItemList object. See :func:`apply_itemlist_ops`"""
+    return apply_itemlist_ops(itemlist_id, [("move", listitem_id, position)], position_strategy)
+
+
+def remove_listitem(itemlist_id: str, listitem_id: str, position_strategy: str = "dense"):
+    """Delete a ListItem object from its ItemList object. See :func:`apply_itemlist_ops`"""
+    return apply_itemlist_ops(itemlist_id, [("remove", listitem_id)], position_strategy)
+
+
+def swap_listitems(itemlist_id: str, listitem_id: str, other_listitem_id: str, position_strategy: str = "dense"):
+    """Swap the positions of two ListItem objects of an ItemList object. See :func:`apply_itemlist_ops`"""
+    return apply_itemlist_ops(itemlist_id, [("swap", listitem_id, other_listitem_id)], position_strategy)
+
+
+def sync_itemlist(itemlist_id: str, desired_item_ids: list, contributor: str = None, creator: str = None,
+                  name: str = None, position_strategy: str = "dense", existence_cache: ExistenceCache = None):
+    """Change an ItemList object so that the Items of its ListItem objects are ``desired_item_ids``, in order.
+
+    Existing ListItems are reused for the Items that are already in the list, and the longest run of them
+    that is already in the desired order is left in place. Only the ListItems for new Items are created, the
+    ListItems of Items that are no longer in the list are deleted, and only the nextItem links and positions
+    that change are updated. The mutations are sent in at most two sequences of mutations.
+
+    With the "dense" position strategy, positions are renumbered from 0, so inserting or removing an Item
+    updates the position of every ListItem after it, and a change near the start of the list costs O(n)
+    mutations. With the "sparse" strategy only the positions of the moved and new ListItems usually change,
+    and the number of mutations is close to the size of the change.
+
+    Arguments:
+        itemlist_id: The identifier of the ItemList
+        desired_item_ids: The identifiers of the Items of the ItemList, in order
+        contributor: A person, an organization, or a service responsible for contributing new ListItems to the
+          web resource.
+        creator: The person, organization or service who created new ListItems.
+        name: The name of new ListItem objects.
+        position_strategy: "dense" or "sparse", the strategy that the ItemList was created with.
+          See :func:`create_itemlist`
+        existence_cache: A cache of the nodes that are known to exist, to skip checking them again.
+          See :class:`ExistenceCache`
+    Raises:
+        IDNotFoundException if the ItemList or one of the new Items is not found
+        ValueError if a ListItem with position null is in the ItemList
+        QueryException if the query fails to execute
+    Returns:
+        The identifiers of the ListItem objects of the ItemList, in order
+    """
+    view = _load_itemlist_view(itemlist_id, position_strategy)
+
+    # Reuse the existing ListItems of each Item in order, in case an Item is in the list more than once
+    reusable = {}
+    for node in reversed(view):
+        if node.item_id is not None:
+            reusable.setdefault(node.item_id, []).append(node)
+    order = []
+    for item_id in desired_item_ids:
+        nodes = reusable.get(item_id)
+        order.append(nodes.pop() if nodes else ListItemNode(item_id=item_id))
+
+    added = [node.item_id for node in order if node.identifier is None]
+    if added:
+        not_found = get_nonexistent_listitem_nodes(list(dict.fromkeys(added)), cache=existence_cache)
+        if not_found:
+            raise IDNotFoundException(not_found)
+
+    view.set_order(order)
+    return view.flush(contributor=contributor, creator=creator, name=name)
@@ -1,11 +1,8 @@
 import asyncio
-import configparser
 import json
 
-import websockets
-
 from trompace import StringConstant, make_parameters
-from trompace.connection import submit_query
+from trompace.connection import submit_query_async
 from trompace.exceptions import ValueNotFound
 from trompace.subscriptions.controlaction import subscription_controlaction_client
 
@@ -103,6 +100,7 @@ async def subscribe_controlaction(controlaction_id):
     is_ok = False
     subs = subscription_controlaction_client(controlaction_id)
     print(subs)
+    import websockets
     async with websockets.connect(uri, subprotocols=['graphql-ws']) as websocket:
         await websocket.send(INIT_STR)
         async for message in websocket:
@@ -127,6 +125,7 @@ async def request_controlaction(req_config_file='req_config1.ini'):
     Raises:
         ValueNotFound exception if one of the required values for the property or property value specifications is not set.
     """
+    import configparser
     config = configparser.ConfigParser()
     config.read(req_config_file)
 
@@ -166,7 +165,7 @@ async def request_controlaction(req_config_file='req_config1.ini'):
 
     query = q1.format(params=params)
 
-    resp_1 = await submit_query(query)
+    resp_1 = await submit_query_async(query)
 
     output_id = resp_1['data']['RequestControlAction']['identifier']
 
@@ -179,7 +178,7 @@ async def request_controlaction(req_config_file='req_config1.ini'):
     while act_status == 'accepted' or act_status == 'running':
         await asyncio.sleep(1)
 
-        resp_2 = await submit_query(status_query)
+        resp_2 = await submit_query_async(status_query)
 
         act_status = resp_2['data']['ControlAction'][0]['actionStatus']
 
@@ -0,0 +1,83 @@
+# Encoding and decoding of the JSON sent to and received from the CE.
+import json
+import threading
+
+from trompace.config import config
+
+
+class JsonCodec:
+    """Encode and decode JSON with the standard library :mod:`json` module"""
+
+    name = "json"
+
+    def dumps(self, obj) -> bytes:
+        """Encode an object as compact UTF-8 JSON"""
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def loads(self, data):
+        """Decode JSON from bytes or a string. Raises ValueError if it isn't valid JSON"""
+        return json.loads(data)
+
+
+class OrjsonCodec(JsonCodec):
+    """Encode and decode JSON with `orjson <https://github.com/ijl/orjson>`_, which is several times
+    faster than :mod:`json` for large documents.
+
+    A few values that orjson doesn't support but :mod:`json` does (integers larger than 64 bits,
+    dictionaries with keys that aren't strings, and ``NaN`` or ``Infinity`` in a response) are handled by
+    falling back to :mod:`json`, so both codecs give the same results.
+    """
+
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+
+    def dumps(self, obj) -> bytes:
+        try:
+            return self._orjson.dumps(obj)
+        except TypeError:
+            return super().dumps(obj)
+
+    def loads(self, data):
+        try:
+            return self._orjson.loads(data)
+        except ValueError:
+            return super().loads(data)
+
+
+CODECS = {"json": JsonCodec, "orjson": OrjsonCodec}
+
+# The codec used for requests to the CE, and the config setting that it was chosen with
+_codec = None
+_codec_setting = None
+_codec_lock = threading.Lock()
+
+
+def make_codec(name: str = "auto"):
+    """Make a codec by name. ``auto`` chooses the fastest codec that is installed
+    Raises:
+        ValueError if ``name`` is not ``auto`` or one of ``CODECS``
+        ImportError if the library for the codec is not installed
+    """
+    if name == "auto":
+        try:
+            return OrjsonCodec()
+        except ImportError:
+            return JsonCodec()
+    if name not in CODECS:
+        raise ValueError(f"Unknown JSON codec '{name}', expected 'auto' or one of {', '.join(CODECS)}")
+    return CODECS[name]()
+
+
+def get_codec():
+    """Get the codec used to encode requests to the CE and decode its responses,
+    chosen with the ``connection.json_codec`` config item"""
+    global _codec, _codec_setting
+    setting = config.connection_json_codec
+    with _codec_lock:
+        if _codec is None or setting != _codec_setting:
+            _codec = make_codec(setting)
+            _codec_setting = setting
+        return _codec
@@ -1,20 +1,24 @@
-import configparser
-import datetime
 import logging
+import math
 import os
+import threading
+import time
 import urllib
 
-from typing import List, Dict
+from typing import List, TYPE_CHECKING
 from urllib.parse import urlparse
 
-import requests
-
 import trompace
-import jwt
+
+if TYPE_CHECKING:
+    import configparser
+
+# configparser, jwt and asyncio are imported when they are first needed, so that importing
+# trompace.config (and modules that depend on it) stays fast
 
 
 class TrompaConfig:
-    config: configparser.ConfigParser = None
+    config: "configparser.ConfigParser" = None
     host: str = None
     websocket_host: str = None
 
@@ -29,10 +33,59 @@ class TrompaConfig:
 
     # path to store a cache file containing the jwt token
     jwt_key_cache: str = None
-    # jwt token
-    jwt_token_encoded: str = None
-    # decoded jwt token
-    jwt_token_decoded: Dict[str, str] = {}
+    # renew the jwt token this many seconds before it expires, but no earlier than half way through its lifetime
+    jwt_refresh_margin: float = 3600.0
+    # a TokenRefresher renews the jwt token after this fraction of its lifetime
+    jwt_refresh_fraction: float = 0.4
+    # (token, refresh_at, issued, expiry, decoded), replaced in a single assignment so that other threads
+    # always see a consistent token and renewal time
+    _jwt_current = (None, 0.0, 0.0, 0.0, {})
+
+    # Number of per-host connection pools kept by the shared HTTP session
+    connection_pool_connections: int = 10
+    # Maximum number of connections kept open to a single host
+    connection_pool_maxsize: int = 10
+    # Number of seconds that the shared HTTP session can be idle before its connections are discarded
+    connection_keepalive_timeout: float = 60.0
+    # Maximum number of async requests in progress at the same time
+    connection_max_in_flight: int = 100
+    # Maximum number of aliased mutations sent in a single request by connection.submit_mutation_sequence
+    connection_batch_max_aliases: int = 500
+    # Maximum size in bytes of a single request sent by connection.submit_mutation_sequence
+    connection_batch_max_bytes: int = 1000000
+    # Send the hash of a query instead of the full query (automatic persisted queries)
+    connection_persisted_queries: bool = False
+    # Number of seconds to wait for a connection to the CE, and for data from the CE (0 to wait forever)
+    connection_connect_timeout: float = 10.0
+    connection_read_timeout: float = 120.0
+    # After this many consecutive failed requests to the CE, fail new requests immediately
+    # for circuit_breaker_cooldown seconds (0 to disable)
+    connection_circuit_breaker_threshold: int = 5
+    connection_circuit_breaker_cooldown: float = 30.0
+    # Maximum number of attempts for a request that fails with a transient error (1 to disable retries)
+    connection_retry_max_attempts: int = 4
+    # Seconds to wait before the first retry. The wait doubles after each attempt, up to retry_backoff_max
+    connection_retry_backoff_base: float = 0.5
+    connection_retry_backoff_max: float = 30.0
+    # Don't start a retry later than this many seconds after the first attempt
+    connection_retry_deadline: float = 120.0
+    # Maximum average number of requests per second sent to the CE (0 for no limit), and the maximum burst
+    connection_rate_limit: float = 0.0
+    connection_rate_limit_burst: int = 10
+    # Adapt the number of concurrent requests to the latency and error rate of the CE
+    connection_adaptive_concurrency: bool = False
+    connection_adaptive_concurrency_min: int = 1
+    connection_adaptive_concurrency_max: int = 100
+    # Reduce concurrency if the latency of requests is higher than this many seconds.
+    # If 0, reduce it if latency rises well above its usual value
+    connection_adaptive_latency_target: float = 0.0
+    # The library used to encode requests to the CE and decode its responses: json, orjson,
+    # or auto to use orjson if it is installed
+    connection_json_codec: str = "auto"
+
+    def __init__(self):
+        # held while requesting a new token, so that only one request is made at a time
+        self._jwt_lock = threading.Lock()
 
     def load(self, configfile: str = None):
         if configfile is None:
@@ -42,11 +95,13 @@ class TrompaConfig:
             if not os.path.exists(configfile):
                 raise ValueError(f"No such config file '{configfile}'")
 
+        import configparser
         self.config = configparser.ConfigParser()
         self.config.read(configfile)
 
         self._set_logging()
         self._set_server()
+        self._set_connection()
         self._set_jwt()
 
     def _set_logging(self):
@@ -79,6 +134,54 @@ class TrompaConfig:
         websocket_host = f"{wss_scheme}://{hostpath}"
         self.websocket_host = urllib.parse.urljoin(websocket_host, "graphql")
 
+    def _set_connection(self):
+        if "connection" not in self.config:
+            return
+        connection = self.config["connection"]
+        self.connection_pool_connections = connection.getint("pool_connections", self.connection_pool_connections)
+        self.connection_pool_maxsize = connection.getint("pool_maxsize", self.connection_pool_maxsize)
+        self.connection_keepalive_timeout = connection.getfloat("keepalive_timeout",
+                                                                self.connection_keepalive_timeout)
+        self.connection_max_in_flight = connection.getint("max_in_flight", self.connection_max_in_flight)
+        self.connection_batch_max_aliases = connection.getint("batch_max_aliases", self.connection_batch_max_aliases)
+        self.connection_batch_max_bytes = connection.getint("batch_max_bytes", self.connection_batch_max_bytes)
+        self.connection_persisted_queries = connection.getboolean("persisted_queries",
+                                                                  self.connection_persisted_queries)
+        self.connection_connect_timeout = connection.getfloat("connect_timeout", self.connection_connect_timeout)
+        self.connection_read_timeout = connection.getfloat("read_timeout", self.connection_read_timeout)
+        self.connection_circuit_breaker_threshold = connection.getint("circuit_breaker_threshold",
+                                                                      self.connection_circuit_breaker_threshold)
+        self.connection_circuit_breaker_cooldown = connection.getfloat("circuit_breaker_cooldown",
+                                                                       self.connection_circuit_breaker_cooldown)
+        self.connection_retry_max_attempts = connection.getint("retry_max_attempts",
+                                                               self.connection_retry_max_attempts)
+        self.connection_retry_backoff_base = connection.getfloat("retry_backoff_base",
+                                                                 self.connection_retry_backoff_base)
+        self.connection_retry_backoff_max = connection.getfloat("retry_backoff_max", self.connection_retry_backoff_max)
+        self.connection_retry_deadline = connection.getfloat("retry_deadline", self.connection_retry_deadline)
+        self.connection_rate_limit = connection.getfloat("rate_limit", self.connection_rate_limit)
+        self.connection_rate_limit_burst = connection.getint("rate_limit_burst", self.connection_rate_limit_burst)
+        self.connection_adaptive_concurrency = connection.getboolean("adaptive_concurrency",
+                                                                     self.connection_adaptive_concurrency)
+        self.connection_adaptive_concurrency_min = connection.getint("adaptive_concurrency_min",
+                                                                     self.connection_adaptive_concurrency_min)
+        self.connection_adaptive_concurrency_max = connection.getint("adaptive_concurrency_max",
+                                                                     self.connection_adaptive_concurrency_max)
+        self.connection_adaptive_latency_target = connection.getfloat("adaptive_latency_target",
+                                                                      self.connection_adaptive_latency_target)
+        self.connection_json_codec = connection.get("json_codec", self.connection_json_codec)
+        if self.connection_pool_connections < 1 or self.connection_pool_maxsize < 1 \
+                or self.connection_max_in_flight < 1 or self.connection_retry_max_attempts < 1 \
+                or self.connection_rate_limit_burst < 1 or self.connection_adaptive_concurrency_min < 1:
+            raise ValueError("connection.pool_connections, connection.pool_maxsize, connection.max_in_flight, "
+                             "connection.retry_max_attempts, connection.rate_limit_burst and "
+                             "connection.adaptive_concurrency_min must be at least 1")
+        if self.connection_adaptive_concurrency_max < self.connection_adaptive_concurrency_min:
+            raise ValueError("connection.adaptive_concurrency_max must be at least connection.adaptive_concurrency_min")
+        from trompace.codec import CODECS
+        if self.connection_json_codec != "auto" and self.connection_json_codec not in CODECS:
+            raise ValueError(f"connection.json_codec must be auto or one of {', '.join(CODECS)}")
+
     def _set_jwt(self):
         server = self.config["server"]
         host = server.get("host")
@@ -95,6 +198,10 @@ class TrompaConfig:
         self.jwt_id = auth.get("id")
         self.jwt_key = auth.get("key")
         self.jwt_scopes = auth.get("scopes").split(",")
+        self.jwt_refresh_margin = auth.getfloat("token_refresh_margin", self.jwt_refresh_margin)
+        self.jwt_refresh_fraction = auth.getfloat("token_refresh_fraction", self.jwt_refresh_fraction)
+        if not 0 < self.jwt_refresh_fraction < 1:
+            raise ValueError("auth.token_refresh_fraction must be between 0 and 1")
 
         if "token_cache_dir" not in auth:
             cache_dir = os.getcwd()
@@ -113,60 +220,231 @@ class TrompaConfig:
                 self._set_jwt_token(token)
 
     def _set_jwt_token(self, token):
+        """Set the current JWT token, returning False if it can't be decoded"""
+        import jwt
         try:
             decoded = jwt.decode(token, algorithms=["HS256"], options={"verify_signature": False})
-            self.jwt_token_encoded = token
-            self.jwt_token_decoded = decoded
         except (jwt.DecodeError, jwt.ExpiredSignatureError):
-            trompace.logger.warn("Could not decode cached jwt token, ignoring")
+            trompace.logger.warning("Could not decode jwt token, ignoring")
+            return False
+        self._set_jwt_claims(token, decoded)
+        return True
+
+    def _set_jwt_claims(self, token, decoded):
+        """Publish a token and its decoded claims, computing when it should be renewed. A token without
+        an expiry time never expires, and is not renewed"""
+        if "exp" not in decoded:
+            issued = float(decoded.get("iat", time.time()))
+            self._jwt_current = (token, math.inf, issued, math.inf, decoded)
+            return
+        expiry = float(decoded["exp"])
+        issued = float(decoded.get("iat", min(time.time(), expiry)))
+        margin = min(self.jwt_refresh_margin, (expiry - issued) / 2)
+        self._jwt_current = (token, expiry - margin, issued, expiry, decoded)
+
+    @property
+    def jwt_token_encoded(self):
+        """The current jwt token, or None"""
+        return self._jwt_current[0]
+
+    @jwt_token_encoded.setter
+    def jwt_token_encoded(self, token):
+        if token is None:
+            self._jwt_current = (None, 0.0, 0.0, 0.0, {})
+            return
+        import jwt
+        try:
+            decoded = jwt.decode(token, algorithms=["HS256"], options={"verify_signature": False})
+        except (jwt.DecodeError, jwt.ExpiredSignatureError):
+            trompace.logger.warning("Could not decode jwt token, it will be renewed when it is needed")
+            self._jwt_current = (token, 0.0, 0.0, 0.0, {})
+            return
+        self._set_jwt_claims(token, decoded)
+
+    @jwt_token_encoded.deleter
+    def jwt_token_encoded(self):
+        self.jwt_token_encoded = None
+
+    @property
+    def jwt_token_decoded(self):
+        """The claims of the current jwt token"""
+        return self._jwt_current[4]
+
+    @jwt_token_decoded.setter
+    def jwt_token_decoded(self, decoded):
+        self._set_jwt_claims(self._jwt_current[0], dict(decoded or {}))
+
+    @jwt_token_decoded.deleter
+    def jwt_token_decoded(self):
+        self._set_jwt_claims(self._jwt_current[0], {})
+
+    @property
+    def jwt_token_issued(self):
+        """The unix timestamp when the current jwt token was issued"""
+        return self._jwt_current[2]
+
+    @property
+    def jwt_token_expiry(self):
+        """The unix timestamp when the current jwt token expires"""
+        return self._jwt_current[3]
+
+    @property
+    def jwt_token_refresh_at(self):
+        """The unix timestamp after which the current jwt token is renewed"""
+        return self._jwt_current[1]
 
     def _save_jwt_token(self, token):
-        """Save a JWT token to the cache file"""
-        with open(self.jwt_key_cache, "w") as fp:
-            fp.write(token)
+        """Save a JWT token to the cache file. The token is written to a temporary file which then replaces
+        the cache file, so that other processes never read a partially written token"""
+        if self.jwt_key_cache is None:
+            return
+        import tempfile
+        fd, path = tempfile.mkstemp(dir=os.path.dirname(self.jwt_key_cache) or ".", prefix=".trompace-client-jwt-")
+        try:
+            with os.fdopen(fd, "w") as fp:
+                fp.write(token)
+            os.replace(path, self.jwt_key_cache)
+        except BaseException:
+            os.unlink(path)
+            raise
 
     @property
     def jwt_token(self):
         """Get the token needed to authenticate to the CE. If no token is available, request one from the CE
-        using the id, key and scopes. If the token is going to expire within the next hour, re-request it.
-        Once requested, save it to ``self.jwt_key_cache``"""
-        if self.jwt_token_encoded is None:
-            trompace.logger.debug("no token, getting one")
-            # No token, refresh it
-            token = get_jwt(self.host, self.jwt_id, self.jwt_key, self.jwt_scopes)
-            self._set_jwt_token(token)
-            self._save_jwt_token(token)
-        elif self.jwt_token_encoded:
-            token = jwt.decode(self.jwt_token_encoded, algorithms=["HS256"], options={"verify_signature": False})
-            now = datetime.datetime.now(datetime.timezone.utc).timestamp()
-            expired = token.get('exp', 0) < now
-            # check if it's expiring
-            if expired:
-                trompace.logger.debug("token is expiring, renewing")
-                # TODO: Duplicate
-                token = get_jwt(self.host, self.jwt_id, self.jwt_key, self.jwt_scopes)
-                self._set_jwt_token(token)
-                self._save_jwt_token(token)
-        # Now we have a token, return it
-        # TODO: The issuing step could fail
-        return self.jwt_token_encoded
+        using the id, key and scopes. If the token is going to expire within ``jwt_refresh_margin`` seconds,
+        re-request it. Once requested, save it to ``self.jwt_key_cache``"""
+        token, refresh_at = self._jwt_current[:2]
+        if token is not None and time.time() < refresh_at:
+            return token
+        return self._refresh_jwt_token()
+
+    async def jwt_token_async(self):
+        """Like :attr:`jwt_token`, but request a new token without blocking the event loop"""
+        token, refresh_at = self._jwt_current[:2]
+        if token is not None and time.time() < refresh_at:
+            return token
+        import asyncio
+        return await asyncio.get_running_loop().run_in_executor(None, self._refresh_jwt_token)
+
+    def _refresh_jwt_token(self, expiring: str = None):
+        """Request a new token from the CE. If several threads call this at the same time only one of them
+        makes the request, and the others use its result.
+        Arguments:
+            expiring: renew this token even if it isn't due for renewal yet
+        """
+        with self._jwt_lock:
+            token, refresh_at, _, expiry, _ = self._jwt_current
+            if token is not None and token != expiring and time.time() < refresh_at:
+                return token
+            trompace.logger.debug("no token or token is expiring, getting a new one")
+            new_token = get_jwt(self.host, self.jwt_id, self.jwt_key, self.jwt_scopes)
+            if new_token is not None and self._set_jwt_token(new_token):
+                self._save_jwt_token(new_token)
+            elif token is not None and time.time() < expiry:
+                # Keep using the current token, and try again in a minute
+                trompace.logger.warning("Could not renew the jwt token, using the current token until it expires")
+                self._jwt_current = (token, min(time.time() + 60, expiry)) + self._jwt_current[2:]
+            return self._jwt_current[0]
+
+
+class TokenRefresher:
+    """Renews the JWT token of a :class:`TrompaConfig` in the background, so that requests never wait
+    for a new token. Use this in long-running processes such as application workers.
+
+    The token is renewed after ``fraction`` of its lifetime, which should be before :attr:`TrompaConfig.jwt_token`
+    would renew it. Run the refresher in a daemon thread with :meth:`start` and :meth:`stop` (or use it as a
+    context manager), or as an asyncio task with :meth:`run_async`::
+
+        task = asyncio.create_task(TokenRefresher(config).run_async())
+
+    Arguments:
+        trompa_config: the config with the token to renew
+        fraction: renew the token after this fraction of its lifetime. Defaults to the
+           ``auth.token_refresh_fraction`` config item
+        retry_interval: if renewing the token fails, try again after this many seconds
+    """
+
+    def __init__(self, trompa_config: TrompaConfig, fraction: float = None, retry_interval: float = 60.0):
+        self.config = trompa_config
+        self.fraction = trompa_config.jwt_refresh_fraction if fraction is None else fraction
+        self.retry_interval = retry_interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        """Renew the token if it is due
+        Returns:
+            the number of seconds until the token should next be renewed
+        """
+        token, _, issued, expiry, _ = self.config._jwt_current
+        due = issued + self.fraction * (expiry - issued)
+        if token is None or time.time() >= due:
+            try:
+                new_token = self.config._refresh_jwt_token(expiring=token)
+            except Exception:
+                trompace.logger.exception("Error renewing the jwt token")
+                return self.retry_interval
+            if new_token is None or new_token == token:
+                return self.retry_interval
+            token, _, issued, expiry, _ = self.config._jwt_current
+            due = issued + self.fraction * (expiry - issued)
+        if due == math.inf:
+            # The token never expires. Check again later in case it is replaced
+            return self.retry_interval
+        return max(0.0, due - time.time())
+
+    def start(self):
+        """Start renewing the token in a daemon thread"""
+        if self._thread is not None:
+            raise RuntimeError("TokenRefresher is already running")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="TokenRefresher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the thread started with :meth:`start`"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._stop.wait(self.refresh())
+
+    async def run_async(self):
+        """Renew the token until the task running this coroutine is cancelled.
+        The requests for a new token are made in an executor, so they don't block the event loop"""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        while True:
+            delay = await loop.run_in_executor(None, self.refresh)
+            await asyncio.sleep(delay)
 
 
 def get_jwt(host, jwt_id, jwt_key, jwt_scopes):
     """Request a JWT key from the CE"""
-    # TODO: Would be nice to put this in trompace.connection, but issues with circular import
+    # Imported here because trompace.connection depends on this module
+    from trompace.connection import get_session, get_timeout
     url = urllib.parse.urljoin(host, "jwt")
     data = {
         "id": jwt_id,
         "apiKey": jwt_key,
         "scopes": jwt_scopes
     }
-    r = requests.post(url, json=data)
+    r = get_session().post(url, json=data, timeout=get_timeout())
     j = r.json()
     if j['success']:
         return j['jwt']
     else:
-        print("invalid response getting jwt", j)
+        trompace.logger.error(f"invalid response getting jwt: {j}")
     return None
 
 
@@ -1,90 +1,1191 @@
 # Utility functions for sending queries and downloading files.
-import requests
+import asyncio
+import functools
+import hashlib
+import itertools
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Iterable, NamedTuple, Optional
 
+import trompace
+from trompace.codec import get_codec
 from trompace.config import config
-from trompace.exceptions import QueryException
+from trompace.exceptions import QueryException, CircuitOpenException
+from trompace.mutations.templates import format_sequence_mutation_chunks
+from trompace.queries.templates import format_page_query
 
+# requests, aiohttp and aiofiles are imported when they are first needed, so that code which only
+# generates queries doesn't pay for importing them
 
-async def submit_query_async(querystr: str, auth_required=False):
+# The HTTP session shared by all requests, and the pool settings that it was created with
+_session = None
+_session_settings = None
+_session_last_used = 0.0
+_session_lock = threading.Lock()
+# aiohttp sessions and in-flight request semaphores, one for each event loop
+_async_sessions = {}
+
+
+def _make_session(pool_connections: int, pool_maxsize: int):
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session():
+    """Get the HTTP session that is shared by all requests made to the CE.
+
+    The session keeps a pool of keep-alive connections, so that consecutive requests reuse an open
+    TCP (and TLS) connection instead of making a new one each time. The size of the pool is set by the
+    ``connection.pool_connections`` and ``connection.pool_maxsize`` config items.
+    If the session has not been used for more than ``connection.keepalive_timeout`` seconds its
+    connections are discarded and a new pool is started, as the server has probably closed them.
+
+    Returns:
+        A :class:`requests.Session`
+    """
+    global _session, _session_settings, _session_last_used
+    settings = (config.connection_pool_connections, config.connection_pool_maxsize)
+    now = time.monotonic()
+    with _session_lock:
+        if _session is not None:
+            idle = now - _session_last_used
+            if settings != _session_settings or idle > config.connection_keepalive_timeout:
+                _session.close()
+                _session = None
+        if _session is None:
+            _session = _make_session(*settings)
+            _session_settings = settings
+        _session_last_used = now
+        return _session
+
+
+def close_session():
+    """Close all connections in the shared HTTP session. A new session is created on the next request."""
+    global _session, _session_settings
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _session_settings = None
+
+
+def get_timeout():
+    """The timeout for requests made with :func:`get_session`, from the ``connection.connect_timeout``
+    and ``connection.read_timeout`` config items
+    Returns:
+        A tuple (connect timeout, read timeout) in seconds. None means to wait forever
+    """
+    return config.connection_connect_timeout or None, config.connection_read_timeout or None
+
+
+def get_async_timeout():
+    """Like :func:`get_timeout`, for requests made with :func:`get_async_session`
+    Returns:
+        A :class:`aiohttp.ClientTimeout`
+    """
+    import aiohttp
+    connect_timeout, read_timeout = get_timeout()
+    return aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout)
+
+
+async def get_async_session():
+    """Get the aiohttp session that is shared by all async requests made from the running event loop.
+
+    Like :func:`get_session`, the session keeps a pool of keep-alive connections. Each event loop gets
+    its own session, together with a semaphore that limits the number of requests in progress at the
+    same time to the ``connection.max_in_flight`` config item. Additional requests wait until one of the
+    in-flight requests has finished.
+
+    Returns:
+        A tuple of (:class:`aiohttp.ClientSession`, :class:`asyncio.Semaphore`)
+    """
+    loop = asyncio.get_running_loop()
+    entry = _async_sessions.get(loop)
+    if entry is None or entry[0].closed:
+        import aiohttp
+        connector = aiohttp.TCPConnector(limit=config.connection_max_in_flight,
+                                         limit_per_host=config.connection_max_in_flight,
+                                         keepalive_timeout=config.connection_keepalive_timeout)
+        session = aiohttp.ClientSession(connector=connector)
+        entry = (session, asyncio.Semaphore(config.connection_max_in_flight))
+        _async_sessions[loop] = entry
+    return entry
+
+
+async def close_async_session():
+    """Close the aiohttp session of the running event loop. Call this before the event loop is closed."""
+    entry = _async_sessions.pop(asyncio.get_running_loop(), None)
+    if entry is not None:
+        await entry[0].close()
+
+
+class RetryPolicy:
+    """Decides if and when to retry a request that failed with a transient error.
+
+    A request is retried if it fails with a connection error, a timeout, or one of the HTTP statuses
+    in ``RETRY_STATUSES``, which the CE or its proxy return when it is overloaded or restarting.
+    Before each retry wait a random time between 0 and ``backoff_base * 2^(attempt - 1)`` seconds,
+    but no more than ``backoff_max``. The random wait means that many clients that failed at the same
+    time don't all retry at the same time. If the response has a ``Retry-After`` header, wait at least
+    that long.
+
+    Arguments:
+        max_attempts: the maximum number of attempts, including the first one
+        backoff_base: the maximum wait in seconds before the first retry
+        backoff_max: the maximum wait in seconds before any retry
+        deadline: don't start a retry more than this many seconds after the first attempt
+    """
+
+    RETRY_STATUSES = frozenset({429, 502, 503, 504})
+
+    def __init__(self, max_attempts: int = 4, backoff_base: float = 0.5, backoff_max: float = 30.0,
+                 deadline: float = 120.0):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self._random = random.Random()
+
+    @classmethod
+    def from_config(cls):
+        """A policy using the ``connection.retry_*`` config items"""
+        return cls(max_attempts=config.connection_retry_max_attempts,
+                   backoff_base=config.connection_retry_backoff_base,
+                   backoff_max=config.connection_retry_backoff_max,
+                   deadline=config.connection_retry_deadline)
+
+    def backoff(self, attempt: int, retry_after: float = None):
+        """The number of seconds to wait after attempt number ``attempt`` (starting at 1) failed"""
+        delay = self._random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    def next_delay(self, attempt: int, start: float, retry_after: float = None):
+        """The number of seconds to wait before retrying a request, or None if it shouldn't be retried
+        Arguments:
+            attempt: the number of the attempt that failed, starting at 1
+            start: the value of :func:`time.monotonic` when the first attempt started
+            retry_after: the value of the Retry-After header of the response, if any
+        """
+        if attempt >= self.max_attempts:
+            return None
+        delay = self.backoff(attempt, retry_after)
+        if time.monotonic() - start + delay > self.deadline:
+            return None
+        return delay
+
+
+@functools.lru_cache(maxsize=None)
+def _retry_exceptions():
+    """The exceptions raised by requests for transient errors"""
+    import requests
+    return (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+            requests.exceptions.ChunkedEncodingError)
+
+
+@functools.lru_cache(maxsize=None)
+def _retry_exceptions_async():
+    """The exceptions raised by aiohttp for transient errors"""
+    import aiohttp
+    return aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError
+
+
+def _retry_after(headers):
+    """The value in seconds of a Retry-After header, or None. HTTP dates are not supported"""
+    try:
+        return max(0.0, float(headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        return None
+
+
+def _log_retry(description, reason, delay, attempt, retry):
+    trompace.logger.warning(f"{description} failed with {reason}, retrying in {delay:.2f}s "
+                            f"(attempt {attempt + 1} of {retry.max_attempts})")
+
+
+def _request_with_retries(send, retry: Optional[RetryPolicy], description: str):
+    """Call send() until it succeeds, or fails with an error that isn't transient, or ``retry`` says to stop.
+    send returns a tuple (HTTP status, headers, result). Returns the result of the last call"""
+    start = time.monotonic()
+    for attempt in itertools.count(1):
+        try:
+            status, headers, result = send()
+        except _retry_exceptions() as e:
+            delay = retry.next_delay(attempt, start) if retry else None
+            if delay is None:
+                raise
+            reason = type(e).__name__
+        else:
+            if status not in RetryPolicy.RETRY_STATUSES:
+                return result
+            delay = retry.next_delay(attempt, start, _retry_after(headers)) if retry else None
+            if delay is None:
+                return result
+            reason = f"HTTP {status}"
+        _log_retry(description, reason, delay, attempt, retry)
+        time.sleep(delay)
+
+
+async def _request_with_retries_async(send, retry: Optional[RetryPolicy], description: str):
+    """Like :func:`_request_with_retries`, where send is a coroutine function"""
+    start = time.monotonic()
+    for attempt in itertools.count(1):
+        try:
+            status, headers, result = await send()
+        except _retry_exceptions_async() as e:
+            delay = retry.next_delay(attempt, start) if retry else None
+            if delay is None:
+                raise
+            reason = type(e).__name__
+        else:
+            if status not in RetryPolicy.RETRY_STATUSES:
+                return result
+            delay = retry.next_delay(attempt, start, _retry_after(headers)) if retry else None
+            if delay is None:
+                return result
+            reason = f"HTTP {status}"
+        _log_retry(description, reason, delay, attempt, retry)
+        await asyncio.sleep(delay)
+
+
+def _is_read_only(querystr: str):
+    """Check if a GraphQL document is a query, and not a mutation or subscription"""
+    return not querystr.lstrip().startswith(("mutation", "subscription"))
+
+
+def _retry_policy(querystr: str, idempotent: Optional[bool]):
+    """The retry policy for a request, None if it shouldn't be retried"""
+    if idempotent is None:
+        idempotent = _is_read_only(querystr)
+    return RetryPolicy.from_config() if idempotent else None
+
+
+class RateLimiter:
+    """A token bucket that limits the rate of requests to ``rate`` per second on average,
+    allowing bursts of up to ``burst`` requests.
+
+    Each request takes a token from the bucket, which is refilled at ``rate`` tokens per second.
+    If the bucket is empty, the request reserves the next token and waits until it is available,
+    so waiting requests are served in order. Can be shared by threads and event loops.
+
+    Arguments:
+        rate: the average number of requests per second
+        burst: the maximum number of requests that can be sent at once after an idle period
+    """
+
+    def __init__(self, rate: float, burst: int = 10):
+        if rate <= 0:
+            raise ValueError("rate must be greater than 0")
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self):
+        """Take a token, returning the number of seconds to wait until it can be used"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+    def acquire(self):
+        """Wait until a request can be sent"""
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        """Wait until a request can be sent, without blocking the event loop"""
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+    def state(self):
+        """The current state of the limiter, for monitoring"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return {"rate": self.rate, "burst": self.burst, "tokens": self._tokens}
+
+
+class AdaptiveConcurrencyLimiter:
+    """Limits the number of requests in progress at the same time, adjusting the limit to the load on the CE.
+
+    The limit is adjusted with additive increase, multiplicative decrease (AIMD), the same way that TCP
+    adjusts its congestion window. If a request fails with a server error or a connection error, or if
+    latency rises above a threshold, the limit is multiplied by ``backoff_ratio``. This happens at most
+    once per round trip, so that a burst of failures from the same overload only counts once. Otherwise
+    the limit grows by about 1 after each ``limit`` successful requests, as long as it is being used.
+    The limit settles just below the concurrency that the CE can sustain.
+
+    The latency threshold is ``latency_target`` if it is set. If not, it is ``latency_tolerance`` times
+    the usual latency of requests to the CE, measured as a slow moving average of latency when the CE
+    isn't overloaded. Latency is compared to a fast moving average of recent requests.
+
+    Can be shared by threads and event loops.
+
+    Arguments:
+        initial_limit: the limit to start with
+        min_limit: the limit never goes below this value
+        max_limit: the limit never goes above this value
+        latency_target: the latency in seconds above which the limit is reduced
+        latency_tolerance: if ``latency_target`` isn't set, reduce the limit if latency is this many times
+            the usual latency
+        backoff_ratio: multiply the limit by this value when the CE is overloaded
+    """
+
+    SHORT_ALPHA = 0.2
+    LONG_ALPHA = 0.02
+
+    def __init__(self, initial_limit: int = 10, min_limit: int = 1, max_limit: int = 100,
+                 latency_target: float = None, latency_tolerance: float = 2.0, backoff_ratio: float = 0.75):
+        if not 1 <= min_limit <= max_limit:
+            raise ValueError("limits must satisfy 1 <= min_limit <= max_limit")
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.latency_tolerance = latency_tolerance
+        self.backoff_ratio = backoff_ratio
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._in_flight = 0
+        self._short_latency = None
+        self._long_latency = None
+        self._last_decrease = 0.0
+        self._requests = 0
+        self._failures = 0
+        self._decreases = 0
+        self._condition = threading.Condition()
+        self._async_waiters = []
+
+    @property
+    def limit(self):
+        """The current limit on the number of requests in progress"""
+        return int(self._limit)
+
+    def acquire(self):
+        """Wait until a request can be sent. Call :meth:`release` when it finishes"""
+        with self._condition:
+            while self._in_flight >= int(self._limit):
+                self._condition.wait()
+            self._in_flight += 1
+
+    async def acquire_async(self):
+        """Wait until a request can be sent, without blocking the event loop. Call :meth:`release` when it finishes"""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self._in_flight < int(self._limit):
+                    self._in_flight += 1
+                    return
+                waiter = (loop, loop.create_future())
+                self._async_waiters.append(waiter)
+            try:
+                await waiter[1]
+            finally:
+                with self._condition:
+                    if waiter in self._async_waiters:
+                        self._async_waiters.remove(waiter)
+
+    def release(self, latency: float, failed: bool):
+        """Record the outcome of a request that was started after :meth:`acquire`
+        Arguments:
+            latency: the time in seconds that the request took
+            failed: True if the request failed because the CE is overloaded or unavailable
+        """
+        with self._condition:
+            self._update(latency, failed)
+            self._in_flight -= 1
+            self._condition.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+    def cancel(self):
+        """Release the slot taken by :meth:`acquire` for a request that was abandoned, without recording
+        its outcome"""
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+    def _update(self, latency, failed):
+        self._requests += 1
+        if failed:
+            self._failures += 1
+            congested = True
+        else:
+            if self._short_latency is None:
+                self._short_latency = self._long_latency = latency
+            self._short_latency += self.SHORT_ALPHA * (latency - self._short_latency)
+            threshold = self.latency_target or self._long_latency * self.latency_tolerance
+            congested = self._short_latency > threshold
+            if not congested:
+                self._long_latency += self.LONG_ALPHA * (latency - self._long_latency)
+
+        if congested:
+            now = time.monotonic()
+            if now - self._last_decrease >= (self._short_latency or 0.0):
+                new_limit = max(self.min_limit, self._limit * self.backoff_ratio)
+                if int(new_limit) != int(self._limit):
+                    trompace.logger.info(f"Reducing the concurrency limit from {int(self._limit)} to {int(new_limit)}")
+                self._limit = new_limit
+                self._last_decrease = now
+                self._decreases += 1
+        elif self._in_flight >= self._limit / 2:
+            self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+
+    def state(self):
+        """The current state of the limiter, for monitoring"""
+        with self._condition:
+            return {"limit": int(self._limit), "in_flight": self._in_flight, "waiting": len(self._async_waiters),
+                    "short_latency": self._short_latency, "long_latency": self._long_latency,
+                    "requests": self._requests, "failures": self._failures, "decreases": self._decreases}
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+# The rate limiter and concurrency limiter used for requests to the CE, and the settings that they were created with
+_limiters = (None, None)
+_limiter_settings = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiters():
+    """Get the :class:`RateLimiter` and :class:`AdaptiveConcurrencyLimiter` that are used for all requests to the CE.
+
+    They are created from the ``connection.rate_limit*`` and ``connection.adaptive_*`` config items.
+
+    Returns:
+        A tuple (rate limiter, concurrency limiter). Each is None if it is disabled in the config
+    """
+    global _limiters, _limiter_settings
+    settings = (config.connection_rate_limit, config.connection_rate_limit_burst,
+                config.connection_adaptive_concurrency, config.connection_adaptive_concurrency_min,
+                config.connection_adaptive_concurrency_max, config.connection_adaptive_latency_target)
+    with _limiter_lock:
+        if settings != _limiter_settings:
+            rate, burst, adaptive, min_limit, max_limit, latency_target = settings
+            rate_limiter = RateLimiter(rate, burst) if rate > 0 else None
+            concurrency_limiter = None
+            if adaptive:
+                initial_limit = min(max(config.connection_pool_maxsize, min_limit), max_limit)
+                concurrency_limiter = AdaptiveConcurrencyLimiter(initial_limit, min_limit, max_limit,
+                                                                 latency_target=latency_target or None)
+            _limiters = (rate_limiter, concurrency_limiter)
+            _limiter_settings = settings
+        return _limiters
+
+
+def limiter_state():
+    """The state of the rate limiter and concurrency limiter, for monitoring
+    Returns:
+        A dictionary {"rate_limiter": state, "concurrency_limiter": state}. A state is None if the limiter is disabled
+    """
+    rate_limiter, concurrency_limiter = get_limiters()
+    return {"rate_limiter": rate_limiter.state() if rate_limiter else None,
+            "concurrency_limiter": concurrency_limiter.state() if concurrency_limiter else None}
+
+
+class CircuitBreaker:
+    """Stops sending requests to the CE while it is down.
+
+    The breaker starts *closed*, and requests are sent normally. After ``failure_threshold`` consecutive
+    requests fail with a connection error, a timeout or a server error, it *opens*: new requests fail
+    immediately with :class:`trompace.exceptions.CircuitOpenException` instead of waiting for a timeout.
+    After ``cooldown`` seconds it becomes *half-open* and lets a single probe request through.
+    If the probe succeeds the breaker closes again, if it fails the breaker opens for another ``cooldown``.
+
+    State changes are logged to the ``trompace`` logger and reported to ``on_state_change``.
+    Can be shared by threads and event loops.
+
+    Arguments:
+        failure_threshold: the number of consecutive failures that opens the breaker
+        cooldown: the number of seconds to fail requests immediately before sending a probe request
+        on_state_change: called as ``on_state_change(breaker, old_state, new_state)`` when the state changes
+        name: the name of the endpoint, for messages
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 30.0, on_state_change=None, name: str = "the CE"):
+        if failure_threshold < 1:
+            raise ValueError("failure_threshold must be at least 1")
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.on_state_change = on_state_change
+        self.name = name
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        return self._state
+
+    def before_request(self):
+        """Call before sending a request. Raises CircuitOpenException if the request must not be sent"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            remaining = self._opened_at + self.cooldown - time.monotonic()
+            if self._state == self.OPEN and remaining <= 0:
+                self._set_state(self.HALF_OPEN)
+            if self._state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            raise CircuitOpenException(self.name, max(remaining, 0.0))
+
+    def record(self, failed: bool):
+        """Record the outcome of a request that was allowed by :meth:`before_request`"""
+        with self._lock:
+            self._probe_in_flight = False
+            if not failed:
+                self._failures = 0
+                if self._state != self.CLOSED:
+                    self._set_state(self.CLOSED)
+                return
+            self._failures += 1
+            if self._state == self.HALF_OPEN or (self._state == self.CLOSED
+                                                 and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def cancel(self):
+        """Release the probe request allowed by :meth:`before_request` without recording an outcome,
+        for a request that was not sent or that was abandoned"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def reset(self):
+        """Close the breaker"""
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            if self._state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def _set_state(self, new_state):
+        old_state, self._state = self._state, new_state
+        if new_state == self.OPEN:
+            trompace.logger.warning(f"Circuit breaker for {self.name} is open after {self._failures} failed requests, "
+                                    f"failing requests for {self.cooldown} seconds")
+        else:
+            trompace.logger.info(f"Circuit breaker for {self.name} is {new_state}")
+        if self.on_state_change is not None:
+            try:
+                self.on_state_change(self, old_state, new_state)
+            except Exception:
+                trompace.logger.exception("Error in circuit breaker on_state_change callback")
+
+
+# The circuit breaker for requests to the CE, and the settings that it was created with
+_circuit_breaker = None
+_circuit_breaker_settings = None
+_circuit_breaker_callbacks = []
+
+
+def _notify_state_change(breaker, old_state, new_state):
+    for callback in list(_circuit_breaker_callbacks):
+        callback(breaker, old_state, new_state)
+
+
+def add_circuit_breaker_callback(callback):
+    """Call ``callback(breaker, old_state, new_state)`` when the state of the circuit breaker for the CE changes"""
+    _circuit_breaker_callbacks.append(callback)
+
+
+def remove_circuit_breaker_callback(callback):
+    """Remove a callback added with :func:`add_circuit_breaker_callback`"""
+    _circuit_breaker_callbacks.remove(callback)
+
+
+def get_circuit_breaker():
+    """Get the :class:`CircuitBreaker` for requests to the CE, configured by the
+    ``connection.circuit_breaker_*`` config items
+    Returns:
+        The circuit breaker, or None if it is disabled in the config
+    """
+    global _circuit_breaker, _circuit_breaker_settings
+    settings = (config.host, config.connection_circuit_breaker_threshold, config.connection_circuit_breaker_cooldown)
+    with _limiter_lock:
+        if settings != _circuit_breaker_settings:
+            host, threshold, cooldown = settings
+            _circuit_breaker = None
+            if threshold > 0:
+                _circuit_breaker = CircuitBreaker(threshold, cooldown, on_state_change=_notify_state_change,
+                                                  name=host or "the CE")
+            _circuit_breaker_settings = settings
+        return _circuit_breaker
+
+
+def _is_overloaded(status):
+    return status in RetryPolicy.RETRY_STATUSES or status >= 500
+
+
+# Exceptions raised when the caller abandons a request, such as a timeout of asyncio.wait_for or a shutdown.
+# They say nothing about the CE, so they aren't counted as failures
+_ABANDONED = (asyncio.CancelledError, KeyboardInterrupt, SystemExit)
+
+
+def _guarded(send, breaker: Optional[CircuitBreaker]):
+    """Wrap a send function of :func:`_request_with_retries` with a circuit breaker,
+    the rate limiter and the concurrency limiter"""
+    def guarded():
+        if breaker:
+            breaker.before_request()
+        rate_limiter, concurrency_limiter = get_limiters()
+        try:
+            if rate_limiter:
+                rate_limiter.acquire()
+            if concurrency_limiter:
+                concurrency_limiter.acquire()
+        except BaseException:
+            # The request is not sent, so a probe request of a half-open breaker must be allowed again
+            if breaker:
+                breaker.cancel()
+            raise
+        start = time.monotonic()
+        failed = True
+        try:
+            status, headers, result = send()
+            failed = _is_overloaded(status)
+            return status, headers, result
+        except _ABANDONED:
+            failed = None
+            raise
+        finally:
+            if breaker:
+                if failed is None:
+                    breaker.cancel()
+                else:
+                    breaker.record(failed)
+            if concurrency_limiter:
+                if failed is None:
+                    concurrency_limiter.cancel()
+                else:
+                    concurrency_limiter.release(time.monotonic() - start, failed)
+    return guarded
+
+
+def _guarded_async(send, breaker: Optional[CircuitBreaker]):
+    """Like :func:`_guarded`, where send is a coroutine function"""
+    async def guarded():
+        if breaker:
+            breaker.before_request()
+        rate_limiter, concurrency_limiter = get_limiters()
+        try:
+            if rate_limiter:
+                await rate_limiter.acquire_async()
+            if concurrency_limiter:
+                await concurrency_limiter.acquire_async()
+        except BaseException:
+            # The request is not sent, so a probe request of a half-open breaker must be allowed again
+            if breaker:
+                breaker.cancel()
+            raise
+        start = time.monotonic()
+        failed = True
+        try:
+            status, headers, result = await send()
+            failed = _is_overloaded(status)
+            return status, headers, result
+        except _ABANDONED:
+            failed = None
+            raise
+        finally:
+            if breaker:
+                if failed is None:
+                    breaker.cancel()
+                else:
+                    breaker.record(failed)
+            if concurrency_limiter:
+                if failed is None:
+                    concurrency_limiter.cancel()
+                else:
+                    concurrency_limiter.release(time.monotonic() - start, failed)
+    return guarded
+
+
+class PersistedQueryRegistry:
+    """Client-side registry of the hashes of query documents, for automatic persisted queries.
+
+    When persisted queries are enabled (the ``connection.persisted_queries`` config item), requests contain the
+    SHA-256 hash of the query document instead of the document itself. If the CE doesn't know a hash
+    it replies with a ``PersistedQueryNotFound`` error, and the request is repeated with the full document
+    so that the CE can store it. This is most effective together with :func:`trompace.use_variables`,
+    where many requests share the same document.
+
+    Arguments:
+        max_size: the maximum number of document hashes to keep
+        max_bytes: the maximum total length of the documents whose hashes are kept. Larger documents,
+          such as batches of mutations, are hashed every time they are sent
+    """
+
+    NOT_FOUND = ("PersistedQueryNotFound", "PERSISTED_QUERY_NOT_FOUND")
+    NOT_SUPPORTED = ("PersistedQueryNotSupported", "PERSISTED_QUERY_NOT_SUPPORTED")
+
+    def __init__(self, max_size: int = 10000, max_bytes: int = 4 * 1024 * 1024):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        # Set to False if the CE reports that it doesn't support persisted queries
+        self.supported = True
+        self._hashes = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def query_hash(self, document: str):
+        """Get the hex SHA-256 hash of a query document"""
+        with self._lock:
+            query_hash = self._hashes.get(document)
+            if query_hash is not None:
+                self._hashes.move_to_end(document)
+                return query_hash
+        query_hash = hashlib.sha256(document.encode("utf-8")).hexdigest()
+        if len(document) > self.max_bytes:
+            return query_hash
+        with self._lock:
+            if document not in self._hashes:
+                self._hashes[document] = query_hash
+                self._bytes += len(document)
+            while len(self._hashes) > self.max_size or self._bytes > self.max_bytes:
+                evicted, _ = self._hashes.popitem(last=False)
+                self._bytes -= len(evicted)
+        return query_hash
+
+    def make_request_body(self, q: dict):
+        """Replace the query in a request body with the hash of the query"""
+        persisted_q = {k: v for k, v in q.items() if k != "query"}
+        persisted_q["extensions"] = {"persistedQuery": {"version": 1, "sha256Hash": self.query_hash(q["query"])}}
+        return persisted_q
+
+    def needs_document(self, content):
+        """Check if the response to a persisted query request says that the request must be sent again
+        with the full query document, because the CE doesn't know the hash or doesn't support persisted queries"""
+        if b"PersistedQuery" not in content and b"PERSISTED_QUERY" not in content:
+            return False
+        try:
+            errors = get_codec().loads(content).get("errors") or []
+        except (ValueError, AttributeError):
+            return False
+        for error in errors:
+            codes = {error.get("message"), (error.get("extensions") or {}).get("code")}
+            if codes.intersection(self.NOT_SUPPORTED):
+                trompace.logger.warning("The CE doesn't support persisted queries, sending full queries")
+                self.supported = False
+                return True
+            if codes.intersection(self.NOT_FOUND):
+                return True
+        return False
+
+
+persisted_queries = PersistedQueryRegistry()
+
+
+def _decode_response(content):
+    """Decode the body of a response from the CE, raising a QueryException if it contains errors"""
+    try:
+        resp = get_codec().loads(content)
+    except ValueError:
+        raise QueryException([{"message": content}])
+    if "errors" in resp.keys():
+        raise QueryException(resp['errors'])
+    return resp
+
+
+async def submit_query_async(querystr: str, auth_required=False, variables: dict = None, idempotent: bool = None):
     """Submit a query to the CE (async).
+
+    Requests are sent over the connection pool of :func:`get_async_session` without blocking the event loop,
+    so many queries can be in progress at the same time.
+
     Arguments:
         querystr: The query to be submitted
         auth_required: If true, send an authentication key with this request. Don't send a key
            if the global config.server_auth_required is false
+        variables: The values of the variables used in the query, see :func:`submit_query`
+        idempotent: If the request can be retried after a transient error, see :func:`submit_query`
     """
-    q = {"query": querystr}
+    q = _make_request_body(querystr, variables)
+    retry = _retry_policy(querystr, idempotent)
     headers = {}
     if auth_required and config.server_auth_required:
-        token = config.jwt_token
+        token = await config.jwt_token_async()
         headers["Authorization"] = f"Bearer {token}"
-    r = requests.post(config.host, json=q, headers=headers)
-    try:
-        r.raise_for_status()
-    except requests.exceptions.HTTPError:
-        print("error")
-        print(r.content)
-    try:
-        resp = r.json()
-        if "errors" in resp.keys():
-            raise QueryException(resp['errors'])
-    except ValueError:
-        raise QueryException(r.content)
-    return resp
+    if config.connection_persisted_queries and persisted_queries.supported:
+        persisted_q = persisted_queries.make_request_body(q)
+        content = await _post_query_async(persisted_q, headers, retry)
+        if not persisted_queries.needs_document(content):
+            return _decode_response(content)
+        q = dict(persisted_q, query=q["query"])
+    content = await _post_query_async(q, headers, retry)
+    return _decode_response(content)
+
+
+async def _post_query_async(q, headers, retry):
+    session, semaphore = await get_async_session()
+    body = get_codec().dumps(q)
+    headers = dict(headers, **{"Content-Type": "application/json"})
 
+    async def send():
+        async with semaphore:
+            async with session.post(config.host, data=body, headers=headers, timeout=get_async_timeout()) as r:
+                return r.status, r.headers, (r.status, await r.read())
 
-def submit_query(querystr: str, auth_required=False):
+    status, content = await _request_with_retries_async(_guarded_async(send, get_circuit_breaker()), retry, "Query")
+    if status >= 400:
+        trompace.logger.error(f"The CE returned HTTP {status}: {content!r}")
+    return content
+
+
+def _make_request_body(querystr, variables):
+    if variables is None:
+        variables = getattr(querystr, "variables", None)
+    q = {"query": querystr}
+    if variables:
+        q["variables"] = variables
+    return q
+
+
+def submit_query(querystr: str, auth_required=False, variables: dict = None, idempotent: bool = None):
     """Submit a query to the CE.
 
+    If the request fails with a transient error (see :class:`RetryPolicy`) it is retried according to the
+    ``connection.retry_*`` config items. A mutation that failed may still have been applied by the CE,
+    so by default only queries are retried.
+
     Args:
         querystr: The query to be submitted
         auth_required: If ``True``, send an authentication key with this request. Required if the CE has authentication
           enabled and you are sending a mutation. Not required for queries. The request is not authenticated
           if the ``auth.required`` config item is ``False``
+        variables: The values of the variables used in the query. If ``querystr`` is a
+          :class:`trompace.Operation` its variables are sent by default
+        idempotent: Set to ``True`` for a mutation that has the same result if it is applied more than once
+          (e.g. an ``UpdateX`` or ``MergeX`` mutation), so that it is retried. Set to ``False`` to never retry.
+          By default only queries are retried
     """
-    q = {"query": querystr}
+    q = _make_request_body(querystr, variables)
+    retry = _retry_policy(querystr, idempotent)
     headers = {}
     if auth_required and config.server_auth_required:
         token = config.jwt_token
         headers["Authorization"] = f"Bearer {token}"
-    r = requests.post(config.host, json=q, headers=headers)
+    if config.connection_persisted_queries and persisted_queries.supported:
+        persisted_q = persisted_queries.make_request_body(q)
+        content = _post_query(persisted_q, headers, retry)
+        if not persisted_queries.needs_document(content):
+            return _decode_response(content)
+        # The CE doesn't know this query yet, send it together with its hash so that the CE stores it
+        q = dict(persisted_q, query=q["query"])
+    content = _post_query(q, headers, retry)
+    return _decode_response(content)
+
+
+def _post_query(q, headers, retry):
+    import requests
+    body = get_codec().dumps(q)
+    headers = dict(headers, **{"Content-Type": "application/json"})
+
+    def send():
+        r = get_session().post(config.host, data=body, headers=headers, timeout=get_timeout())
+        return r.status_code, r.headers, r
+
+    r = _request_with_retries(_guarded(send, get_circuit_breaker()), retry, "Query")
     try:
         r.raise_for_status()
     except requests.exceptions.HTTPError:
-        print("error")
-        print(r.content)
+        trompace.logger.error(f"The CE returned HTTP {r.status_code}: {r.content!r}")
+    return r.content
+
+
+class QueryResult(NamedTuple):
+    """The result of a query sent with :func:`submit_queries`.
+    Exactly one of ``response`` and ``error`` is set."""
+    # The position of the query in the input
+    index: int
+    query: str
+    response: Optional[dict]
+    error: Optional[Exception]
+
+
+def submit_queries(queries: Iterable[str], max_concurrency: int = None, auth_required=False, ordered=True,
+                   idempotent: bool = None):
+    """Submit many queries to the CE, sending up to ``max_concurrency`` of them at the same time.
+
+    Queries are sent from a pool of worker threads over the keep-alive connections of :func:`get_session`.
+    ``queries`` is consumed lazily, so it can be a generator producing a very large number of queries.
+    An exception raised by a query is reported in its result and doesn't stop the rest of the batch.
+
+    Args:
+        queries: The queries to be submitted
+        max_concurrency: The maximum number of queries to send at the same time. Defaults to the
+          ``connection.pool_maxsize`` config item. Connections above this value are not kept alive,
+          so increase ``pool_maxsize`` if you increase this value.
+        auth_required: If ``True``, send an authentication key with each request. See :func:`submit_query`
+        ordered: If ``True``, yield results in the same order as ``queries``, otherwise yield them
+          as soon as they complete
+        idempotent: If the queries can be retried after a transient error, see :func:`submit_query`
+    Returns:
+        A generator of :class:`QueryResult`, one for each query
+    """
+    if max_concurrency is None:
+        max_concurrency = config.connection_pool_maxsize
+    if max_concurrency < 1:
+        raise ValueError("max_concurrency must be at least 1")
+
+    def run(index, query):
+        try:
+            response = submit_query(query, auth_required=auth_required, idempotent=idempotent)
+            return QueryResult(index, query, response, None)
+        except Exception as e:
+            return QueryResult(index, query, None, e)
+
+    # Limit the number of queries that have been read from the input but not yet yielded,
+    # so that memory use doesn't depend on the number of queries
+    window = max_concurrency * 2
+    query_iter = enumerate(queries)
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    pending = set()
+    completed = {}
+    submitted = 0
+    yielded = 0
+    exhausted = False
     try:
-        resp = r.json()
-        if "errors" in resp.keys():
-            raise QueryException(resp['errors'])
-    except ValueError:
-        raise QueryException([{"message": r.content}])
-    return resp
+        while True:
+            while not exhausted and submitted - yielded < window:
+                try:
+                    index, query = next(query_iter)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending.add(executor.submit(run, index, query))
+                submitted += 1
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if ordered:
+                    completed[result.index] = result
+                else:
+                    yielded += 1
+                    yield result
+            while yielded in completed:
+                result = completed.pop(yielded)
+                yielded += 1
+                yield result
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
 
+def submit_mutation_sequence(mutations: list, max_aliases: int = None, max_bytes: int = None,
+                             max_concurrency: int = None, auth_required=False, idempotent: bool = None):
+    """Submit a sequence of aliased mutations to the CE.
 
-async def download_file_async(url, file_link):
+    Long sequences are split into several requests (see
+    :func:`trompace.mutations.templates.format_sequence_mutation_chunks`), which are sent concurrently with
+    :func:`submit_queries`. The results of all requests are combined in the order of ``mutations``.
+    If a request fails the mutations in the other requests may still have been applied.
+
+    Args:
+        mutations: a list of mutations [(mutationalias, mutationname, args),...]
+        max_aliases: the maximum number of mutations in each request.
+          Defaults to the ``connection.batch_max_aliases`` config item
+        max_bytes: the maximum size of each request. Defaults to the ``connection.batch_max_bytes`` config item
+        max_concurrency: the maximum number of requests to send at the same time, see :func:`submit_queries`
+        auth_required: If ``True``, send an authentication key with each request. See :func:`submit_query`
+        idempotent: Set to ``True`` if all of the mutations can be applied more than once, so that
+          requests are retried after a transient error. See :func:`submit_query`
+    Raises:
+        QueryException if any of the requests fails
+    Returns:
+        A dictionary of {mutationalias: result}, in the same order as ``mutations``.
+        The result of a mutation that the CE didn't return is ``None``
+    """
+    if max_aliases is None:
+        max_aliases = config.connection_batch_max_aliases
+    if max_bytes is None:
+        max_bytes = config.connection_batch_max_bytes
+    documents = format_sequence_mutation_chunks(mutations, max_aliases=max_aliases, max_bytes=max_bytes)
+
+    data = {}
+    for result in submit_queries(documents, max_concurrency=max_concurrency, auth_required=auth_required,
+                                 ordered=False, idempotent=idempotent):
+        if result.error:
+            raise result.error
+        data.update(result.response.get("data") or {})
+
+    return {mutationalias: data.get(mutationalias) for mutationalias, _, _ in mutations}
+
+
+def get_jsonld(identifier: str, retry: RetryPolicy = None):
+    """Get the JSON-LD representation of a node in the CE.
+    Arguments:
+        identifier: the identifier of the node
+        retry: the policy for retrying transient errors, by default from the ``connection.retry_*`` config items
+    Raises:
+        requests.exceptions.HTTPError if the CE returns an error, e.g. 404 if there is no node with this identifier
+    Returns:
+        The decoded JSON-LD document
+    """
+    if retry is None:
+        retry = RetryPolicy.from_config()
+    url = config.host.rstrip("/") + "/" + identifier
+
+    def send():
+        r = get_session().get(url, headers={"Accept": "application/ld+json"}, timeout=get_timeout())
+        return r.status_code, r.headers, r
+
+    r = _request_with_retries(_guarded(send, get_circuit_breaker()), retry, f"JSON-LD request for {identifier}")
+    r.raise_for_status()
+    return get_codec().loads(r.content)
+
+
+def iterate_query(queryname: str, filter: dict = None, fields: list = None, page_size: int = 1000,
+                  paging: str = "keyset", prefetch: bool = True, auth_required=False):
+    """Iterate over all results of a query, requesting them from the CE one page at a time.
+
+    Unlike a single query for all nodes, the size of each response is limited, so this works for queries
+    with millions of results. Only the current page and the next one are kept in memory.
+    While the caller processes the results of one page the next page is requested in a background thread.
+
+    With ``paging="keyset"`` (the default) results are ordered by identifier, and each page is requested
+    with a filter ``identifier_gt`` set to the last identifier of the previous page. This is fast for any
+    page, and doesn't skip or repeat results if nodes are created or deleted during the iteration.
+    With ``paging="offset"`` pages are requested with ``first`` and ``offset``, which the CE has to count
+    through for every page.
+
+    Arguments:
+        queryname: the name of the query, e.g. ``ThingInterface`` or ``Person``
+        filter: a dictionary of filter: value pairs to select the results, e.g. ``{"name_contains": "Bach"}``
+        fields: the fields to return for each result (see :func:`trompace.make_select_query`).
+          ``identifier`` is added if keyset paging is used. Defaults to ``["identifier"]``
+        page_size: the number of results to request in each query
+        paging: ``keyset`` or ``offset``
+        prefetch: request the next page while the caller processes the current one
+        auth_required: If ``True``, send an authentication key with each request. See :func:`submit_query`
+    Raises:
+        QueryException if a query fails
+    Returns:
+        A generator of the results (dictionaries of fields)
+    """
+    if page_size < 1:
+        raise ValueError("page_size must be at least 1")
+    if paging not in ("keyset", "offset"):
+        raise ValueError("paging must be 'keyset' or 'offset'")
+    fields = list(fields or ["identifier"])
+    filter = dict(filter or {})
+    cursor = None
+    if paging == "keyset":
+        if "identifier" not in fields:
+            fields.insert(0, "identifier")
+        # An identifier_gt filter is the starting point of the iteration
+        cursor = filter.pop("identifier_gt", None)
+
+    def fetch(cursor, offset):
+        page_filter = dict(filter, identifier_gt=cursor) if cursor is not None else filter
+        query = format_page_query(queryname, page_filter, fields, first=page_size,
+                                  offset=offset if paging == "offset" else 0, order_by="identifier_asc")
+        return submit_query(query, auth_required=auth_required)["data"][queryname] or []
+
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+
+    def request_page(cursor, offset):
+        """Start requesting a page, returning a function that returns the page when it is available"""
+        if executor is None:
+            return lambda: fetch(cursor, offset)
+        return executor.submit(fetch, cursor, offset).result
+
+    try:
+        offset = 0
+        next_page = request_page(cursor, offset)
+        while next_page is not None:
+            page = next_page()
+            offset += len(page)
+            next_page = None
+            if len(page) == page_size:
+                if paging == "keyset":
+                    cursor = page[-1]["identifier"]
+                next_page = request_page(cursor, offset)
+            yield from page
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+async def download_file_async(url, file_link, retry: RetryPolicy = None):
     """
     Downloads a file linked by the URL as saves it in the link provided in file_link.
     Arguments:
     url: url for the file to be downloaded
     file_link: the path to save the file in
+    retry: the policy for retrying transient errors, by default from the ``connection.retry_*`` config items
     """
-    with requests.get(url, stream=True) as r:
-        r.raise_for_status()
-        with open(file_link, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
+    import aiofiles
+    if retry is None:
+        retry = RetryPolicy.from_config()
+    session, semaphore = await get_async_session()
 
-def download_file(url, file_link):
+    async def send():
+        async with semaphore:
+            async with session.get(url, timeout=get_async_timeout()) as r:
+                if r.status < 400:
+                    async with aiofiles.open(file_link, 'wb') as f:
+                        async for chunk in r.content.iter_chunked(8192):
+                            await f.write(chunk)
+                return r.status, r.headers, r
+
+    # Files may not be on the CE, and transfer times say little about its load, so downloads aren't limited
+    r = await _request_with_retries_async(send, retry, f"Download of {url}")
+    r.raise_for_status()
+
+
+def download_file(url, file_link, retry: RetryPolicy = None):
     """
     Downloads a file linked by the URL as saves it in the link provided in file_link.
     Arguments:
     url: url for the file to be downloaded
     file_link: the path to save the file in
+    retry: the policy for retrying transient errors, by default from the ``connection.retry_*`` config items
     """
-    with requests.get(url, stream=True) as r:
-        r.raise_for_status()
-        with open(file_link, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
\ No newline at end of file
+    if retry is None:
+        retry = RetryPolicy.from_config()
+
+    def send():
+        with get_session().get(url, stream=True, timeout=get_timeout()) as r:
+            if r.status_code < 400:
+                with open(file_link, 'wb') as f:
+                    for chunk in r.iter_content(chunk_size=8192):
+                        if chunk:
+                            f.write(chunk)
+            return r.status_code, r.headers, r
+
+    # Files may not be on the CE, and transfer times say little about its load, so downloads aren't limited
+    r = _request_with_retries(send, retry, f"Download of {url}")
+    r.raise_for_status()
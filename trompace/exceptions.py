@@ -39,3 +39,11 @@ class QueryException(Exception):
 class InvalidItemListOrderTypeException(Exception):
     def __init__(self, itemlistorder):
         super().__init__("ItemListOrderType {} is not a valid ItemListOrder. See trompace.constants.ItemListOrderType".format(itemlistorder))
+
+
+class CircuitOpenException(Exception):
+    def __init__(self, host, retry_in):
+        super().__init__("Requests to {} have been failing, not sending requests for the next {:.1f} seconds"
+                         .format(host, retry_in))
+        self.host = host
+        self.retry_in = retry_in
@@ -1,7 +1,18 @@
+from trompace import lazy_submodules
+
+__getattr__ = lazy_submodules(__name__, [
+    "annotation", "application", "audioobject", "controlaction", "definedterm", "digitaldocument", "entrypoint",
+    "itemlist", "mediaobject", "musiccomposition", "musicgroup", "musicplaylist", "musicrecording", "person",
+    "place", "property", "rating", "templates"])
+
 MUTATION = '''mutation {{
   {mutation}
 }}'''
 
+MUTATION_VARIABLES = '''mutation({variables}) {{
+  {mutation}
+}}'''
+
 
 def _verify_additional_type(additionaltype):
     """Check that the input to additionaltype is a list of strings.
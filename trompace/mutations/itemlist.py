@@ -1,4 +1,3 @@
-from graphql import validation
 from typing import Optional, List
 from trompace import (docstring_interpolate, filter_none_args,
                       StringConstant, check_required_args)
@@ -295,12 +294,14 @@ LISTITEM_SEQ_ARGS_DOCS = """listitems: the ListItems objects to create
         contributor: A person, an organization, or a service responsible for contributing the ListItem to
           the web resource. This can be either a name or a base URL.
         name: The name of the ListItem object.
+        description: The description of each ListItem object.
+        positions (optional): The position of each ListItem object. By default 0, 1, 2, ...
         """
 
 
 @docstring_interpolate("listitem_args", LISTITEM_SEQ_ARGS_DOCS)
 def mutation_sequence_create_listitem(listitems: list, contributor: str, creator: str = None,
-                                      name: str = None, description: list = None):
+                                      name: str = None, description: list = None, positions: list = None):
     """Returns a mutation for creating a sequence of ListItem objects
     (https://schema.org/itemListElement)
 
@@ -310,6 +311,28 @@ def mutation_sequence_create_listitem(listitems: list, contributor: str, creator
     Returns:
         The string for the mutation for creating a sequence of ListItem objects
     """
+    mutation_list = make_sequence_create_listitem(listitems=listitems, contributor=contributor, creator=creator,
+                                                  name=name, description=description, positions=positions)
+    return format_sequence_mutation(mutations=mutation_list)
+
+
+@docstring_interpolate("listitem_args", LISTITEM_SEQ_ARGS_DOCS)
+def make_sequence_create_listitem(listitems: list, contributor: str, creator: str = None,
+                                  name: str = None, description: list = None, positions: list = None):
+    """Returns the list of aliased mutations for creating a sequence of ListItem objects,
+    for use with :func:`trompace.connection.submit_mutation_sequence`
+
+    Arguments:
+        {listitem_args}
+
+    Returns:
+        A list of mutations [(mutationalias, mutationname, args),...]
+    """
+    if positions is None:
+        positions = range(len(listitems))
+    elif len(positions) != len(listitems):
+        raise ValueError("positions must have the same length as listitems")
+
     mutation_list = []
 
     mutationname = "CreateListItem"
@@ -319,12 +342,12 @@ def mutation_sequence_create_listitem(listitems: list, contributor: str, creator
             "name": name,
             "creator": creator,
             "description": description[pos],
-            "position": pos,
+            "position": positions[pos],
         }
         mutationalias = "ListItemAlias{}".format(pos)
         mutation_list.append((mutationalias, mutationname, args))
 
-    return format_sequence_mutation(mutations=mutation_list)
+    return mutation_list
 
 
 def mutation_sequence_add_itemlist_itemlist_element(itemlist_id: str,
@@ -341,6 +364,23 @@ def mutation_sequence_add_itemlist_itemlist_element(itemlist_id: str,
         The string for the mutation for adding a sequence of ThingInterface in an
         ItemList object based on the identifiers.
     """
+    mutation_list = make_sequence_add_itemlist_itemlist_element(itemlist_id=itemlist_id, element_ids=element_ids)
+    return format_sequence_link_mutation(mutations=mutation_list)
+
+
+def make_sequence_add_itemlist_itemlist_element(itemlist_id: str,
+                                                element_ids: list):
+    """Returns the list of aliased mutations for adding a sequence of ThingInterface in an
+    ItemList object based on the identifiers.
+    (https://schema.org/itemListElement)
+
+    Arguments:
+        itemlist_id: The unique identifier of the ItemList object.
+        element_ids: The list of unique identifiers of the ThingInterface objects.
+
+    Returns:
+        A list of mutations [(mutationalias, mutationname, args),...]
+    """
     check_required_args(itemlist_id=itemlist_id, element_ids=element_ids)
 
     mutation_list = []
@@ -351,7 +391,7 @@ def mutation_sequence_add_itemlist_itemlist_element(itemlist_id: str,
         mutationalias = "MergeItemListItemListElementAlias{}".format(pos)
         mutation_list.append((mutationalias, mutationname, args))
 
-    return format_sequence_link_mutation(mutations=mutation_list)
+    return mutation_list
 
 
 def mutation_sequence_add_listitem_item(listitem_ids: list,
@@ -368,6 +408,23 @@ def mutation_sequence_add_listitem_item(listitem_ids: list,
         The string for the mutation for adding a sequence of ThingInterface in an
     ListItem objects based on the identifiers.
     """
+    mutation_list = make_sequence_add_listitem_item(listitem_ids=listitem_ids, item_ids=item_ids)
+    return format_sequence_link_mutation(mutations=mutation_list)
+
+
+def make_sequence_add_listitem_item(listitem_ids: list,
+                                    item_ids: list):
+    """Returns the list of aliased mutations for adding a sequence of ThingInterface in an
+    ListItem objects based on the identifiers.
+    (https://schema.org/itemListElement)
+
+    Arguments:
+        listitem_ids: The list of unique identifiers of the ListItem objects.
+        item_ids: The list of unique identifiers of the ThingInterface objects.
+
+    Returns:
+        A list of mutations [(mutationalias, mutationname, args),...]
+    """
     check_required_args(listitem_ids=listitem_ids, item_ids=item_ids)
 
     mutation_list = []
@@ -378,7 +435,7 @@ def mutation_sequence_add_listitem_item(listitem_ids: list,
         mutationalias = "MergeListItemItemAlias{}".format(pos)
         mutation_list.append((mutationalias, mutationname, args))
 
-    return format_sequence_link_mutation(mutations=mutation_list)
+    return mutation_list
 
 
 def mutation_sequence_add_listitem_nextitem(listitem_ids: list):
@@ -393,6 +450,21 @@ def mutation_sequence_add_listitem_nextitem(listitem_ids: list):
         The string for the mutation for adding a sequence of NextItem to an
     ListItem objects based on the identifiers.
     """
+    mutation_list = make_sequence_add_listitem_nextitem(listitem_ids=listitem_ids)
+    return format_sequence_link_mutation(mutations=mutation_list)
+
+
+def make_sequence_add_listitem_nextitem(listitem_ids: list):
+    """Returns the list of aliased mutations for adding a sequence of NextItem to an
+    ListItem objects based on the identifiers.
+    (https://schema.org/itemListElement)
+
+    Arguments:
+        listitem_ids: The list of unique identifier of the ListItems objects.
+
+    Returns:
+        A list of mutations [(mutationalias, mutationname, args),...]
+    """
     check_required_args(listitem_ids=listitem_ids)
 
     mutation_list = []
@@ -405,4 +477,86 @@ def mutation_sequence_add_listitem_nextitem(listitem_ids: list):
         mutation_list.append((mutationalias, mutationname, args))
         pos += 1
 
-    return format_sequence_link_mutation(mutations=mutation_list)
+    return mutation_list
+
+
+def make_sequence_insert_listitem(itemlist_id: str, listitem_id: str, position: int, following_ids: list,
+                                  previous_id: str = None, item_id: str = None, new_positions: dict = None):
+    """Returns the list of aliased mutations for inserting an existing ListItem object into an ItemList
+    object, for use with :func:`trompace.connection.submit_mutation_sequence`
+
+    The ListItem is added to the ItemList and linked into the nextItem chain between ``previous_id`` and the
+    first element of ``following_ids``. By default the position of each following element is increased by
+    one. If ``new_positions`` is set, only the elements in it are updated, for lists with gaps between positions.
+
+    Arguments:
+        itemlist_id: The unique identifier of the ItemList object.
+        listitem_id: The unique identifier of the ListItem object to insert.
+        position: The position of the inserted ListItem object.
+        following_ids: The unique identifiers of the ListItem objects currently at ``position`` and after it, in order.
+        previous_id: The unique identifier of the ListItem object before ``position``, if any.
+        item_id: The unique identifier of the Item of the inserted ListItem object, if any.
+        new_positions: A dictionary {identifier: position} of the ListItem objects to update, if not the
+          following elements.
+
+    Returns:
+        A list of mutations [(mutationalias, mutationname, args),...]
+    """
+    check_required_args(itemlist_id=itemlist_id, listitem_id=listitem_id, position=position)
+
+    mutation_list = [("MergeItemListItemListElementAlias", "MergeItemListItemListElement", [itemlist_id, listitem_id])]
+    if item_id is not None:
+        mutation_list.append(("MergeListItemItemAlias", "MergeListItemItem", [listitem_id, item_id]))
+    if previous_id is not None:
+        if following_ids:
+            mutation_list.append(("RemoveListItemNextItemAlias", "RemoveListItemNextItem",
+                                  [previous_id, following_ids[0]]))
+        mutation_list.append(("MergeListItemNextItemAlias0", "MergeListItemNextItem", [previous_id, listitem_id]))
+    if following_ids:
+        mutation_list.append(("MergeListItemNextItemAlias1", "MergeListItemNextItem", [listitem_id, following_ids[0]]))
+
+    if new_positions is None:
+        new_positions = {following_id: position + pos + 1 for pos, following_id in enumerate(following_ids)}
+    for pos, (identifier, new_position) in enumerate(new_positions.items()):
+        args = {"identifier": identifier, "position": new_position}
+        mutationalias = "UpdateListItemAlias{}".format(pos)
+        mutation_list.append((mutationalias, "UpdateListItem", args))
+
+    return mutation_list
+
+
+def make_sequence_edit_itemlist(remove_nextitems: list = (), add_nextitems: list = (), new_positions: dict = None,
+                                delete_ids: list = ()):
+    """Returns the list of aliased mutations for editing the ListItem objects of an ItemList object,
+    for use with :func:`trompace.connection.submit_mutation_sequence`
+
+    :func:`trompace.connection.submit_mutation_sequence` may send the mutations in several requests at the
+    same time, so they can run in any order. The result doesn't depend on the order as long as no nextItem
+    link is both removed and added, and no deleted ListItem is linked, which :meth:`ItemListView.plan
+    <trompace.client.client_itemlist.ItemListView.plan>` guarantees.
+
+    Arguments:
+        remove_nextitems: The nextItem links to remove, as a list of (listitem_id, nextitem_id) pairs.
+        add_nextitems: The nextItem links to add, as a list of (listitem_id, nextitem_id) pairs.
+        new_positions: A dictionary {identifier: position} of the ListItem objects to update.
+        delete_ids: The unique identifiers of the ListItem objects to delete.
+
+    Returns:
+        A list of mutations [(mutationalias, mutationname, args),...]
+    """
+    mutation_list = []
+
+    for pos, (listitem_id, nextitem_id) in enumerate(remove_nextitems):
+        mutationalias = "RemoveListItemNextItemAlias{}".format(pos)
+        mutation_list.append((mutationalias, "RemoveListItemNextItem", [listitem_id, nextitem_id]))
+    for pos, listitem_id in enumerate(delete_ids):
+        mutationalias = "DeleteListItemAlias{}".format(pos)
+        mutation_list.append((mutationalias, "DeleteListItem", {"identifier": listitem_id}))
+    for pos, (listitem_id, nextitem_id) in enumerate(add_nextitems):
+        mutationalias = "MergeListItemNextItemAlias{}".format(pos)
+        mutation_list.append((mutationalias, "MergeListItemNextItem", [listitem_id, nextitem_id]))
+    for pos, (identifier, position) in enumerate((new_positions or {}).items()):
+        mutationalias = "UpdateListItemAlias{}".format(pos)
+        mutation_list.append((mutationalias, "UpdateListItem", {"identifier": identifier, "position": position}))
+
+    return mutation_list
@@ -1,9 +1,9 @@
 # Templates for generating GraphQL queries for mutations.
-
+import functools
 from typing import Dict, Any
 
-from trompace import make_parameters
-from trompace.mutations import MUTATION
+from trompace import make_parameters, make_arguments, encode_value, Operation, _use_variables
+from trompace.mutations import MUTATION, MUTATION_VARIABLES
 
 
 MUTATION_TEMPLATE = '''{mutationname}(
@@ -33,6 +33,19 @@ LINK_MUTATION_TEMPLATE = '''{mutationname}(
   }}'''
 
 
+LINK_MUTATION_VARIABLES_TEMPLATE = '''{mutationname}(
+    from: {{identifier: $identifier_1}}
+    to: {{identifier: $identifier_2}}
+  ) {{
+    from {{
+      identifier
+    }}
+    to {{
+      identifier
+    }}
+  }}'''
+
+
 LINK_MUTATION_ALIAS_TEMPLATE = '''{mutationalias}: {mutationname}(
     from: {{identifier: "{identifier_1}"}}
     to: {{identifier: "{identifier_2}"}}
@@ -46,6 +59,82 @@ LINK_MUTATION_ALIAS_TEMPLATE = '''{mutationalias}: {mutationname}(
   }}'''
 
 
+# Marks the position of a value in a compiled template
+_PLACEHOLDER = "\x00"
+
+
+def _compile_document(document: str):
+    """Convert a document containing placeholders into a format string with a positional field for each placeholder"""
+    return document.replace("{", "{{").replace("}", "}}").replace(_PLACEHOLDER, "{}")
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_mutation(mutation_string: str, keys: tuple):
+    """Compile a mutation template with the given argument names into a format string.
+    The result only needs to be formatted with the encoded argument values (see :func:`render_mutation`)
+    instead of re-generating the parameters and re-formatting the template each time.
+    Compiled templates are cached for each (template, argument names) pair.
+    Arguments:
+        mutation_string: a mutation template with a ``{parameters}`` field
+        keys: the names of the arguments of the mutation, in order
+    Returns:
+        A format string for the complete mutation document
+    """
+    parameters = "\n        ".join(f"{k}: {_PLACEHOLDER}" for k in keys)
+    return _compile_document(MUTATION.format(mutation=mutation_string.format(parameters=parameters)))
+
+
+def render_mutation(mutation_string: str, args: Dict[str, Any]):
+    """Render a mutation using its compiled template (see :func:`compile_mutation`).
+    The result is the same as formatting ``mutation_string`` with :func:`trompace.make_parameters`.
+    Arguments:
+        mutation_string: a mutation template with a ``{parameters}`` field
+        args: a dictionary of field: value pairs to add to the mutation
+    Returns:
+        A formatted mutation
+    """
+    compiled = compile_mutation(mutation_string, tuple(args))
+    return compiled.format(*[encode_value(v) for v in args.values()])
+
+
+@functools.lru_cache(maxsize=1024)
+def _mutation_template(mutationname: str):
+    return MUTATION_TEMPLATE.replace("{mutationname}", mutationname)
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_alias_mutation(mutationname: str, keys: tuple):
+    parameters = "\n        ".join(f"{k}: {_PLACEHOLDER}" for k in keys)
+    return _compile_document(MUTATION_ALIAS_TEMPLATE.format(mutationalias=_PLACEHOLDER, mutationname=mutationname,
+                                                            parameters=parameters))
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_alias_link_mutation(mutationname: str):
+    return _compile_document(LINK_MUTATION_ALIAS_TEMPLATE.format(mutationalias=_PLACEHOLDER, mutationname=mutationname,
+                                                                 identifier_1=_PLACEHOLDER, identifier_2=_PLACEHOLDER))
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_link_mutation(mutation_string: str):
+    mutation = mutation_string.format(identifier_1=_PLACEHOLDER, identifier_2=_PLACEHOLDER)
+    return _compile_document(MUTATION.format(mutation=mutation))
+
+
+def format_mutation_document(mutation: str, definitions: str = "", variables: dict = None):
+    """Wrap a mutation in a GraphQL document.
+    Arguments:
+        mutation: the formatted mutation
+        definitions: the definitions of the variables used by the mutation, see :func:`trompace.make_arguments`
+        variables: the values of the variables used by the mutation
+    Returns:
+        A formatted mutation, or an :class:`trompace.Operation` if the mutation uses variables
+    """
+    if definitions:
+        return Operation(MUTATION_VARIABLES.format(variables=definitions, mutation=mutation), variables)
+    return MUTATION.format(mutation=mutation)
+
+
 def format_sequence_link_mutation(mutations: list):
     """Create a mutation link sequence  to send to the Contributor Environment.
     Arguments:
@@ -73,7 +162,7 @@ def create_alias_link_mutation(mutationalias: str, mutationname: str, identifier
     Returns:
         A mutation string
     """
-    return LINK_MUTATION_ALIAS_TEMPLATE.format(mutationalias=mutationalias, mutationname=mutationname, identifier_1=identifier_1, identifier_2=identifier_2)
+    return _compile_alias_link_mutation(mutationname).format(mutationalias, identifier_1, identifier_2)
 
 
 def format_sequence_mutation(mutations: list):
@@ -92,6 +181,46 @@ def format_sequence_mutation(mutations: list):
     return MUTATION.format(mutation="\n".join(formatted_mutations))
 
 
+def format_sequence_mutation_chunks(mutations: list, max_aliases: int = None, max_bytes: int = None):
+    """Create a mutation sequence to send to the Contributor Environment, split into as many mutation
+    documents as needed so that no document has more than `max_aliases` mutations or is larger than `max_bytes`.
+    A single mutation larger than `max_bytes` is put in a document of its own.
+    Arguments:
+        mutations: a list of mutations [(mutationalias, mutationname, args),...]. If args is a dictionary it
+          contains the field: value pairs of the mutation, otherwise it is a pair of identifiers to link
+        max_aliases: the maximum number of mutations in each document, or None for no limit
+        max_bytes: the maximum size of each document in bytes, or None for no limit
+    Returns:
+        A list of formatted mutation sequences, in the same order as the input mutations
+    """
+    overhead = len(MUTATION.format(mutation=""))
+    chunks = []
+    current = []
+    size = overhead
+    for mutationalias, mutationname, args in mutations:
+        if isinstance(args, dict):
+            formatted_mutation = create_alias_mutation(mutationalias=mutationalias, mutationname=mutationname,
+                                                       args=args)
+        else:
+            identifier_1, identifier_2 = args
+            formatted_mutation = create_alias_link_mutation(mutationalias=mutationalias,
+                                                            mutationname=mutationname,
+                                                            identifier_1=identifier_1, identifier_2=identifier_2)
+        # Include the newline that joins this mutation to the previous one
+        mutation_size = len(formatted_mutation.encode("utf-8")) + 1
+        if current and ((max_aliases and len(current) >= max_aliases) or
+                        (max_bytes and size + mutation_size > max_bytes)):
+            chunks.append(MUTATION.format(mutation="\n".join(current)))
+            current = []
+            size = overhead
+        current.append(formatted_mutation)
+        size += mutation_size
+    if current:
+        chunks.append(MUTATION.format(mutation="\n".join(current)))
+
+    return chunks
+
+
 def create_alias_mutation(mutationalias: str, mutationname: str, args: Dict[str, Any]):
     """Create a mutation alias to send to the Contributor Environment.
     Arguments:
@@ -101,7 +230,8 @@ def create_alias_mutation(mutationalias: str, mutationname: str, args: Dict[str,
     Returns:
         A mutation string
     """
-    return MUTATION_ALIAS_TEMPLATE.format(mutationalias=mutationalias, mutationname=mutationname, parameters=make_parameters(**args))
+    compiled = _compile_alias_mutation(mutationname, tuple(args))
+    return compiled.format(mutationalias, *[encode_value(v) for v in args.values()])
 
 
 def format_alias_mutation(mutationalias: str, mutationname: str, args: Dict[str, Any]):
@@ -126,8 +256,11 @@ def format_mutation(mutationname: str, args: Dict[str, Any]):
         A formatted mutation
     """
 
-    formatted_mutation = MUTATION_TEMPLATE.format(mutationname=mutationname, parameters=make_parameters(**args))
-    return MUTATION.format(mutation=formatted_mutation)
+    if not _use_variables.get():
+        return render_mutation(_mutation_template(mutationname), args)
+    parameters, definitions, variables = make_arguments(args)
+    formatted_mutation = MUTATION_TEMPLATE.format(mutationname=mutationname, parameters=parameters)
+    return format_mutation_document(formatted_mutation, definitions, variables)
 
 
 def format_link_mutation(mutationname: str, identifier_1: str, identifier_2: str):
@@ -139,8 +272,12 @@ def format_link_mutation(mutationname: str, identifier_1: str, identifier_2: str
     Returns:
         A formatted mutation
     """
-    return MUTATION.format(mutation=LINK_MUTATION_TEMPLATE.format(mutationname=mutationname, identifier_1=identifier_1,
-                                                                  identifier_2=identifier_2))
+    if _use_variables.get():
+        return format_mutation_document(LINK_MUTATION_VARIABLES_TEMPLATE.format(mutationname=mutationname),
+                                        "$identifier_1: ID!, $identifier_2: ID!",
+                                        {"identifier_1": identifier_1, "identifier_2": identifier_2})
+    link_mutation = LINK_MUTATION_TEMPLATE.replace("{mutationname}", mutationname)
+    return _compile_link_mutation(link_mutation).format(identifier_1, identifier_2)
 
 
 def mutation_create(args, mutation_string: str):
@@ -153,8 +290,11 @@ def mutation_create(args, mutation_string: str):
         Assertion error if the input language is not one of the supported languages.
     """
 
-    create_mutation = mutation_string.format(parameters=make_parameters(**args))
-    return MUTATION.format(mutation=create_mutation)
+    if not _use_variables.get():
+        return render_mutation(mutation_string, args)
+    parameters, definitions, variables = make_arguments(args)
+    create_mutation = mutation_string.format(parameters=parameters)
+    return format_mutation_document(create_mutation, definitions, variables)
 
 
 def mutation_update(args, mutation_string: str):
@@ -167,8 +307,11 @@ def mutation_update(args, mutation_string: str):
         Assertion error if the input language is not one of the supported languages.
     """
 
-    create_mutation = mutation_string.format(parameters=make_parameters(**args))
-    return MUTATION.format(mutation=create_mutation)
+    if not _use_variables.get():
+        return render_mutation(mutation_string, args)
+    parameters, definitions, variables = make_arguments(args)
+    create_mutation = mutation_string.format(parameters=parameters)
+    return format_mutation_document(create_mutation, definitions, variables)
 
 
 def mutation_delete(identifier: str, mutation_string: str):
@@ -183,8 +326,11 @@ def mutation_delete(identifier: str, mutation_string: str):
 
     args = {"identifier": identifier}
 
-    delete_mutation = mutation_string.format(parameters=make_parameters(**args))
-    return MUTATION.format(mutation=delete_mutation)
+    if not _use_variables.get():
+        return render_mutation(mutation_string, args)
+    parameters, definitions, variables = make_arguments(args)
+    delete_mutation = mutation_string.format(parameters=parameters)
+    return format_mutation_document(delete_mutation, definitions, variables)
 
 
 def mutation_link(identifier_1: str, identifier_2: str, mutation_string: str):
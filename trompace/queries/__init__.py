@@ -1,4 +1,14 @@
+from trompace import lazy_submodules
+
+__getattr__ = lazy_submodules(__name__, [
+    "annotation", "application", "audioobject", "controlaction", "itemlist", "mediaobject", "musiccomposition",
+    "musicplaylist", "musicrecording", "person", "place", "templates"])
+
 
 QUERY = '''query {{
   {query}
 }}'''
+
+QUERY_VARIABLES = '''query({variables}) {{
+  {query}
+}}'''
@@ -3,8 +3,8 @@
 # To be added EntryPoint, ControlAction, PropertyValueSpecification and Property
 from typing import Dict, Any, Union
 
-from trompace.queries import QUERY
-from trompace import make_parameters, make_select_query
+from trompace.queries import QUERY, QUERY_VARIABLES
+from trompace import make_arguments, make_select_query, Operation, StringConstant
 
 QUERY_TEMPLATE = '''{queryname}{parameters}
 {{
@@ -32,11 +32,26 @@ itemListElement{{
     identifier
     position
     nextItem{{identifier}}
+    item{{identifier}}
     }}
 }}
 }}'''
 
 
+def format_query_document(query: str, definitions: str = "", variables: dict = None):
+    """Wrap a query in a GraphQL document.
+    Arguments:
+        query: the formatted query
+        definitions: the definitions of the variables used by the query, see :func:`trompace.make_arguments`
+        variables: the values of the variables used by the query
+    Returns:
+        A formatted query, or an :class:`trompace.Operation` if the query uses variables
+    """
+    if definitions:
+        return Operation(QUERY_VARIABLES.format(variables=definitions, query=query), variables)
+    return QUERY.format(query=query)
+
+
 def format_query(queryname: str, args: Dict[str, Any], return_items: Union[list, str]):
     """Create a query to send to the Contributor Environment.
     Arguments:
@@ -47,14 +62,39 @@ def format_query(queryname: str, args: Dict[str, Any], return_items: Union[list,
         A formatted query
     """
 
-    parameters = ""
+    parameters, definitions, variables = "", "", {}
     if args:
-        parameters = "({})".format(make_parameters(**args))
+        parameters, definitions, variables = make_arguments(args)
+        parameters = "({})".format(parameters)
     if isinstance(return_items, list):
         return_items = make_select_query(return_items)
     formatted_query = QUERY_TEMPLATE.format(queryname=queryname, parameters=parameters,
                                             return_items=return_items)
-    return QUERY.format(query=formatted_query)
+    return format_query_document(formatted_query, definitions, variables)
+
+
+def format_page_query(queryname: str, filter: Dict[str, Any], return_items: Union[list, str], first: int,
+                      offset: int = 0, order_by: str = None):
+    """Create a query for one page of the results of a query.
+    Arguments:
+        queryname: the name of the query to generate
+        filter: a dictionary of filter: value pairs to select the results, e.g. ``{"name_contains": "Bach"}``
+        return_items: A list of items for the query to return, or a formatted string of graphql.
+        first: the maximum number of results to return
+        offset: the number of results to skip
+        order_by: the order of the results, e.g. ``identifier_asc``
+    Returns:
+        A formatted query
+    """
+    args = {}
+    if filter:
+        args["filter"] = filter
+    if order_by:
+        args["orderBy"] = StringConstant(order_by)
+    args["first"] = first
+    if offset:
+        args["offset"] = offset
+    return format_query(queryname, args, return_items)
 
 
 def format_filter_query(queryname: str, args: Dict[str, Any], return_items_list: list):
@@ -67,12 +107,12 @@ def format_filter_query(queryname: str, args: Dict[str, Any], return_items_list:
         A formatted query
     """
 
-    parameters = ""
+    parameters, definitions, variables = "", "", {}
     if args:
-        parameters = make_parameters(**args)
+        parameters, definitions, variables = make_arguments(args)
     formatted_query = QUERY_FILTER_TEMPLATE.format(queryname=queryname, parameters=parameters,
                                                    return_items="\n".join(return_items_list))
-    return QUERY.format(query=formatted_query)
+    return format_query_document(formatted_query, definitions, variables)
 
 
 def format_itemlist_query(queryname: str, args: Dict[str, Any]):
@@ -85,8 +125,8 @@ def format_itemlist_query(queryname: str, args: Dict[str, Any]):
         A formatted query
     """
 
-    parameters = ""
+    parameters, definitions, variables = "", "", {}
     if args:
-        parameters = make_parameters(**args)
+        parameters, definitions, variables = make_arguments(args)
     formatted_query = QUERY_ITEMLIST_TEMPLATE.format(queryname=queryname, parameters=parameters)
-    return QUERY.format(query=formatted_query)
+    return format_query_document(formatted_query, definitions, variables)
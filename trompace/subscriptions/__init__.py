@@ -1,5 +1,7 @@
 import json
 
+_encoder = json.JSONEncoder()
+
 
 class StringConstant:
     """Some values in GraphQL are constants, not strings, and so they shouldn't
@@ -36,7 +38,6 @@ def BoolConstant(in_bool: bool):
 def make_parameters(**kwargs):
     """Convert mutation query parameters from dictionary to string format.
     """
-    encoder = json.JSONEncoder()
     parts = []
     for k, v in kwargs.items():
         if isinstance(v, StringConstant):
@@ -44,7 +45,7 @@ def make_parameters(**kwargs):
         elif isinstance(v, ListConstant):
             value = v.values
         else:
-            value = encoder.encode(v)
+            value = _encoder.encode(v)
         parts.append("{}: {}".format(k, value))
     return "\n        ".join(parts)
 
@@ -0,0 +1,5 @@
+"""Tools for testing code that uses trompace without a Contributor Environment"""
+
+from trompace.testing.fakece import FakeCE
+
+__all__ = ["FakeCE"]
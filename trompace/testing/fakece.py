@@ -0,0 +1,743 @@
+"""An in-process stand-in for the Contributor Environment.
+
+:class:`FakeCE` runs an aiohttp server in a background thread and stores nodes in memory. It
+understands the GraphQL that trompace generates:
+
+ * ``CreateX``, ``UpdateX``, ``DeleteX`` and ``MergeX`` mutations for any node type
+ * ``MergeX``, ``AddX`` and ``RemoveX`` mutations with ``from`` and ``to`` arguments, which
+   add or remove a relation
+ * ``RequestControlAction``
+ * queries for any node type, or for ``ThingInterface`` to match all nodes, with arguments,
+   ``filter``, ``first``, ``offset`` and ``orderBy``
+ * variables and automatic persisted queries
+
+It also serves ``/jwt``, graphql-ws subscriptions at ``/graphql`` and the JSON-LD representation
+of nodes at ``/<identifier>``. Latency and errors can be injected into each request so that the
+transport and batching code can be load tested on a single machine::
+
+    with FakeCE(latency=(0.01, 0.05), error_rate=0.01) as ce:
+        config.host = ce.url
+        config.websocket_host = ce.websocket_url
+        ...
+
+This is not a validating GraphQL server: there is no schema, unknown fields are returned as null
+and all arguments of a ``CreateX`` mutation are stored as properties of the new node.
+
+To run a server from the command line::
+
+    python -m trompace.testing.fakece --port 4000 --latency 0.01
+"""
+import argparse
+import asyncio
+import datetime
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+
+import jwt
+from aiohttp import web, WSMsgType
+from graphql import parse, GraphQLError
+from graphql.language import FieldNode, InlineFragmentNode, FragmentSpreadNode, OperationDefinitionNode, \
+    FragmentDefinitionNode
+from graphql.utilities import value_from_ast_untyped
+
+import trompace
+
+# Relations that hold a single node. All other relations are lists
+SINGLE_RELATIONS = frozenset({"nextItem", "item"})
+
+# Interfaces that can appear in relation mutation names in place of the type of the `from` node,
+# e.g. AddActionInterfaceResult
+INTERFACES = ("ThingInterface", "ActionInterface", "CreativeWorkInterface", "MediaObjectInterface")
+
+# Suffixes of filter keys, longest first so that _not_in is matched before _in
+FILTER_OPERATORS = {
+    "_not_starts_with": lambda a, e: a is not None and not str(a).startswith(e),
+    "_not_ends_with": lambda a, e: a is not None and not str(a).endswith(e),
+    "_not_contains": lambda a, e: a is not None and e not in a,
+    "_starts_with": lambda a, e: a is not None and str(a).startswith(e),
+    "_ends_with": lambda a, e: a is not None and str(a).endswith(e),
+    "_contains": lambda a, e: a is not None and e in a,
+    "_not_in": lambda a, e: a not in _as_list(e),
+    "_not": lambda a, e: a != e,
+    "_in": lambda a, e: a in _as_list(e),
+    "_gte": lambda a, e: a is not None and a >= e,
+    "_gt": lambda a, e: a is not None and a > e,
+    "_lte": lambda a, e: a is not None and a <= e,
+    "_lt": lambda a, e: a is not None and a < e,
+}
+
+PAGINATION_ARGUMENTS = ("filter", "first", "offset", "orderBy")
+
+
+def _as_list(value):
+    if isinstance(value, list):
+        return [_comparable(v) for v in value]
+    return [_comparable(value)]
+
+
+def _comparable(value):
+    """DateTime values are stored as {"formatted": ...}, compare them on the formatted string"""
+    if isinstance(value, dict) and "formatted" in value:
+        return value["formatted"]
+    return value
+
+
+def _now():
+    return {"formatted": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="milliseconds")}
+
+
+class _ExecutionError(Exception):
+    pass
+
+
+class _Node:
+    __slots__ = ("typename", "properties", "relations")
+
+    def __init__(self, typename, properties):
+        self.typename = typename
+        self.properties = properties
+        self.relations = {}
+
+    @property
+    def identifier(self):
+        return self.properties["identifier"]
+
+
+class _Subscription:
+    __slots__ = ("websocket", "id", "field", "arguments", "fragments")
+
+    def __init__(self, websocket, id, field, arguments, fragments):
+        self.websocket = websocket
+        self.id = id
+        self.field = field
+        self.arguments = arguments
+        self.fragments = fragments
+
+
+class FakeCE:
+    """An in-memory Contributor Environment
+    Arguments:
+        latency: seconds to wait before answering each request, or a tuple (min, max) to wait a
+                 random time in this range
+        error_rate: the fraction of requests that fail with `error_status` instead of being answered
+        error_status: the HTTP status of injected errors
+        persisted_queries: if False, reply to persisted queries with PersistedQueryNotSupported
+        require_auth: if True, mutations need an Authorization header with a token issued by /jwt
+        token_lifetime: the number of seconds that tokens issued by /jwt are valid for
+        seed: seed for the random number generator used for latency and errors
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, error_status=503, persisted_queries=True,
+                 require_auth=False, token_lifetime=3600, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.persisted_queries = persisted_queries
+        self.require_auth = require_auth
+        self.token_lifetime = token_lifetime
+        self.jwt_secret = "trompace-fakece-token-signing-secret"
+        self.random = random.Random(seed)
+
+        self._lock = threading.RLock()
+        self._nodes = {}
+        self._documents = {}
+        self._subscriptions = []
+        self._fail_next = []
+        self.stats = {}
+        self.reset_stats()
+
+        self._loop = None
+        self._thread = None
+        self._runner = None
+        self._port = None
+
+    # Server lifecycle
+
+    @property
+    def url(self):
+        """The URL to use as ``config.host``"""
+        return f"http://{self._host}:{self._port}/"
+
+    @property
+    def websocket_url(self):
+        """The URL to use as ``config.websocket_host``"""
+        return f"ws://{self._host}:{self._port}/graphql"
+
+    def start(self, host="127.0.0.1", port=0):
+        """Start the server in a background thread. If `port` is 0 a free port is chosen, see :attr:`url`"""
+        if self._thread is not None:
+            raise RuntimeError("FakeCE is already running")
+        self._host = host
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="FakeCE", daemon=True)
+        self._thread.start()
+        future = asyncio.run_coroutine_threadsafe(self._start_site(host, port), self._loop)
+        self._port = future.result()
+        trompace.logger.debug(f"FakeCE listening on {self.url}")
+        return self
+
+    def stop(self):
+        """Stop the server and wait for the background thread to finish"""
+        if self._thread is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._thread = None
+        self._loop = None
+
+    def __enter__(self):
+        if self._thread is None:
+            self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    async def _start_site(self, host, port):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/", self._handle_graphql)
+        app.router.add_post("/graphql", self._handle_graphql)
+        app.router.add_get("/graphql", self._handle_websocket)
+        app.router.add_post("/jwt", self._handle_jwt)
+        app.router.add_get("/{identifier}", self._handle_jsonld)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        return self._runner.addresses[0][1]
+
+    # Data
+
+    def add_node(self, typename, identifier=None, **properties):
+        """Add a node to the store without going through GraphQL
+        Returns:
+            the identifier of the node
+        """
+        with self._lock:
+            try:
+                return self._create(typename, dict(properties, identifier=identifier)).identifier
+            except _ExecutionError as e:
+                raise ValueError(str(e))
+
+    def add_relation(self, from_identifier, field, to_identifier):
+        """Add a relation `field` from one node to another"""
+        with self._lock:
+            self._relate(self._nodes[from_identifier], field, self._nodes[to_identifier])
+
+    def get_node(self, identifier):
+        """The properties of a node, including its `__typename` and the identifiers of related nodes,
+        or None if there is no node with this identifier"""
+        with self._lock:
+            node = self._nodes.get(identifier)
+            if node is None:
+                return None
+            data = dict(node.properties, __typename=node.typename)
+            for field, related in node.relations.items():
+                data[field] = (related[0] if related else None) if field in SINGLE_RELATIONS else list(related)
+            return data
+
+    def nodes(self, typename=None):
+        """The identifiers of all nodes, or of all nodes of type `typename`"""
+        with self._lock:
+            return [n.identifier for n in self._nodes.values() if typename is None or n.typename == typename]
+
+    def reset(self):
+        """Remove all nodes and persisted queries"""
+        with self._lock:
+            self._nodes.clear()
+            self._documents.clear()
+
+    def reset_stats(self):
+        self.stats = {"requests": 0, "queries": 0, "mutations": 0, "in_flight": 0, "max_in_flight": 0,
+                      "injected_errors": 0}
+
+    def fail_next(self, count=1, status=None):
+        """Fail the next `count` requests with HTTP status `status` (default `error_status`)"""
+        self._fail_next.extend([status or self.error_status] * count)
+
+    # Injected latency and errors
+
+    async def _inject(self):
+        """Wait for the injected latency, then return an error response if this request should fail"""
+        latency = self.latency
+        if isinstance(latency, (tuple, list)):
+            latency = self.random.uniform(*latency)
+        if latency:
+            await asyncio.sleep(latency)
+        status = None
+        if self._fail_next:
+            status = self._fail_next.pop(0)
+        elif self.error_rate and self.random.random() < self.error_rate:
+            status = self.error_status
+        if status is not None:
+            self.stats["injected_errors"] += 1
+            return web.json_response({"errors": [{"message": "Injected error"}]}, status=status)
+        return None
+
+    async def _counted(self, request, handler):
+        self.stats["requests"] += 1
+        self.stats["in_flight"] += 1
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+        try:
+            error = await self._inject()
+            if error is not None:
+                return error
+            return await handler(request)
+        finally:
+            self.stats["in_flight"] -= 1
+
+    # HTTP handlers
+
+    async def _handle_graphql(self, request):
+        return await self._counted(request, self._graphql)
+
+    async def _graphql(self, request):
+        try:
+            body = await request.json()
+        except ValueError:
+            return web.json_response({"errors": [{"message": "POST body must be JSON"}]}, status=400)
+
+        query = body.get("query")
+        persisted = (body.get("extensions") or {}).get("persistedQuery")
+        if persisted:
+            if not self.persisted_queries:
+                return web.json_response({"errors": [{"message": "PersistedQueryNotSupported",
+                                                      "extensions": {"code": "PERSISTED_QUERY_NOT_SUPPORTED"}}]})
+            query_hash = persisted.get("sha256Hash")
+            if query is None:
+                query = self._documents.get(query_hash)
+                if query is None:
+                    return web.json_response({"errors": [{"message": "PersistedQueryNotFound",
+                                                          "extensions": {"code": "PERSISTED_QUERY_NOT_FOUND"}}]})
+            elif hashlib.sha256(query.encode("utf-8")).hexdigest() != query_hash:
+                return web.json_response({"errors": [{"message": "provided sha does not match query"}]}, status=400)
+            else:
+                self._documents[query_hash] = query
+        if not query:
+            return web.json_response({"errors": [{"message": "Must provide query string."}]}, status=400)
+
+        token = None
+        authorization = request.headers.get("Authorization", "")
+        if authorization.startswith("Bearer "):
+            token = authorization[len("Bearer "):]
+        try:
+            document = parse(query)
+        except GraphQLError as e:
+            return web.json_response({"errors": [{"message": e.message}]}, status=400)
+        result = self._execute(document, body.get("variables"), body.get("operationName"), token)
+        return web.json_response(result)
+
+    async def _handle_jwt(self, request):
+        return await self._counted(request, self._jwt)
+
+    async def _jwt(self, request):
+        body = await request.json()
+        if not body.get("id") or not body.get("apiKey"):
+            return web.json_response({"success": False, "message": "id and apiKey are required"})
+        now = int(time.time())
+        claims = {"id": body["id"], "scopes": body.get("scopes") or [], "iat": now, "exp": now + self.token_lifetime}
+        token = jwt.encode(claims, self.jwt_secret, algorithm="HS256")
+        # PyJWT < 2 returns bytes
+        if isinstance(token, bytes):
+            token = token.decode("ascii")
+        return web.json_response({"success": True, "jwt": token})
+
+    async def _handle_jsonld(self, request):
+        return await self._counted(request, self._jsonld)
+
+    async def _jsonld(self, request):
+        node = self.get_node(request.match_info["identifier"])
+        if node is None:
+            raise web.HTTPNotFound()
+        typename = node.pop("__typename")
+        data = {"@context": "https://schema.org", "@id": self.url + node["identifier"], "@type": typename}
+        data.update(node)
+        return web.json_response(data, content_type="application/ld+json")
+
+    async def _handle_websocket(self, request):
+        websocket = web.WebSocketResponse(protocols=("graphql-ws",))
+        await websocket.prepare(request)
+        try:
+            async for message in websocket:
+                if message.type != WSMsgType.TEXT:
+                    continue
+                message = json.loads(message.data)
+                message_type = message.get("type")
+                if message_type == "connection_init":
+                    await self._send(websocket, {"type": "connection_ack"})
+                elif message_type == "start":
+                    await self._subscribe(websocket, message.get("id"), message.get("payload") or {})
+                elif message_type == "stop":
+                    with self._lock:
+                        self._subscriptions = [s for s in self._subscriptions
+                                               if not (s.websocket is websocket and s.id == message.get("id"))]
+                elif message_type == "connection_terminate":
+                    break
+        finally:
+            with self._lock:
+                self._subscriptions = [s for s in self._subscriptions if s.websocket is not websocket]
+        return websocket
+
+    async def _send(self, websocket, message):
+        # Compact separators, the same as the reference server
+        await websocket.send_str(json.dumps(message, separators=(",", ":")))
+
+    async def _subscribe(self, websocket, id, payload):
+        try:
+            document = parse(payload.get("query", ""))
+            operation, fragments, variables = self._operation(document, payload.get("variables"),
+                                                              payload.get("operationName"))
+            if operation.operation.value != "subscription":
+                raise _ExecutionError("Only subscriptions are supported over websockets")
+        except (GraphQLError, _ExecutionError) as e:
+            await self._send(websocket, {"type": "error", "id": id, "payload": {"message": str(e)}})
+            return
+        with self._lock:
+            for field in operation.selection_set.selections:
+                arguments = self._arguments(field, variables)
+                self._subscriptions.append(_Subscription(websocket, id, field, arguments, (fragments, variables)))
+
+    def _publish(self, events):
+        """Send subscription data for events [(subscription name, node, arguments to match)]"""
+        messages = []
+        for name, node, keys in events:
+            for subscription in self._subscriptions:
+                if subscription.field.name.value != name:
+                    continue
+                if any(keys.get(k) != v for k, v in subscription.arguments.items()):
+                    continue
+                fragments, variables = subscription.fragments
+                alias = subscription.field.alias.value if subscription.field.alias else name
+                data = {alias: self._project(node, subscription.field.selection_set, fragments, variables)}
+                messages.append((subscription.websocket, {"type": "data", "id": subscription.id,
+                                                          "payload": {"data": data}}))
+        if messages and self._loop is not None:
+            for websocket, message in messages:
+                asyncio.run_coroutine_threadsafe(self._send(websocket, message), self._loop)
+
+    # GraphQL execution
+
+    def execute(self, query, variables=None, operation_name=None):
+        """Run a GraphQL document against the store without going through HTTP
+        Returns:
+            the response, a dictionary with "data" and optionally "errors"
+        """
+        return self._execute(parse(query), variables, operation_name, token=None, authorized=True)
+
+    def _execute(self, document, variables, operation_name, token, authorized=False):
+        try:
+            operation, fragments, variables = self._operation(document, variables, operation_name)
+        except _ExecutionError as e:
+            return {"errors": [{"message": str(e)}]}
+
+        operation_type = operation.operation.value
+        if operation_type == "subscription":
+            return {"errors": [{"message": "Subscriptions are only supported over websockets"}]}
+        if operation_type == "mutation" and self.require_auth and not authorized and not self._valid_token(token):
+            return {"errors": [{"message": "Not Authorised!"}]}
+        self.stats["mutations" if operation_type == "mutation" else "queries"] += 1
+
+        data = {}
+        errors = []
+        events = []
+        with self._lock:
+            for field in self._fields(operation.selection_set, None, fragments):
+                alias = field.alias.value if field.alias else field.name.value
+                try:
+                    if operation_type == "mutation":
+                        value = self._mutate(field, fragments, variables, events)
+                    else:
+                        value = self._query(field, fragments, variables)
+                except _ExecutionError as e:
+                    errors.append({"message": str(e), "path": [alias]})
+                    value = None
+                data[alias] = value
+            self._publish(events)
+        result = {"data": data}
+        if errors:
+            result["errors"] = errors
+        return result
+
+    def _valid_token(self, token):
+        if not token:
+            return False
+        try:
+            jwt.decode(token, self.jwt_secret, algorithms=["HS256"])
+        except jwt.InvalidTokenError:
+            return False
+        return True
+
+    def _operation(self, document, variables, operation_name):
+        operations = [d for d in document.definitions if isinstance(d, OperationDefinitionNode)]
+        fragments = {d.name.value: d for d in document.definitions if isinstance(d, FragmentDefinitionNode)}
+        if operation_name:
+            operations = [o for o in operations if o.name and o.name.value == operation_name]
+        if len(operations) != 1:
+            raise _ExecutionError("Document must contain exactly one operation, or set operationName")
+        operation = operations[0]
+        variables = dict(variables or {})
+        for definition in operation.variable_definitions or []:
+            name = definition.variable.name.value
+            if name not in variables and definition.default_value is not None:
+                variables[name] = value_from_ast_untyped(definition.default_value)
+        return operation, fragments, variables
+
+    def _arguments(self, field, variables):
+        return {a.name.value: value_from_ast_untyped(a.value, variables) for a in field.arguments or []}
+
+    def _fields(self, selection_set, typename, fragments):
+        """The fields of a selection set that apply to a node of type `typename`, expanding fragments"""
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                yield selection
+                continue
+            if isinstance(selection, InlineFragmentNode):
+                fragment = selection
+            elif isinstance(selection, FragmentSpreadNode):
+                fragment = fragments[selection.name.value]
+            else:
+                continue
+            condition = fragment.type_condition.name.value if fragment.type_condition else None
+            if condition is None or typename is None or condition == typename or condition in INTERFACES:
+                yield from self._fields(fragment.selection_set, typename, fragments)
+
+    def _project(self, node, selection_set, fragments, variables):
+        """Select the fields in `selection_set` from a node"""
+        if node is None:
+            return None
+        if selection_set is None:
+            return {"identifier": node.identifier}
+        result = {}
+        for field in self._fields(selection_set, node.typename, fragments):
+            name = field.name.value
+            alias = field.alias.value if field.alias else name
+            if name == "__typename":
+                result[alias] = node.typename
+            elif name in node.relations or (field.selection_set is not None and name not in node.properties):
+                related = [self._nodes[i] for i in node.relations.get(name, []) if i in self._nodes]
+                if name in SINGLE_RELATIONS:
+                    result[alias] = self._project(related[0] if related else None, field.selection_set,
+                                                  fragments, variables)
+                else:
+                    related = self._select(related, self._arguments(field, variables))
+                    result[alias] = [self._project(n, field.selection_set, fragments, variables) for n in related]
+            else:
+                value = node.properties.get(name)
+                if isinstance(value, dict) and field.selection_set is not None:
+                    value = {f.name.value: value.get(f.name.value) for f in field.selection_set.selections}
+                result[alias] = value
+        return result
+
+    def _query(self, field, fragments, variables):
+        typename = field.name.value
+        if typename.startswith("__"):
+            raise _ExecutionError("Introspection is not supported")
+        nodes = [n for n in self._nodes.values() if typename == "ThingInterface" or n.typename == typename]
+        nodes = self._select(nodes, self._arguments(field, variables))
+        return [self._project(n, field.selection_set, fragments, variables) for n in nodes]
+
+    def _select(self, nodes, arguments):
+        """Filter, order and paginate nodes with the arguments of a query"""
+        equal = {k: v for k, v in arguments.items() if k not in PAGINATION_ARGUMENTS}
+        if equal:
+            nodes = [n for n in nodes if self._matches(n, equal)]
+        if arguments.get("filter"):
+            nodes = [n for n in nodes if self._matches(n, arguments["filter"])]
+        order = arguments.get("orderBy")
+        if order:
+            nodes = list(nodes)
+            for key in reversed(_as_list(order)):
+                field, _, direction = key.rpartition("_")
+
+                def sort_key(n, field=field):
+                    value = _comparable(n.properties.get(field))
+                    return value is None, value if value is not None else 0
+
+                nodes.sort(key=sort_key, reverse=direction == "desc")
+        offset = arguments.get("offset") or 0
+        first = arguments.get("first")
+        if offset or first is not None:
+            nodes = nodes[offset:None if first is None else offset + first]
+        return nodes
+
+    def _matches(self, node, filter):
+        for key, expected in filter.items():
+            if key == "AND":
+                if not all(self._matches(node, f) for f in expected):
+                    return False
+                continue
+            if key == "OR":
+                if not any(self._matches(node, f) for f in expected):
+                    return False
+                continue
+            field, operator = key, None
+            for suffix in FILTER_OPERATORS:
+                if key.endswith(suffix):
+                    field, operator = key[:-len(suffix)], suffix
+                    break
+            if field in node.relations or (isinstance(expected, dict) and "formatted" not in expected
+                                           and field not in node.properties):
+                related = [self._nodes[i] for i in node.relations.get(field, []) if i in self._nodes]
+                if not any(self._matches(n, expected) for n in related):
+                    return False
+                continue
+            actual = _comparable(node.properties.get(field))
+            if operator is None:
+                if actual != _comparable(expected):
+                    return False
+            elif operator in ("_in", "_not_in"):
+                if not FILTER_OPERATORS[operator](actual, expected):
+                    return False
+            elif not FILTER_OPERATORS[operator](actual, _comparable(expected)):
+                return False
+        return True
+
+    # Mutations
+
+    def _create(self, typename, properties):
+        properties = {k: v for k, v in properties.items() if v is not None}
+        properties.setdefault("identifier", str(uuid.uuid4()))
+        if properties["identifier"] in self._nodes:
+            raise _ExecutionError(f"Node with identifier {properties['identifier']} already exists")
+        now = _now()
+        properties.setdefault("created", now)
+        properties.setdefault("modified", now)
+        node = _Node(typename, properties)
+        self._nodes[node.identifier] = node
+        return node
+
+    def _relate(self, from_node, field, to_node):
+        related = from_node.relations.setdefault(field, [])
+        if field in SINGLE_RELATIONS:
+            related[:] = [to_node.identifier]
+        elif to_node.identifier not in related:
+            related.append(to_node.identifier)
+
+    def _relation_field(self, name, prefix, from_node):
+        rest = name[len(prefix):]
+        for typename in (from_node.typename,) + INTERFACES:
+            if rest.startswith(typename) and len(rest) > len(typename):
+                field = rest[len(typename):]
+                return field[0].lower() + field[1:]
+        raise _ExecutionError(f"Cannot find the relation for {name} on {from_node.typename}")
+
+    def _mutate(self, field, fragments, variables, events):
+        name = field.name.value
+        arguments = self._arguments(field, variables)
+
+        if "from" in arguments and "to" in arguments:
+            prefix = next((p for p in ("Merge", "Add", "Remove") if name.startswith(p)), None)
+            if prefix is None:
+                raise _ExecutionError(f"Unknown mutation {name}")
+            from_node = self._nodes.get((arguments["from"] or {}).get("identifier"))
+            to_node = self._nodes.get((arguments["to"] or {}).get("identifier"))
+            # Like the CE, linking nodes that don't exist returns null
+            if from_node is None or to_node is None:
+                return None
+            relation = self._relation_field(name, prefix, from_node)
+            if prefix == "Remove":
+                related = from_node.relations.get(relation, [])
+                if to_node.identifier in related:
+                    related.remove(to_node.identifier)
+            else:
+                self._relate(from_node, relation, to_node)
+            return self._project_link(field, from_node, to_node, fragments, variables)
+
+        if name == "RequestControlAction":
+            return self._request_control_action(field, arguments.get("controlAction") or {}, fragments,
+                                                variables, events)
+
+        for prefix in ("Create", "Update", "Delete", "Merge"):
+            if name.startswith(prefix) and len(name) > len(prefix):
+                typename = name[len(prefix):]
+                break
+        else:
+            raise _ExecutionError(f"Unknown mutation {name}")
+
+        node = self._nodes.get(arguments.get("identifier"))
+        if prefix == "Create" or (prefix == "Merge" and node is None):
+            node = self._create(typename, arguments)
+        elif node is None or node.typename != typename:
+            return None
+        elif prefix == "Delete":
+            result = self._project(node, field.selection_set, fragments, variables)
+            del self._nodes[node.identifier]
+            for other in self._nodes.values():
+                for related in other.relations.values():
+                    if node.identifier in related:
+                        related.remove(node.identifier)
+            return result
+        else:
+            node.properties.update(arguments)
+            node.properties["modified"] = _now()
+            if typename == "ControlAction":
+                events.append(("ControlActionMutation", node, {"identifier": node.identifier}))
+        return self._project(node, field.selection_set, fragments, variables)
+
+    def _project_link(self, field, from_node, to_node, fragments, variables):
+        result = {}
+        for selection in self._fields(field.selection_set, None, fragments) if field.selection_set else []:
+            name = selection.name.value
+            alias = selection.alias.value if selection.alias else name
+            if name in ("from", "to"):
+                node = from_node if name == "from" else to_node
+                result[alias] = self._project(node, selection.selection_set, fragments, variables)
+            elif name == "__typename":
+                result[alias] = "_" + field.name.value + "Payload"
+        return result
+
+    def _request_control_action(self, field, request, fragments, variables, events):
+        template = self._nodes.get(request.get("potentialActionIdentifier"))
+        if template is None:
+            raise _ExecutionError("potentialActionIdentifier does not refer to a ControlAction")
+        properties = {k: v for k, v in template.properties.items() if k not in ("identifier", "created", "modified")}
+        properties["actionStatus"] = "PotentialActionStatus"
+        node = self._create("ControlAction", properties)
+        self._relate(node, "wasDerivedFrom", template)
+        for value in request.get("propertyObject") or []:
+            target = self._nodes.get(value.get("nodeIdentifier"))
+            property_value = self._create("PropertyValue", {"value": value.get("nodeIdentifier"),
+                                                            "valueReference": value.get("nodeType")})
+            if target is not None:
+                self._relate(property_value, "nodeValue", target)
+            self._relate(node, "object", property_value)
+        for value in request.get("propertyValueObject") or []:
+            property_value = self._create("PropertyValue", {"value": value.get("value"),
+                                                            "valueReference": value.get("valuePattern")})
+            self._relate(node, "object", property_value)
+        events.append(("ControlActionRequest", node, {"entryPointIdentifier": request.get("entryPointIdentifier")}))
+        return self._project(node, field.selection_set, fragments, variables)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run an in-memory stand-in for the Contributor Environment")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4000)
+    parser.add_argument("--latency", type=float, nargs="+", default=[0.0],
+                        help="Seconds to wait before answering each request, or a min and max")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503, help="HTTP status of injected errors")
+    parser.add_argument("--require-auth", action="store_true", help="Require a token from /jwt for mutations")
+    args = parser.parse_args(argv)
+
+    latency = args.latency[0] if len(args.latency) == 1 else tuple(args.latency[:2])
+    ce = FakeCE(latency=latency, error_rate=args.error_rate, error_status=args.error_status,
+                require_auth=args.require_auth)
+    ce.start(args.host, args.port)
+    print(f"FakeCE listening on {ce.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ce.stop()
+
+
+if __name__ == '__main__':
+    main()